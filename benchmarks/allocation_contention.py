@@ -0,0 +1,107 @@
+"""Contention benchmark: many concurrent allocators against a single parking lot.
+
+Compares the old two-statement transaction, the single-statement allocation and
+the reservation ledger. Run from the repository root:
+
+    $ python -m benchmarks.allocation_contention --allocators 300
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Dict, List
+
+import asyncpg
+import testing.postgresql
+
+from parking.backend.db.dbaccess import DbAccess
+from parking.backend.db.pool import PoolConfig
+from parking.shared.location import Location
+from parking.shared.rest_models import ParkingLot
+
+# The allocation path as it was before PARKINGLOTS_ALLOCATE: two round trips in a transaction.
+TRANSACTION_INCREMENT = """
+UPDATE ParkingLots
+SET num_allocated = num_allocated + 1
+WHERE id = $1
+ AND num_allocated < num_available
+"""
+TRANSACTION_INSERT = """
+INSERT INTO Allocations (user_id, park_id)
+VALUES ($1, $2)
+"""
+
+
+async def allocate_in_transaction(dba: DbAccess, user_id: str, park_id: int) -> bool:
+    async with dba.pool.acquire() as conn:
+        try:
+            async with conn.transaction():
+                if await conn.execute(TRANSACTION_INCREMENT, park_id) == "UPDATE 0":
+                    return False
+                await conn.execute(TRANSACTION_INSERT, user_id, park_id)
+        except asyncpg.exceptions.UniqueViolationError:
+            return False
+    return True
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+async def run_mode(url: str, mode: str, allocators: int, per_allocator: int, pool_size: int,
+                   block_size: int) -> Dict[str, float]:
+    loop = asyncio.get_event_loop()
+    dba = await DbAccess.create(url, loop, reset_tables=True, pool_config=PoolConfig(pool_size, pool_size),
+                                reservation_block=block_size if mode == 'ledger' else None)
+    total = allocators * per_allocator
+    park_id = await dba.insert_parking_lot(ParkingLot(total, 'contended', 1.0, Location(0.0, 0.0)))
+    latencies: List[float] = []
+    failures = 0
+
+    async def allocator(n: int) -> None:
+        nonlocal failures
+        for i in range(per_allocator):
+            user_id = 'user-{}-{}'.format(n, i)
+            start = time.perf_counter()
+            if mode == 'transaction':
+                ok = await allocate_in_transaction(dba, user_id, park_id)
+            else:
+                ok = await dba.allocate_parking_lot(user_id, park_id)
+            latencies.append(time.perf_counter() - start)
+            failures += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(allocator(n) for n in range(allocators)))
+    elapsed = time.perf_counter() - start
+    await dba.close()
+    return {'allocations': total, 'failures': failures, 'seconds': elapsed,
+            'per_second': total / elapsed, 'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000, 'mean_ms': statistics.mean(latencies) * 1000}
+
+
+async def main(args: argparse.Namespace) -> None:
+    results = {}
+    with testing.postgresql.Postgresql() as postgresql:
+        for mode in args.modes:
+            results[mode] = await run_mode(postgresql.url(), mode, args.allocators, args.per_allocator,
+                                           args.pool_size, args.block_size)
+            r = results[mode]
+            print("{:<12} {:>8.0f} alloc/s  p50 {:>7.2f} ms  p99 {:>7.2f} ms  failures {}".format(
+                mode, r['per_second'], r['p50_ms'], r['p99_ms'], r['failures']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Allocation contention benchmark.')
+    parser.add_argument("--allocators", type=int, default=300, help="Concurrent allocating coroutines")
+    parser.add_argument("--per-allocator", type=int, default=5, help="Allocations made by each allocator")
+    parser.add_argument("--pool-size", type=int, default=20, help="Database connection pool size")
+    parser.add_argument("--block-size", type=int, default=32, help="Slots reserved at a time by the ledger")
+    parser.add_argument("--modes", nargs='+', default=['transaction', 'statement', 'ledger'],
+                        choices=['transaction', 'statement', 'ledger'])
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
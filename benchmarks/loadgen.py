@@ -0,0 +1,289 @@
+"""End-to-end load generator for the REST and WebSocket routes.
+
+Starts the backend against a temporary database, as `--temp-db` does, then
+drives simulated sensors and drivers at a target rate for a fixed duration and
+reports latency percentiles, throughput and errors per route. Run from the
+repository root:
+
+    $ python -m benchmarks.loadgen --duration 30 --sensor-rate 200 --drivers 200 --output results.json
+    $ python -m benchmarks.loadgen --compare before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.websocket import websocket_connect
+
+from parking.shared import ws_codec
+from parking.shared.location import Location
+from parking.shared.rest_models import ParkingLot, ParkingLotAvailableMessage, ParkingLotPriceMessage
+from parking.shared.util import serialize_model
+from parking.shared.ws_models import (LocationUpdateMessage, ParkingAcceptanceMessage, ParkingAllocationMessage,
+                                      ParkingRejectionMessage, ParkingRequestMessage)
+
+HEADERS = {'Content-Type': 'application/json; charset=UTF-8'}
+CENTRE = Location(51.5, -0.12)
+
+
+class RouteStats(object):
+    """Latencies and errors of one route."""
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.errors = 0
+
+    def record(self, start: float) -> None:
+        self.latencies.append(time.perf_counter() - start)
+
+    def summary(self, duration: float) -> Dict[str, float]:
+        latencies = sorted(self.latencies)
+        total = len(latencies) + self.errors
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p / 100.0 * len(latencies)))] * 1000
+
+        return {'count': len(latencies), 'errors': self.errors,
+                'error_rate': self.errors / total if total else 0.0,
+                'throughput': len(latencies) / duration,
+                'p50_ms': percentile(50), 'p95_ms': percentile(95), 'p99_ms': percentile(99)}
+
+
+class LoadGenerator(object):
+    def __init__(self, base_url: str, args: argparse.Namespace) -> None:
+        self.base_url = base_url
+        self.args = args
+        self.routes: Dict[str, RouteStats] = {}
+        self.lot_ids: List[int] = []
+        self.deadline = 0.0
+        AsyncHTTPClient.configure(None, max_clients=args.max_clients)
+        self.http = AsyncHTTPClient()
+
+    def route(self, name: str) -> RouteStats:
+        stats = self.routes.get(name)
+        if stats is None:
+            stats = self.routes[name] = RouteStats()
+        return stats
+
+    def random_location(self) -> Location:
+        spread = self.args.spread
+        return Location(CENTRE.latitude + random.uniform(-spread, spread),
+                        CENTRE.longitude + random.uniform(-spread, spread))
+
+    async def post(self, route: str, path: str, body: str) -> Optional[dict]:
+        stats = self.route(route)
+        start = time.perf_counter()
+        try:
+            response = await self.http.fetch(self.base_url + path, method='POST', headers=HEADERS, body=body)
+        except (HTTPClientError, OSError):
+            stats.errors += 1
+            return None
+        stats.record(start)
+        return json.loads(response.body) if response.body else None
+
+    async def create_lot(self) -> None:
+        lot = ParkingLot(random.randint(10, 500), 'lot', round(random.uniform(0.5, 5.0), 2), self.random_location())
+        response = await self.post('POST /spaces', '/spaces', serialize_model(lot))
+        if response is not None:
+            self.lot_ids.append(response['id'])
+
+    async def sensor_update(self) -> None:
+        lot_id = random.choice(self.lot_ids)
+        if random.random() < self.args.price_ratio:
+            body = serialize_model(ParkingLotPriceMessage(round(random.uniform(0.5, 5.0), 2)))
+            await self.post('POST /spaces/<id>/price', '/spaces/{}/price'.format(lot_id), body)
+        else:
+            body = serialize_model(ParkingLotAvailableMessage(random.randint(0, 500)))
+            await self.post('POST /spaces/<id>/available', '/spaces/{}/available'.format(lot_id), body)
+
+    async def sensors(self) -> None:
+        """Fire sensor updates at a fixed rate, without waiting for earlier ones to finish."""
+        interval = 1.0 / self.args.sensor_rate
+        tasks = set()
+        next_time = time.perf_counter()
+        while next_time < self.deadline:
+            tasks.add(asyncio.ensure_future(self.sensor_update()))
+            tasks = {t for t in tasks if not t.done()}
+            next_time += interval
+            await asyncio.sleep(max(0.0, next_time - time.perf_counter()))
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def driver(self, n: int) -> None:
+        ws_url = self.base_url.replace('http', 'ws', 1) + '/ws/driver-{}'.format(n)
+        subprotocols = [ws_codec.BINARY_SUBPROTOCOL] if self.args.binary else None
+        start = time.perf_counter()
+        try:
+            conn = await websocket_connect(ws_url, subprotocols=subprotocols)
+        except (HTTPClientError, OSError):
+            self.route('WS connect').errors += 1
+            return
+        self.route('WS connect').record(start)
+        binary = conn.selected_subprotocol == ws_codec.BINARY_SUBPROTOCOL
+        requested: Optional[float] = None
+        accepted = False
+
+        async def send(route: str, msg) -> None:
+            stats = self.route(route)
+            start = time.perf_counter()
+            try:
+                await conn.write_message(ws_codec.encode(msg, binary), binary=binary)
+            except Exception:
+                stats.errors += 1
+                return
+            stats.record(start)
+
+        async def read() -> None:
+            nonlocal requested, accepted
+            while True:
+                data = await conn.read_message()
+                if data is None:
+                    return
+                msg = ws_codec.decode(data)
+                if isinstance(msg, ParkingAllocationMessage) and requested is not None:
+                    if msg.lot is None:
+                        # Refused; a later round may still find a lot.
+                        self.route('WS parking request -> allocation').errors += 1
+                        requested = None
+                        continue
+                    self.route('WS parking request -> allocation').record(requested)
+                    requested = None
+                    if random.random() < self.args.accept_ratio:
+                        accepted = True
+                        await send('WS acceptance', ParkingAcceptanceMessage(msg.lot.id))
+                    else:
+                        await send('WS rejection', ParkingRejectionMessage(msg.lot.id))
+
+        reader = asyncio.ensure_future(read())
+        interval = 1.0 / self.args.driver_rate
+        location = self.random_location()
+        # Stagger the drivers so that their updates do not arrive in lockstep.
+        await asyncio.sleep(random.uniform(0, interval))
+        while time.perf_counter() < self.deadline:
+            location = Location(location.latitude + random.gauss(0, 0.0002),
+                                location.longitude + random.gauss(0, 0.0002))
+            await send('WS location update', LocationUpdateMessage(location))
+            if requested is None and not accepted and random.random() < self.args.request_ratio:
+                requested = time.perf_counter()
+                await send('WS parking request', ParkingRequestMessage(location))
+            await asyncio.sleep(interval)
+        if requested is not None:
+            self.route('WS parking request -> allocation').errors += 1
+        conn.close()
+        await reader
+
+    async def run(self) -> Dict[str, Dict[str, float]]:
+        await asyncio.gather(*(self.create_lot() for _ in range(self.args.lots)))
+        if not self.lot_ids:
+            raise RuntimeError('Could not create any parking lots')
+        start = time.perf_counter()
+        self.deadline = start + self.args.duration
+        jobs = [self.driver(n) for n in range(self.args.drivers)]
+        if self.args.sensor_rate > 0:
+            jobs.append(self.sensors())
+        await asyncio.gather(*jobs)
+        duration = time.perf_counter() - start
+        return {name: stats.summary(duration) for name, stats in sorted(self.routes.items())}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('The backend exited with status {}'.format(process.returncode))
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1.0):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('The backend did not start listening within {} seconds'.format(timeout))
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: Dict[str, Dict[str, float]]) -> None:
+    print("{:<36} {:>8} {:>7} {:>10} {:>9} {:>9} {:>9}".format(
+        'route', 'count', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name, r in results.items():
+        print("{:<36} {:>8} {:>7} {:>10.1f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+            name, r['count'], r['errors'], r['throughput'], r['p50_ms'], r['p95_ms'], r['p99_ms']))
+
+
+def compare(before_path: str, after_path: str) -> None:
+    """Print the relative change of throughput and latency of each route between two result files."""
+    with open(before_path) as f:
+        before = json.load(f)['routes']
+    with open(after_path) as f:
+        after = json.load(f)['routes']
+    print("{:<36} {:>10} {:>9} {:>9} {:>9}".format('route', 'req/s', 'p50', 'p95', 'p99'))
+    for name in sorted(set(before) & set(after)):
+        changes = []
+        for key in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms'):
+            old, new = before[name][key], after[name][key]
+            changes.append((new - old) / old * 100 if old else 0.0)
+        print("{:<36} {:>+9.1f}% {:>+8.1f}% {:>+8.1f}% {:>+8.1f}%".format(name, *changes))
+
+
+def main(args: argparse.Namespace) -> None:
+    port = free_port()
+    command = [sys.executable, '-m', 'parking.backend', '--temp-db', '--port', str(port),
+               '--admin-port', str(free_port()), '--workers', str(args.workers)]
+    backend = subprocess.Popen(command, stdout=subprocess.DEVNULL,
+                               stderr=None if args.backend_output else subprocess.DEVNULL)
+    try:
+        wait_for_port(port, backend)
+        generator = LoadGenerator('http://127.0.0.1:{}'.format(port), args)
+        routes = asyncio.get_event_loop().run_until_complete(generator.run())
+    finally:
+        backend.terminate()
+        backend.wait()
+    print_results(routes)
+    if args.output:
+        settings = {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}
+        with open(args.output, 'w') as f:
+            json.dump({'commit': git_commit(), 'time': time.time(), 'settings': settings, 'routes': routes},
+                      f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load generator for the parking backend.')
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to generate load for")
+    parser.add_argument("--workers", type=int, default=1, help="Backend worker processes")
+    parser.add_argument("--lots", type=int, default=100, help="Parking lots created before the run")
+    parser.add_argument("--spread", type=float, default=0.05, help="Half-width in degrees of the simulated area")
+    parser.add_argument("--sensor-rate", type=float, default=100.0, help="Sensor updates per second, in total")
+    parser.add_argument("--price-ratio", type=float, default=0.2, help="Share of sensor updates that are prices")
+    parser.add_argument("--drivers", type=int, default=100, help="Simulated drivers, one WebSocket each")
+    parser.add_argument("--driver-rate", type=float, default=1.0, help="Location updates per second per driver")
+    parser.add_argument("--request-ratio", type=float, default=0.05,
+                        help="Chance that a location update is followed by a parking request")
+    parser.add_argument("--accept-ratio", type=float, default=0.5, help="Chance that a driver accepts a lot")
+    parser.add_argument("--binary", action='store_true', help="Use the binary WebSocket wire format")
+    parser.add_argument("--max-clients", type=int, default=100, help="Concurrent HTTP requests")
+    parser.add_argument("--backend-output", action='store_true', help="Show the backend's log output")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help="Compare two result files instead of running")
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+    else:
+        main(args)
@@ -0,0 +1,72 @@
+"""Model benchmark: messages/sec built with and without validation, and serialized with attr.asdict or serialize_model.
+
+    $ python -m benchmarks.models --count 100000
+"""
+import argparse
+import json
+import time
+from typing import Callable, Dict, Tuple
+
+import attr
+
+from parking.shared.location import Location
+from parking.shared.rest_models import ParkingLot, ParkingLotStatus
+from parking.shared.util import serialize_model, trusted
+from parking.shared.ws_models import LocationUpdateMessage, ParkingAllocationMessage, ParkingLotUpdateMessage
+
+# A function building each message from the same values, given the class to build it with.
+BUILDERS: Dict[str, Callable[[Callable[[type], Callable]], object]] = {
+    'location_update': lambda make: make(LocationUpdateMessage)(make(Location)(51.507351, -0.127758)),
+    'lot_update': lambda make: make(ParkingLotUpdateMessage)(42, 17, 2.5),
+    'parking_allocation': lambda make: make(ParkingAllocationMessage)(make(ParkingLot)(
+        250, 'Central Car Park', 2.5, make(Location)(51.507351, -0.127758), 42)),
+    'lot_status': lambda make: make(ParkingLotStatus)(42, 'Central Car Park', 250, 2.5,
+                                                      make(Location)(51.507351, -0.127758), 17, 233),
+}
+
+
+def rate(function: Callable[[], object], count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        function()
+    return count / (time.perf_counter() - start)
+
+
+def validated(cls: type) -> Callable:
+    return cls
+
+
+def run(count: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, build in BUILDERS.items():
+        msg = build(validated)
+        assert build(trusted) == msg and serialize_model(msg) == json.dumps(attr.asdict(msg))
+        results[name] = {
+            'validated_per_second': rate(lambda: build(validated), count),
+            'trusted_per_second': rate(lambda: build(trusted), count),
+            'asdict_per_second': rate(lambda: json.dumps(attr.asdict(msg)), count),
+            'serialize_per_second': rate(lambda: serialize_model(msg), count),
+        }
+    return results
+
+
+def speedups(r: Dict[str, float]) -> Tuple[float, float]:
+    return r['trusted_per_second'] / r['validated_per_second'], r['serialize_per_second'] / r['asdict_per_second']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Model construction and serialization benchmark.')
+    parser.add_argument("--count", type=int, default=50000, help="Messages built or serialized per measurement")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+    results = run(args.count)
+    print("{:<20} {:>12} {:>12} {:>7} {:>12} {:>12} {:>7}".format(
+        'message', 'valid/s', 'trusted/s', 'x', 'asdict/s', 'serial/s', 'x'))
+    for name, r in results.items():
+        build_speedup, serialize_speedup = speedups(r)
+        print("{:<20} {:>12.0f} {:>12.0f} {:>7.2f} {:>12.0f} {:>12.0f} {:>7.2f}".format(
+            name, r['validated_per_second'], r['trusted_per_second'], build_speedup,
+            r['asdict_per_second'], r['serialize_per_second'], serialize_speedup))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
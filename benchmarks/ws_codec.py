@@ -0,0 +1,63 @@
+"""Codec benchmark: messages/sec and bytes per message of the JSON and binary wire formats.
+
+    $ python -m benchmarks.ws_codec --count 100000
+"""
+import argparse
+import json
+import time
+from typing import Callable, Dict
+
+from parking.shared import ws_codec
+from parking.shared.location import Location
+from parking.shared.rest_models import ParkingLot
+from parking.shared.util import serialize_model
+from parking.shared.ws_models import (LocationUpdateMessage, ParkingAllocationMessage, ParkingRejectionMessage,
+                                      ParkingRequestMessage, deserialize_ws_message)
+
+MESSAGES = {
+    'location_update': LocationUpdateMessage(Location(51.507351, -0.127758)),
+    'parking_request': ParkingRequestMessage(Location(51.507351, -0.127758), {'max_price': 3.5}),
+    'parking_allocation': ParkingAllocationMessage(ParkingLot(250, 'Central Car Park', 2.5,
+                                                              Location(51.507351, -0.127758), 42)),
+    'parking_rejection': ParkingRejectionMessage(42),
+}
+
+
+def rate(function: Callable[[], object], count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        function()
+    return count / (time.perf_counter() - start)
+
+
+def run(count: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, msg in MESSAGES.items():
+        text = serialize_model(msg)
+        data = ws_codec.encode_binary(msg)
+        results[name] = {
+            'json_bytes': len(text.encode()),
+            'binary_bytes': len(data),
+            'json_encode_per_second': rate(lambda: serialize_model(msg), count),
+            'binary_encode_per_second': rate(lambda: ws_codec.encode_binary(msg), count),
+            'json_decode_per_second': rate(lambda: deserialize_ws_message(text), count),
+            'binary_decode_per_second': rate(lambda: ws_codec.decode_binary(data), count),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='WebSocket codec benchmark.')
+    parser.add_argument("--count", type=int, default=50000, help="Messages encoded and decoded per measurement")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+    results = run(args.count)
+    print("{:<20} {:>6} {:>6} {:>12} {:>12} {:>12} {:>12}".format(
+        'message', 'json B', 'bin B', 'json enc/s', 'bin enc/s', 'json dec/s', 'bin dec/s'))
+    for name, r in results.items():
+        print("{:<20} {:>6} {:>6} {:>12.0f} {:>12.0f} {:>12.0f} {:>12.0f}".format(
+            name, r['json_bytes'], r['binary_bytes'], r['json_encode_per_second'], r['binary_encode_per_second'],
+            r['json_decode_per_second'], r['binary_decode_per_second']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -1,28 +1,210 @@
 import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
 from asyncio import AbstractEventLoop
+from typing import Dict, Optional
 
 import testing.postgresql
 import tornado
+import tornado.httpserver
+import tornado.netutil
+import tornado.process
 
+from parking.backend import metrics
+from parking.backend.admin_server.admin import make_admin_app
+from parking.backend.db import tools
 from parking.backend.db.dbaccess import DbAccess
+from parking.backend.db.pool import PoolConfig
+from parking.backend.engine.allocator import AllocationEngine
+from parking.backend.engine.forecast import AvailabilityForecaster
+from parking.backend.engine.lot_index import LotIndex
+from parking.backend.engine.lot_index_sync import LotIndexSync
+from parking.backend.engine.offers import OfferExpiry
+from parking.backend.log_config import configure_logging
+from parking.backend.profiling import LoopLagMonitor
+from parking.backend.sensor_server.lot_search import LotSearch
+from parking.backend.user_server.directory import SessionDirectory
+from parking.backend.user_server.mailbox import LocationMailbox
+from parking.backend.user_server.notifier import LotUpdateNotifier
+from parking.backend.user_server.payload_cache import LotPayloadCache
+from parking.backend.user_server.rate_limit import DEFAULT_RATE_LIMITS
 from parking.backend.user_server.wsserver import UserWSHandler, UserSessions
 from parking.backend.sensor_server.rest_server import (IndividualLotDeleteHandler, IndividualLotAvailableHandler,
-                                                       IndividualLotPriceHandler, ParkingLotsCreationHandler)
+                                                       IndividualLotPriceHandler, ParkingLotsCreationHandler,
+                                                       ParkingLotsBulkUpdateHandler)
+from parking.shared.location import Location
 
+logger = logging.getLogger('backend')
 
-def main(temp_db: bool, db_url: str, reset_tables: bool):
+
+async def load_lot_index(dba: DbAccess) -> LotIndex:
+    """Index every lot, and keep following the lots that other processes add and delete."""
+    lot_index = LotIndex()
+    # Follow first, so that no lot added while loading is missed; inserting one twice is harmless.
+    await LotIndexSync(lot_index, dba).start()
+    for record in await dba.get_parking_lots():
+        lot_index.insert(record['id'], Location(record['lat'], record['long']))
+    return lot_index
+
+
+def prepare_tables(url: str, init_tables: bool, reset_tables: bool) -> None:
+    """Create or reset the tables on a loop of its own, so that it can run before forking workers."""
+    loop = asyncio.new_event_loop()
+    try:
+        dba = loop.run_until_complete(DbAccess.create(url, loop=loop, init_tables=init_tables,
+                                                      reset_tables=reset_tables, cache_lots=False,
+                                                      pool_config=PoolConfig(min_size=1, max_size=1)))
+        loop.run_until_complete(dba.close())
+    finally:
+        loop.close()
+
+
+def fork_workers(workers: int, max_restarts: int = 100) -> Optional[int]:
+    """Fork the worker processes, like tornado.process.fork_processes, and supervise them.
+
+    Returns the worker's number in each worker. The parent restarts workers that die, and
+    on SIGTERM or SIGINT passes SIGTERM on to them, waits for them all to exit and returns
+    None, so that whatever it set up, such as a temporary database, is cleaned up.
+    """
+    workers = workers if workers > 0 else tornado.process.cpu_count()
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def start_worker(number: int) -> bool:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            return True
+        children[pid] = number
+        return False
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info("Starting %d workers", workers)
+    for number in range(workers):
+        if start_worker(number):
+            return number
+    restarts = 0
+    while children:
+        pid, status = os.wait()
+        number = children.pop(pid, None)
+        if number is None or stopping:
+            continue
+        if os.WIFSIGNALED(status):
+            logger.warning("Worker %d (pid %d) killed by signal %d, restarting", number, pid, os.WTERMSIG(status))
+        elif os.WEXITSTATUS(status) != 0:
+            logger.warning("Worker %d (pid %d) exited with status %d, restarting",
+                           number, pid, os.WEXITSTATUS(status))
+        else:
+            continue
+        restarts += 1
+        if restarts > max_restarts:
+            stop(signal.SIGTERM, None)
+            logger.error("Too many worker restarts, stopping")
+            continue
+        if start_worker(number):
+            return number
+    return None
+
+
+def main(temp_db: bool, db_url: str, reset_tables: bool, write_behind: Optional[float] = None,
+         pool_config: Optional[PoolConfig] = None, workers: int = 1, port: int = 8888,
+         lag_threshold: float = 0.25, log_level: int = logging.INFO,
+         log_sample_rates: Optional[Dict[str, float]] = None, offer_timeout: float = 60.0,
+         history_samples: Optional[int] = 256, rollup_interval: Optional[float] = 300.0,
+         location_interval: Optional[float] = 0.1, rate_limits: bool = True, admin_port: int = 8889,
+         admin_address: str = '127.0.0.1'):
     def _main(url: str, _init_tables: bool = False, _reset_tables: bool = False):
+        sockets = tornado.netutil.bind_sockets(port)
+        admin_sockets = tornado.netutil.bind_sockets(admin_port, address=admin_address)
+        if workers != 1:
+            # The workers share the listening sockets; each gets its own IOLoop and connection pool.
+            if _init_tables or _reset_tables:
+                prepare_tables(url, _init_tables, _reset_tables)
+                _init_tables = _reset_tables = False
+            if fork_workers(workers) is None:
+                return
+
+        # Formatting and writing log records happens on the listener's thread, off the event loop.
+        log_listener = configure_logging(log_level, log_sample_rates)
         loop: AbstractEventLoop = tornado.ioloop.IOLoop.current().asyncio_loop
         dba: DbAccess = tornado.ioloop.IOLoop.current().run_sync(
-            lambda: DbAccess.create(url, loop=loop, init_tables=_init_tables, reset_tables=_reset_tables))
-        app = tornado.web.Application([(r"/ws/(.*)", UserWSHandler, {'user_sessions': UserSessions(), 'dba': dba}),
-                                       (r'/spaces', ParkingLotsCreationHandler, {'dba': dba}),
-                                       (r'/spaces/([0-9])+', IndividualLotDeleteHandler, {'dba': dba}),
-                                       (r'/spaces/([0-9])+/available', IndividualLotAvailableHandler, {'dba': dba}),
-                                       (r'/spaces/([0-9])+/price', IndividualLotPriceHandler, {'dba': dba})])
+            lambda: DbAccess.create(url, loop=loop, init_tables=_init_tables, reset_tables=_reset_tables,
+                                    write_behind_interval=write_behind, pool_config=pool_config,
+                                    history_samples=history_samples or None,
+                                    rollup_interval=(rollup_interval or None) if history_samples else None))
+        lot_index: LotIndex = tornado.ioloop.IOLoop.current().run_sync(lambda: load_lot_index(dba))
+        user_sessions = UserSessions()
+        mailbox = LocationMailbox(user_sessions, location_interval) if location_interval else None
+        if mailbox is not None:
+            tornado.ioloop.IOLoop.current().add_callback(mailbox.start)
+        offers = OfferExpiry(dba, user_sessions, timeout=offer_timeout)
+        forecaster = AvailabilityForecaster(dba.history) if dba.history is not None else None
+        payloads = LotPayloadCache()
+        engine = AllocationEngine(dba, lot_index, user_sessions, offers=offers, forecaster=forecaster,
+                                  payloads=payloads)
+        tornado.ioloop.IOLoop.current().add_callback(engine.start)
+        tornado.ioloop.IOLoop.current().add_callback(offers.start)
+        if forecaster is not None:
+            tornado.ioloop.IOLoop.current().add_callback(forecaster.start)
+        monitor = LoopLagMonitor(threshold=lag_threshold)
+        tornado.ioloop.IOLoop.current().add_callback(monitor.start)
+        notifier = LotUpdateNotifier(user_sessions, payloads=payloads)
+        directory: Optional[SessionDirectory] = None
+        if workers != 1:
+            directory = SessionDirectory(dba, user_sessions, notifier)
+            tornado.ioloop.IOLoop.current().run_sync(directory.start)
+        metrics.POOL_IN_USE.set_function(lambda: dba.pool_stats.in_use)
+        metrics.POOL_WAITING.set_function(lambda: dba.pool_stats.waiting)
+        metrics.USER_SESSIONS.set_function(lambda: len(user_sessions.users))
+        lots = {'dba': dba, 'lot_index': lot_index, 'lot_search': LotSearch(dba, lot_index)}
+        updates = {'dba': dba, 'notifier': notifier, 'payloads': payloads}
+        ws = {'user_sessions': user_sessions, 'engine': engine, 'directory': directory, 'mailbox': mailbox,
+              'rate_limits': DEFAULT_RATE_LIMITS if rate_limits else None}
+        app = tornado.web.Application([(r"/ws/(.*)", UserWSHandler, ws),
+                                       (r'/spaces', ParkingLotsCreationHandler, lots),
+                                       (r'/spaces/bulk', ParkingLotsBulkUpdateHandler, updates),
+                                       (r'/spaces/([0-9]+)', IndividualLotDeleteHandler,
+                                        {'dba': dba, 'lot_index': lot_index, 'payloads': payloads}),
+                                       (r'/spaces/([0-9]+)/available', IndividualLotAvailableHandler, updates),
+                                       (r'/spaces/([0-9]+)/price', IndividualLotPriceHandler, updates)])
 
-        app.listen(8888)
-        tornado.ioloop.IOLoop.current().start()
+        server = tornado.httpserver.HTTPServer(app)
+        server.add_sockets(sockets)
+        admin_server = tornado.httpserver.HTTPServer(make_admin_app(dba))
+        admin_server.add_sockets(admin_sockets)
+        signal.signal(signal.SIGTERM, lambda *args: tornado.ioloop.IOLoop.current().add_callback_from_signal(
+            tornado.ioloop.IOLoop.current().stop))
+        try:
+            tornado.ioloop.IOLoop.current().start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Flushes any buffered writes before exiting.
+            engine.stop()
+            if forecaster is not None:
+                forecaster.stop()
+            monitor.stop()
+            if mailbox is not None:
+                mailbox.stop()
+            tornado.ioloop.IOLoop.current().run_sync(offers.stop)
+            if directory is not None:
+                tornado.ioloop.IOLoop.current().run_sync(directory.close)
+            tornado.ioloop.IOLoop.current().run_sync(dba.close)
+            log_listener.stop()
 
     if temp_db:
         with testing.postgresql.Postgresql() as postgresql:
@@ -31,11 +213,71 @@ def main(temp_db: bool, db_url: str, reset_tables: bool):
         _main(db_url, _reset_tables=reset_tables)
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Parking backend.')
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Parking backend. Serves unless given a command.')
     parser.add_argument("--db", default="postgresql://localhost/postgres", help="Database full url")
     parser.add_argument("--temp-db", action='store_true', help="Create and initialise a temporary database")
     parser.add_argument("--reset-tables", action='store_true', help="Drop and recreate database tables")
+    parser.add_argument("--write-behind", type=float, metavar='SECONDS',
+                        help="Buffer availability updates and write them in batches every SECONDS")
+    parser.add_argument("--pool-min-size", type=int, default=10, help="Connections the pool keeps open")
+    parser.add_argument("--pool-max-size", type=int, default=10, help="Most connections the pool opens")
+    parser.add_argument("--pool-max-queries", type=int, default=50000,
+                        help="Queries after which a pooled connection is replaced")
+    parser.add_argument("--pool-max-inactive-lifetime", type=float, default=300.0, metavar='SECONDS',
+                        help="Close pooled connections idle for longer than this, 0 to keep them")
+    parser.add_argument("--port", type=int, default=8888, help="Port to listen on")
+    parser.add_argument("--admin-port", type=int, default=8889,
+                        help="Port serving /metrics, /admin/profile and /export, which have no authentication")
+    parser.add_argument("--admin-address", default='127.0.0.1',
+                        help="Address the admin port is bound to; keep it private")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes sharing the port, 0 for one per CPU")
+    parser.add_argument("--lag-threshold", type=float, default=0.25, metavar='SECONDS',
+                        help="Log the stack of any callback blocking the event loop for longer than this")
+    parser.add_argument("--log-level", default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="Level of the backend logger")
+    parser.add_argument("--log-sample", action='append', default=[], metavar='EVENT=RATE',
+                        help="Log only this share of an event type, e.g. location_update=0.01. Repeatable")
+    parser.add_argument("--offer-timeout", type=float, default=60.0, metavar='SECONDS',
+                        help="Take back allocations the driver has not accepted within this time")
+    parser.add_argument("--history-samples", type=int, default=256,
+                        help="Availability updates of each lot kept in memory, 0 to keep none")
+    parser.add_argument("--rollup-interval", type=float, default=300.0, metavar='SECONDS',
+                        help="Persist summaries of the availability history every SECONDS, 0 to never")
+    parser.add_argument("--location-interval", type=float, default=0.1, metavar='SECONDS',
+                        help="Apply only the latest location update of each user every SECONDS, 0 to apply all")
+    parser.add_argument("--no-rate-limits", dest='rate_limits', action='store_false',
+                        help="Do not limit the rate of WebSocket messages from each connection")
+    tools.add_commands(parser.add_subparsers(dest='command', metavar='command'))
+    return parser
+
+
+if __name__ == "__main__":
+    parser = build_parser()
     args: argparse.Namespace = parser.parse_args()
+    if args.command is not None:
+        tools.run_command(args)
+        sys.exit()
+
+    log_sample_rates = {}
+    for option in args.log_sample:
+        event, _, rate = option.partition('=')
+        try:
+            log_sample_rates[event] = float(rate)
+        except ValueError:
+            parser.error('--log-sample expects EVENT=RATE, got {}'.format(option))
+        if not 0.0 <= log_sample_rates[event] <= 1.0:
+            parser.error('--log-sample rates must be between 0 and 1, got {}'.format(option))
 
-    main(args.temp_db, args.db, args.reset_tables)
+    try:
+        pool_config = PoolConfig(min_size=args.pool_min_size, max_size=args.pool_max_size,
+                                 max_queries=args.pool_max_queries,
+                                 max_inactive_connection_lifetime=args.pool_max_inactive_lifetime)
+    except ValueError as e:
+        parser.error('--pool-min-size {} and --pool-max-size {}: {}'.format(args.pool_min_size, args.pool_max_size,
+                                                                            e))
+    main(args.temp_db, args.db, args.reset_tables, args.write_behind, pool_config, args.workers, args.port,
+         args.lag_threshold, getattr(logging, args.log_level), log_sample_rates,
+         args.offer_timeout, args.history_samples, args.rollup_interval, args.location_interval, args.rate_limits,
+         args.admin_port, args.admin_address)
@@ -0,0 +1,123 @@
+import threading
+
+from tornado import web
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+
+from parking.backend.db.dbaccess import DbAccess
+from parking.backend.db.export import CONTENT_TYPES, ChunkFormatter, EXPORTS, ExportFilter, parse_bbox
+from parking.backend.metrics import REGISTRY, Registry
+from parking.backend.profiling import SamplingProfiler
+
+MAX_PROFILE_SECONDS = 60.0
+# Sampling more often than this would take the GIL from the event loop for little extra detail.
+MIN_PROFILE_INTERVAL = 0.001
+MAX_EXPORT_CHUNK = 10000
+
+
+def make_admin_app(dba: DbAccess) -> web.Application:
+    """The metrics, profiling and export endpoints, which have no authentication.
+
+    They are served on an admin port of their own, bound to a private address,
+    rather than on the public API port.
+    """
+    return web.Application([(r'/metrics', MetricsHandler),
+                            (r'/admin/profile', ProfileHandler),
+                            (r'/export/([a-z]+)', ExportHandler, {'dba': dba})])
+
+
+class MetricsHandler(web.RequestHandler):
+    """Serves a metrics registry in the Prometheus text exposition format.
+
+    With several workers each process has its own metrics, so a scrape sees
+    whichever worker accepted the connection.
+    """
+    def initialize(self, registry: Registry = REGISTRY) -> None:
+        self.registry = registry
+
+    def get(self) -> None:
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(self.registry.render())
+
+
+class ProfileHandler(web.RequestHandler):
+    """Profiles the event loop thread of this process for ?seconds=N, default 10.
+
+    Responds with collapsed stacks, e.g. for flamegraph.pl or speedscope.
+    ?interval=MS sets the sampling interval, at least 1 ms. One profile runs at a time.
+    """
+    running = False
+
+    async def get(self) -> None:
+        try:
+            seconds = float(self.get_argument('seconds', '10'))
+            interval = float(self.get_argument('interval', '5')) / 1000.0
+        except ValueError:
+            raise web.HTTPError(400, 'seconds and interval must be numbers')
+        if not 0 < seconds <= MAX_PROFILE_SECONDS or not 0 < interval <= seconds:
+            raise web.HTTPError(400, 'seconds must be in (0, {}] and interval positive and at most seconds'.format(
+                MAX_PROFILE_SECONDS))
+        interval = max(interval, MIN_PROFILE_INTERVAL)
+        if ProfileHandler.running:
+            raise web.HTTPError(409, 'A profile is already running')
+
+        ProfileHandler.running = True
+        try:
+            profiler = SamplingProfiler(threading.get_ident(), interval)
+            stacks = await IOLoop.current().run_in_executor(None, profiler.run, seconds)
+        finally:
+            ProfileHandler.running = False
+        self.set_header('Content-Type', 'text/plain; charset=utf-8')
+        self.write(stacks)
+
+
+class ExportHandler(web.RequestHandler):
+    """Streams a table, /export/lots or /export/allocations, as ?format=ndjson (default) or csv.
+
+    ?min_id=, ?max_id= and ?bbox=south,west,north,east filter by lot. Rows are
+    read ?chunk=N at a time, default 1000, and each chunk is flushed to the
+    client before the next is read, so memory use stays constant and a slow
+    client slows the export down rather than filling the buffers.
+    """
+    def initialize(self, dba: DbAccess) -> None:
+        self.dba = dba
+
+    def _int_argument(self, name: str, default=None):
+        value = self.get_argument(name, None)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise web.HTTPError(400, '{} must be an integer'.format(name))
+
+    async def get(self, table: str) -> None:
+        if table not in EXPORTS:
+            raise web.HTTPError(404)
+        fmt = self.get_argument('format', 'ndjson')
+        if fmt not in CONTENT_TYPES:
+            raise web.HTTPError(400, 'format must be one of {}'.format(', '.join(CONTENT_TYPES)))
+        chunk_size = self._int_argument('chunk', 1000)
+        if not 0 < chunk_size <= MAX_EXPORT_CHUNK:
+            raise web.HTTPError(400, 'chunk must be in (0, {}]'.format(MAX_EXPORT_CHUNK))
+        bbox = self.get_argument('bbox', None)
+        try:
+            export_filter = ExportFilter(self._int_argument('min_id'), self._int_argument('max_id'),
+                                         parse_bbox(bbox) if bbox is not None else None)
+        except ValueError as err:
+            raise web.HTTPError(400, str(err))
+
+        formatter = ChunkFormatter(fmt, EXPORTS[table][1])
+        self.set_header('Content-Type', '{}; charset=utf-8'.format(CONTENT_TYPES[fmt]))
+        chunks = self.dba.export(table, export_filter, chunk_size)
+        try:
+            async for records in chunks:
+                self.write(formatter.format(records))
+                await self.flush()
+        except StreamClosedError:
+            # The client went away.
+            return
+        finally:
+            # Closes the cursor and returns the connection now rather than whenever the generator is collected.
+            await chunks.aclose()
+        self.write(formatter.finish())
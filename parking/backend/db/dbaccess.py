@@ -1,10 +1,19 @@
 import logging
+import uuid
 from asyncio import AbstractEventLoop
-from typing import Optional
+from datetime import date, datetime, timedelta, timezone
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
 
 import asyncpg
 
 import parking.backend.db.sql_constants as c
+from parking.backend.db.export import EXPORTS, ExportFilter
+from parking.backend.db.lot_cache import LotCache, LotEntry
+from parking.backend.db.occupancy import OccupancyHistory, Rollup, RollupWriter
+from parking.backend.db.pool import PoolConfig, PoolStats, TimedAcquire
+from parking.backend.db.reservations import ReservationLedger
+from parking.backend.db.write_behind import AvailabilityBuffer
+from parking.backend.metrics import DB_ERRORS, DB_SECONDS, timed
 from parking.shared.rest_models import ParkingLot
 
 logger = logging.getLogger('backend')
@@ -13,64 +22,551 @@ logger = logging.getLogger('backend')
 class DbAccess(object):
     @classmethod
     async def create(cls, destination: str, loop: AbstractEventLoop,
-                     init_tables: bool = False, reset_tables: bool = False) -> 'DbAccess':
+                     init_tables: bool = False, reset_tables: bool = False, cache_lots: bool = True,
+                     write_behind_interval: Optional[float] = None, write_behind_max: int = 1000,
+                     pool_config: Optional[PoolConfig] = None, reservation_block: Optional[int] = None,
+                     history_samples: Optional[int] = None, rollup_interval: Optional[float] = None) -> 'DbAccess':
+        """Connect to the database.
+
+        Every statement in sql_constants.PREPARED_STATEMENTS is prepared on each new
+        pooled connection, see _init_connection.
+
+        If write_behind_interval is given, availability updates for cached lots are
+        buffered and written in batches at most that many seconds later, or once
+        write_behind_max lots are waiting. This needs the lot cache.
+
+        If reservation_block is given, allocate_parking_lot hands out slots from
+        blocks of that many reserved through a ReservationLedger.
+
+        If history_samples is given, the last that many availability updates of
+        each lot are kept in an OccupancyHistory. With rollup_interval as well,
+        summaries of them are written to OccupancyRollups every that many seconds.
+        The table is partitioned, and so is only created when rollups are on; they
+        need PostgreSQL 11 or later.
+        """
+        if write_behind_interval is not None and not cache_lots:
+            raise ValueError('Write-behind availability updates need the lot cache')
+        if rollup_interval is not None and history_samples is None:
+            raise ValueError('Occupancy rollups need the occupancy history')
         self = DbAccess()
-        self.pool: asyncpg.pool.Pool = await asyncpg.create_pool(dsn=destination, loop=loop)
+        # Tags our connections so that change notifications caused by our own writes can be told apart.
+        self.instance_id = 'parking-{}'.format(uuid.uuid4().hex[:12])
+        server_settings = {'application_name': self.instance_id}
+        self._destination = destination
+        self._loop = loop
+        self._partitions: Set[date] = set()
+        pool_config = pool_config or PoolConfig()
+        self.pool_stats = PoolStats()
+        self.pool: asyncpg.pool.Pool = await asyncpg.create_pool(
+            dsn=destination, loop=loop, server_settings=server_settings, init=self._init_connection,
+            min_size=pool_config.min_size, max_size=pool_config.max_size, max_queries=pool_config.max_queries,
+            max_inactive_connection_lifetime=pool_config.max_inactive_connection_lifetime,
+            statement_cache_size=pool_config.statement_cache_size,
+            max_cached_statement_lifetime=pool_config.max_cached_statement_lifetime)
         if reset_tables:
             await self._drop_tables()
         if init_tables or reset_tables:
             await self._create_tables()
+        await self._upgrade_tables()
+
+        self.cache: Optional[LotCache] = None
+        self.history: Optional[OccupancyHistory] = None
+        self._listener: Optional[asyncpg.Connection] = None
+        self._lot_callbacks: List[Callable[[str, int], None]] = []
+        self._following_lots = False
+        if cache_lots:
+            self.cache = LotCache()
+            await self._follow_lots()
+            self.cache.load(await self.get_parking_lots())
+
+        self.availability_buffer: Optional[AvailabilityBuffer] = None
+        if write_behind_interval is not None:
+            self.availability_buffer = AvailabilityBuffer(self._write_parking_lots_availability,
+                                                          write_behind_interval, write_behind_max)
+            self.availability_buffer.start()
+
+        self.ledger: Optional[ReservationLedger] = None
+        if reservation_block is not None:
+            self.ledger = ReservationLedger(self, reservation_block)
+
+        self.rollups: Optional[RollupWriter] = None
+        if history_samples is not None:
+            self.history = OccupancyHistory(history_samples)
+            if self.cache is not None:
+                self.history.record_many(list(self.cache.lots),
+                                         [entry.num_available for entry in self.cache.lots.values()])
+            if rollup_interval is not None:
+                await self._create_rollup_table()
+                self.rollups = RollupWriter(self.history, self.insert_occupancy_rollups, rollup_interval)
+                self.rollups.start()
         return self
 
+    async def close(self) -> None:
+        if self.rollups is not None:
+            await self.rollups.stop()
+        if self.ledger is not None:
+            await self.ledger.release()
+        if self.availability_buffer is not None:
+            await self.availability_buffer.stop()
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+        await self.pool.close()
+
+    def _acquire(self) -> TimedAcquire:
+        return TimedAcquire(self.pool, self.pool_stats)
+
+    async def _init_connection(self, conn: asyncpg.Connection) -> None:
+        """Pool init hook, prepares every statement in sql_constants.PREPARED_STATEMENTS.
+
+        The statements go into the connection's statement cache, which is where
+        `fetch`, `fetchval` and `execute` with arguments look their query up, so no
+        request pays for parsing and planning them. Only the private
+        `Connection._prepare` fills that cache without running the statement; its
+        signature is the same across the asyncpg versions requirements.txt allows,
+        and test_statements_prepared_on_pool_connections checks the cache is used.
+        Should it change, statements are prepared on first use instead.
+        """
+        try:
+            # Preparing leaves the locks taken while planning held until the next sync, so commit explicitly.
+            async with conn.transaction():
+                for query in c.PREPARED_STATEMENTS:
+                    await conn._prepare(query, use_cache=True)
+        except asyncpg.exceptions.UndefinedTableError:
+            # The tables have not been created yet, see _create_tables.
+            pass
+        except (AttributeError, TypeError):
+            logger.warning("Cannot prepare statements with asyncpg %s, preparing them on first use",
+                           asyncpg.__version__, exc_info=True)
+
+    async def listen(self, channel: str, callback: Callable[[asyncpg.Connection, int, str, str], None]) -> None:
+        """Call callback(conn, pid, channel, payload) for every notification on channel.
+
+        All channels share one dedicated connection, so notifications arrive in the
+        order they were committed.
+        """
+        if self._listener is None:
+            self._listener = await asyncpg.connect(dsn=self._destination, loop=self._loop,
+                                                   server_settings={'application_name': self.instance_id})
+        await self._listener.add_listener(channel, callback)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def notify(self, channel: str, payload: str) -> None:
+        async with self._acquire() as conn:
+            await conn.execute(c.NOTIFY, channel, payload)
+
+    async def _follow_lots(self) -> None:
+        if not self._following_lots:
+            await self.listen(c.PARKINGLOTS_CHANNEL, self._on_lots_changed)
+            self._following_lots = True
+
+    async def follow_lot_changes(self, callback: Callable[[str, int], None]) -> None:
+        """Call callback(operation, lot_id) for every lot another process inserts, updates or deletes.
+
+        operation is 'INSERT', 'UPDATE' or 'DELETE'. The callback runs after the
+        lot's cache entry has been invalidated, or for a DELETE removed.
+        """
+        self._lot_callbacks.append(callback)
+        await self._follow_lots()
+
+    def _on_lots_changed(self, conn, pid: int, channel: str, payload: str) -> None:
+        origin, operation, lot_id = payload.split(' ')
+        if origin == self.instance_id:
+            return
+        park_id = int(lot_id)
+        if operation == 'DELETE':
+            # Gone for good, so drop it rather than leave a stale entry that reads of cache.lots would see.
+            if self.cache is not None:
+                self.cache.remove(park_id)
+            if self.history is not None:
+                self.history.remove(park_id)
+        elif self.cache is not None:
+            self.cache.invalidate(park_id)
+        for callback in self._lot_callbacks:
+            callback(operation, park_id)
+
     async def _drop_tables(self):
         logger.info("Dropping database tables.")
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
+            await conn.execute(c.OCCUPANCY_ROLLUPS_DROP_TABLE)
+            await conn.execute(c.SESSIONS_DROP_TABLE)
             await conn.execute(c.ALLOCATIONS_DROP_TABLE)
             await conn.execute(c.PARKINGLOTS_DROP_TABLE)
+        self._partitions.clear()
         logger.info("Database tables dropped.")
 
     async def _create_tables(self):
         logger.info("Creating database tables.")
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             async with conn.transaction():
                 await conn.execute(c.PARKINGLOTS_CREATE_TABLE)
                 await conn.execute(c.ALLOCATIONS_CREATE_TABLE)
+                await conn.execute(c.SESSIONS_CREATE_TABLE)
+        # Replace the pooled connections so that they prepare their statements against the new tables.
+        await self.pool.expire_connections()
         logger.info("Database tables created.")
 
+    async def _upgrade_tables(self):
+        """Add what databases created by earlier versions lack: the Sessions table and the NOTIFY trigger."""
+        async with self._acquire() as conn:
+            if await conn.fetchval("SELECT to_regclass('parkinglots')") is None:
+                # The tables have not been created yet.
+                return
+            async with conn.transaction():
+                await conn.execute(c.PARKINGLOTS_LOCK_FOR_UPGRADE)
+                created = await conn.fetchval("SELECT to_regclass('sessions')") is None
+                await conn.execute(c.SESSIONS_CREATE_TABLE)
+                await conn.execute(c.PARKINGLOTS_CREATE_NOTIFY_FUNCTION)
+                await conn.execute(c.PARKINGLOTS_DROP_NOTIFY_TRIGGER)
+                await conn.execute(c.PARKINGLOTS_CREATE_NOTIFY_TRIGGER)
+        if created:
+            # Replace the pooled connections so that they prepare the Sessions statements too.
+            await self.pool.expire_connections()
+
+    async def _create_rollup_table(self):
+        async with self._acquire() as conn:
+            try:
+                async with conn.transaction():
+                    await conn.execute(c.OCCUPANCY_ROLLUPS_CREATE_TABLE)
+                    await conn.execute(c.OCCUPANCY_ROLLUPS_CREATE_INDEX)
+            except (asyncpg.exceptions.DuplicateTableError, asyncpg.exceptions.UniqueViolationError):
+                # Another worker created it at the same time.
+                pass
+
+    @timed(DB_SECONDS, DB_ERRORS)
     async def insert_parking_lot(self, p: ParkingLot) -> Optional[int]:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             park_id: int = await conn.fetchval(c.PARKINGLOTS_INSERT,
                                                p.name, p.capacity, p.location.latitude,
                                                p.location.longitude, p.price, p.capacity, 0)
+        if self.cache is not None:
+            self.cache.put(LotEntry(park_id, p.name, p.capacity, p.location.latitude, p.location.longitude,
+                                    p.price, p.capacity, 0))
+        if self.history is not None:
+            self.history.record(park_id, p.capacity)
         return park_id
 
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def insert_parking_lots(self, batches: Iterable[Sequence[ParkingLot]]) -> List[int]:
+        """Insert lots in bulk, one COPY per batch, all in one transaction. Returns their IDs in order.
+
+        batches may be a generator that reads and validates its input lazily; if
+        it raises, nothing is inserted.
+        """
+        park_ids: List[int] = []
+        # Only kept to fill the cache once the transaction has committed.
+        entries: List[LotEntry] = []
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                for batch in batches:
+                    if not batch:
+                        continue
+                    ids = sorted(r['id'] for r in await conn.fetch(c.PARKINGLOTS_RESERVE_IDS, len(batch)))
+                    records = [(park_id, p.name, p.capacity, p.location.latitude, p.location.longitude, p.price,
+                                p.capacity, 0) for park_id, p in zip(ids, batch)]
+                    await conn.copy_records_to_table(c.PARKINGLOTS_TABLE, records=records,
+                                                     columns=c.PARKINGLOTS_COLUMNS)
+                    park_ids.extend(ids)
+                    if self.cache is not None or self.history is not None:
+                        entries.extend(LotEntry(*record) for record in records)
+        for entry in entries:
+            if self.cache is not None:
+                self.cache.put(entry)
+            if self.history is not None:
+                self.history.record(entry.id, entry.capacity)
+        return park_ids
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def get_parking_lots(self) -> List[asyncpg.Record]:
+        async with self._acquire() as conn:
+            return await conn.fetch(c.PARKINGLOTS_SELECT_ALL)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def get_parking_lot(self, park_id: int) -> Optional[LotEntry]:
+        if self.cache is not None:
+            entry = self.cache.get(park_id)
+            if entry is not None:
+                return entry
+        async with self._acquire() as conn:
+            record = await conn.fetchrow(c.PARKINGLOTS_SELECT_BY_ID, park_id)
+        if record is None:
+            if self.cache is not None:
+                self.cache.remove(park_id)
+            return None
+        entry = LotEntry.from_record(record)
+        return entry if self.cache is None else self.cache.put(entry)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def get_parking_lots_by_id(self, park_ids: Sequence[int]) -> List[LotEntry]:
+        """Look up many lots at once, fetching whatever the cache does not hold in one query."""
+        if self.cache is None:
+            missing, entries = list(park_ids), []
+        else:
+            missing, entries = [], []
+            for park_id in park_ids:
+                entry = self.cache.get(park_id)
+                if entry is None:
+                    missing.append(park_id)
+                else:
+                    entries.append(entry)
+        if missing:
+            async with self._acquire() as conn:
+                records = await conn.fetch(c.PARKINGLOTS_SELECT_BY_IDS, missing)
+            for record in records:
+                entry = LotEntry.from_record(record)
+                entries.append(entry if self.cache is None else self.cache.put(entry))
+        return entries
+
+    @timed(DB_SECONDS, DB_ERRORS)
     async def delete_parking_lot(self, park_id: int) -> Optional[int]:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             park_id: int = await conn.fetchval(c.PARKINGLOTS_DELETE, park_id)
+        if park_id is not None and self.cache is not None:
+            self.cache.remove(park_id)
+        if park_id is not None and self.history is not None:
+            self.history.remove(park_id)
         return park_id
 
+    @timed(DB_SECONDS, DB_ERRORS)
     async def update_parking_lot_availability(self, park_id: int, availability: int) -> Optional[int]:
-        async with self.pool.acquire() as conn:
-            park_id: int = await conn.fetchval(c.PARKINGLOTS_UPDATE_AVAILABILITY, park_id, availability)
+        # Stale entries may be of lots deleted elsewhere, which must get the direct write and its None.
+        if self.availability_buffer is not None and self.cache.get(park_id) is not None:
+            self.availability_buffer.add(park_id, availability)
+            self.cache.update(park_id, num_available=availability)
+        else:
+            async with self._acquire() as conn:
+                park_id: int = await conn.fetchval(c.PARKINGLOTS_UPDATE_AVAILABILITY, park_id, availability)
+            if park_id is not None and self.cache is not None:
+                self.cache.update(park_id, num_available=availability)
+        if park_id is not None and self.history is not None:
+            self.history.record(park_id, availability)
         return park_id
 
+    @timed(DB_SECONDS, DB_ERRORS)
     async def update_parking_lot_price(self, park_id: int, price: int) -> Optional[int]:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             park_id: int = await conn.fetchval(c.PARKINGLOTS_UPDATE_PRICE, park_id, price)
+        if park_id is not None and self.cache is not None:
+            self.cache.update(park_id, price=price)
         return park_id
 
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def update_parking_lots_availability(self, updates: Iterable[Tuple[int, int]]) -> List[int]:
+        """Set the availability of many lots in one statement. Returns the IDs that exist.
+
+        If an ID appears more than once the last update for it wins.
+        """
+        latest: Dict[int, int] = dict(updates)
+        park_ids = await self._write_parking_lots_availability(latest.items())
+        if self.history is not None:
+            self.history.record_many(park_ids, [latest[park_id] for park_id in park_ids])
+        return park_ids
+
+    async def _write_parking_lots_availability(self, updates: Iterable[Tuple[int, int]]) -> List[int]:
+        # Also the write-behind flush, which must not record the buffered updates in the history again.
+        latest: Dict[int, int] = dict(updates)
+        if not latest:
+            return []
+        # Taken before writing, so that a lot changed while the write runs is not set back to an older value.
+        versions = {park_id: self.cache.version_of(park_id) for park_id in latest} if self.cache is not None else {}
+        async with self._acquire() as conn:
+            records = await conn.fetch(c.PARKINGLOTS_BULK_UPDATE_AVAILABILITY, list(latest), list(latest.values()))
+        park_ids: List[int] = [r['id'] for r in records]
+        if self.cache is not None:
+            pending = self.availability_buffer.pending if self.availability_buffer is not None else {}
+            for park_id in park_ids:
+                if park_id in pending:
+                    # Buffered again meanwhile; the cache holds that newer value already.
+                    continue
+                entry = self.cache.lots.get(park_id)
+                if entry is None:
+                    continue
+                if entry.version != versions[park_id]:
+                    self.cache.invalidate(park_id)
+                elif entry.num_available != latest[park_id]:
+                    self.cache.update(park_id, num_available=latest[park_id])
+        return park_ids
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def update_parking_lots_price(self, updates: Iterable[Tuple[int, float]]) -> List[int]:
+        """Set the price of many lots in one statement. Returns the IDs that exist.
+
+        If an ID appears more than once the last update for it wins.
+        """
+        latest: Dict[int, float] = dict(updates)
+        if not latest:
+            return []
+        async with self._acquire() as conn:
+            records = await conn.fetch(c.PARKINGLOTS_BULK_UPDATE_PRICE, list(latest), list(latest.values()))
+        park_ids: List[int] = [r['id'] for r in records]
+        if self.cache is not None:
+            for park_id in park_ids:
+                self.cache.update(park_id, price=latest[park_id])
+        return park_ids
+
+    @timed(DB_SECONDS, DB_ERRORS)
     async def allocate_parking_lot(self, user_id: str, park_id: int) -> bool:
-        async with self.pool.acquire() as conn:
-            try:
-                async with conn.transaction():
-                    status: str = await conn.execute(c.PARKINGLOTS_INCREMENT_ALLOCATION, park_id)
-                    if status == "UPDATE 0":
-                        logger.warning("The car park {} did not exist or had too many allocations "
-                                       "when allocating it to user : '{}'".format(park_id, user_id))
-                        return False
-                    else:
-                        await conn.execute(c.ALLOCATIONS_INSERT, user_id, park_id)
-            except asyncpg.exceptions.UniqueViolationError:
-                logger.warning("Tried to allocate user : '{}' when they already had an allocation.".format(user_id))
-                return False
+        if self.ledger is not None:
+            return await self.ledger.allocate(user_id, park_id)
+        try:
+            async with self._acquire() as conn:
+                allocated = await conn.fetchval(c.PARKINGLOTS_ALLOCATE, user_id, park_id)
+        except asyncpg.exceptions.UniqueViolationError:
+            # Another allocation for the same user committed first.
+            allocated = None
+        if allocated is None:
+            logger.warning("Could not allocate car park {} to user : '{}', it does not exist, is full or the user "
+                           "already has an allocation.".format(park_id, user_id))
+            return False
+        if self.cache is not None:
+            self.cache.add_allocations(park_id)
         return True
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def reserve_parking_slots(self, park_id: int, count: int) -> int:
+        """Take up to count free slots of a lot without allocating them. Returns how many were taken."""
+        async with self._acquire() as conn:
+            reserved = await conn.fetchval(c.PARKINGLOTS_RESERVE, park_id, count) or 0
+        if reserved and self.cache is not None:
+            self.cache.add_allocations(park_id, reserved)
+        return reserved
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def release_parking_slots(self, park_id: int, count: int) -> None:
+        async with self._acquire() as conn:
+            await conn.execute(c.PARKINGLOTS_RELEASE, park_id, count)
+        if self.cache is not None:
+            self.cache.add_allocations(park_id, -count)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def insert_allocation(self, user_id: str, park_id: int) -> bool:
+        """Record an allocation for a slot that has already been reserved."""
+        try:
+            async with self._acquire() as conn:
+                await conn.execute(c.ALLOCATIONS_INSERT, user_id, park_id)
+        except asyncpg.exceptions.UniqueViolationError:
+            logger.warning("Tried to allocate user : '{}' when they already had an allocation.".format(user_id))
+            return False
+        except asyncpg.exceptions.ForeignKeyViolationError:
+            logger.warning("Tried to allocate user : '{}' to car park {} which does not exist.".format(
+                user_id, park_id))
+            return False
+        return True
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def allocate_parking_lots(self, allocations: Iterable[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        """Allocate many (user_id, park_id) pairs in one transaction.
+
+        Pairs are granted in order while their lot has room; users who already
+        hold an allocation are skipped. Returns the pairs that were granted.
+        """
+        user_ids, park_ids = [], []
+        for user_id, park_id in allocations:
+            user_ids.append(user_id)
+            park_ids.append(park_id)
+        if not user_ids:
+            return []
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(c.PARKINGLOTS_LOCK_BY_IDS, park_ids)
+                records = await conn.fetch(c.ALLOCATIONS_BULK_INSERT, user_ids, park_ids)
+        granted = [(r['user_id'], r['park_id']) for r in records]
+        if self.cache is not None:
+            for _, park_id in granted:
+                self.cache.add_allocations(park_id)
+        return granted
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def deallocate_parking_lots(self, allocations: Iterable[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        """Remove many (user_id, park_id) allocations in one statement and free their slots.
+
+        Pairs that are no longer allocated are ignored. Returns the pairs removed.
+        """
+        user_ids, park_ids = [], []
+        for user_id, park_id in allocations:
+            user_ids.append(user_id)
+            park_ids.append(park_id)
+        if not user_ids:
+            return []
+        async with self._acquire() as conn:
+            records = await conn.fetch(c.ALLOCATIONS_BULK_DELETE, user_ids, park_ids)
+        removed = [(r['user_id'], r['park_id']) for r in records]
+        if self.cache is not None:
+            for _, park_id in removed:
+                self.cache.add_allocations(park_id, -1)
+        return removed
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def insert_occupancy_rollups(self, rollups: Sequence[Rollup]) -> None:
+        """Write rollups in one statement, first creating the daily partitions they fall in.
+
+        A rollup of a lot and bucket already written, by another worker or an earlier
+        run, is merged into the existing row.
+        """
+        days = {datetime.fromtimestamp(rollup[1], timezone.utc).date() for rollup in rollups} - self._partitions
+        async with self._acquire() as conn:
+            for day in sorted(days):
+                try:
+                    await conn.execute(c.OCCUPANCY_ROLLUPS_CREATE_PARTITION.format(
+                        day.strftime('%Y%m%d'), day.isoformat(), (day + timedelta(days=1)).isoformat()))
+                except (asyncpg.exceptions.DuplicateTableError, asyncpg.exceptions.UniqueViolationError):
+                    # Another process created it at the same time.
+                    pass
+            await conn.execute(c.OCCUPANCY_ROLLUPS_MERGE, *(list(column) for column in zip(*rollups)))
+        self._partitions |= days
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def get_occupancy_rollups(self, park_ids: Sequence[int], since: float, until: float) -> List[Rollup]:
+        """Rollups of the given lots with buckets starting in [since, until), by lot and then time."""
+        async with self._acquire() as conn:
+            records = await conn.fetch(c.OCCUPANCY_ROLLUPS_SELECT, list(park_ids), since, until)
+        return [tuple(record) for record in records]
+
+    async def export(self, table: str, export_filter: Optional[ExportFilter] = None,
+                     chunk_size: int = 1000) -> AsyncIterator[List[asyncpg.Record]]:
+        """Read a table, 'lots' or 'allocations', in chunks of at most chunk_size rows.
+
+        The rows come from a server-side cursor, so only one chunk is in memory
+        at a time, and from a single snapshot. A pooled connection is held until
+        the iteration finishes, so a slow consumer keeps it busy.
+        """
+        query, _ = EXPORTS[table]
+        arguments = (export_filter or ExportFilter()).arguments()
+        async with self._acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                cursor = await conn.cursor(query, *arguments)
+                while True:
+                    records = await cursor.fetch(chunk_size)
+                    if not records:
+                        break
+                    yield records
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def register_session(self, user_id: str) -> None:
+        """Record that this process holds the WebSocket of user_id."""
+        async with self._acquire() as conn:
+            await conn.execute(c.SESSIONS_REGISTER, user_id, self.instance_id)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def unregister_session(self, user_id: str) -> None:
+        """Forget user_id's session, unless another process has taken it over since."""
+        async with self._acquire() as conn:
+            await conn.execute(c.SESSIONS_UNREGISTER, user_id, self.instance_id)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def unregister_sessions(self) -> None:
+        async with self._acquire() as conn:
+            await conn.execute(c.SESSIONS_UNREGISTER_WORKER, self.instance_id)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def unregister_dead_sessions(self) -> int:
+        """Forget the sessions of worker processes that have died, returning how many there were."""
+        async with self._acquire() as conn:
+            status = await conn.execute(c.SESSIONS_UNREGISTER_DEAD)
+        return int(status.split()[-1])
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    async def locate_session(self, user_id: str) -> Optional[str]:
+        """The instance_id of the live process holding user_id's WebSocket, if any."""
+        async with self._acquire() as conn:
+            return await conn.fetchval(c.SESSIONS_LOCATE, user_id)
@@ -0,0 +1,71 @@
+import csv
+import io
+import json
+from typing import Optional, Sequence, Tuple
+
+import attr
+
+import parking.backend.db.sql_constants as c
+
+# The query and column order of each table that can be exported.
+EXPORTS = {
+    'lots': (c.PARKINGLOTS_EXPORT,
+             ('id', 'name', 'capacity', 'lat', 'long', 'price', 'num_available', 'num_allocated')),
+    'allocations': (c.ALLOCATIONS_EXPORT, ('user_id', 'park_id')),
+}
+
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+BoundingBox = Tuple[float, float, float, float]
+
+
+def parse_bbox(text: str) -> BoundingBox:
+    """Parse 'south,west,north,east' in degrees."""
+    try:
+        south, west, north, east = (float(part) for part in text.split(','))
+    except ValueError:
+        raise ValueError('bbox must be south,west,north,east')
+    if not (-90.0 <= south <= north <= 90.0 and -180.0 <= west <= east <= 180.0):
+        raise ValueError('bbox must have south <= north and west <= east, in range')
+    return south, west, north, east
+
+
+@attr.s
+class ExportFilter:
+    """Restricts an export to lots with IDs in [min_id, max_id] inside bbox, each bound optional."""
+    min_id: Optional[int] = attr.ib(default=None)
+    max_id: Optional[int] = attr.ib(default=None)
+    bbox: Optional[BoundingBox] = attr.ib(default=None)
+
+    def arguments(self) -> tuple:
+        return (self.min_id, self.max_id) + (self.bbox or (None, None, None, None))
+
+
+class ChunkFormatter(object):
+    """Formats chunks of records as NDJSON, one object per line, or as CSV with a header before the first chunk."""
+    def __init__(self, fmt: str, columns: Sequence[str]) -> None:
+        if fmt not in CONTENT_TYPES:
+            raise ValueError('Unknown export format {}'.format(fmt))
+        self.fmt = fmt
+        self.columns = columns
+        self.rows = 0
+
+    def format(self, records: Sequence) -> str:
+        out = io.StringIO()
+        if self.fmt == 'ndjson':
+            for record in records:
+                out.write(json.dumps(dict(zip(self.columns, record))))
+                out.write('\n')
+        else:
+            writer = csv.writer(out, lineterminator='\n')
+            if self.rows == 0:
+                writer.writerow(self.columns)
+            writer.writerows(records)
+        self.rows += len(records)
+        return out.getvalue()
+
+    def finish(self) -> str:
+        """Whatever must follow the last chunk: the header, for a CSV export without rows."""
+        if self.fmt == 'csv' and self.rows == 0:
+            return ','.join(self.columns) + '\n'
+        return ''
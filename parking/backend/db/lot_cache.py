@@ -0,0 +1,103 @@
+from typing import Dict, Iterable, Optional, Set
+
+import attr
+
+
+@attr.s(slots=True)
+class LotEntry:
+    """The state of one row of ParkingLots as seen by this process."""
+    id: int = attr.ib()
+    name: str = attr.ib()
+    capacity: int = attr.ib()
+    lat: float = attr.ib()
+    long: float = attr.ib()
+    price: float = attr.ib()
+    num_available: int = attr.ib()
+    num_allocated: int = attr.ib()
+    version: int = attr.ib(default=0)
+
+    @classmethod
+    def from_record(cls, record) -> 'LotEntry':
+        return cls(record['id'], record['name'], record['capacity'], record['lat'], record['long'],
+                   record['price'], record['num_available'], record['num_allocated'])
+
+
+class LotCache(object):
+    """In-memory copy of the ParkingLots table.
+
+    Every change stamps the affected entry with a new value of a cache-wide
+    counter, so a caller holding an entry can compare its version with
+    `version_of` to tell whether it has since changed. Entries invalidated by
+    another process stay in `stale` until they are refetched.
+    """
+    def __init__(self) -> None:
+        self.lots: Dict[int, LotEntry] = {}
+        self.stale: Set[int] = set()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self.lots)
+
+    def _next_version(self) -> int:
+        self.version += 1
+        return self.version
+
+    def load(self, records: Iterable) -> None:
+        self.lots.clear()
+        self.stale.clear()
+        for record in records:
+            self.put(LotEntry.from_record(record))
+
+    def get(self, lot_id: int) -> Optional[LotEntry]:
+        """Return the cached entry, or None if it is unknown or stale."""
+        entry = self.lots.get(lot_id)
+        if entry is None or lot_id in self.stale:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, entry: LotEntry) -> LotEntry:
+        entry.version = self._next_version()
+        self.lots[entry.id] = entry
+        self.stale.discard(entry.id)
+        return entry
+
+    def update(self, lot_id: int, **changes) -> None:
+        """Apply a change this process has written to the database."""
+        entry = self.lots.get(lot_id)
+        if entry is None:
+            return
+        for name, value in changes.items():
+            setattr(entry, name, value)
+        entry.version = self._next_version()
+
+    def add_allocations(self, lot_id: int, count: int = 1) -> None:
+        entry = self.lots.get(lot_id)
+        if entry is not None:
+            self.update(lot_id, num_allocated=entry.num_allocated + count)
+
+    def remove(self, lot_id: int) -> None:
+        self.lots.pop(lot_id, None)
+        self.stale.discard(lot_id)
+        self._next_version()
+
+    def invalidate(self, lot_id: int) -> None:
+        """Mark an entry as changed elsewhere; the next `get` will miss."""
+        self.invalidations += 1
+        entry = self.lots.get(lot_id)
+        if entry is not None:
+            entry.version = self._next_version()
+        self.stale.add(lot_id)
+
+    def version_of(self, lot_id: int) -> int:
+        """Current version of an entry, 0 if it is not cached."""
+        entry = self.lots.get(lot_id)
+        return 0 if entry is None else entry.version
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self.lots), 'stale': len(self.stale), 'version': self.version,
+                'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations}
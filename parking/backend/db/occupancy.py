@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import time
+from math import floor
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger('backend')
+
+# (park_id, bucket start, samples, min, max, mean and last availability in the bucket, time of the last)
+Rollup = Tuple[int, float, int, int, int, float, int, float]
+WriteFunction = Callable[[List[Rollup]], Awaitable[None]]
+
+
+class OccupancyHistory(object):
+    """Recent availability samples of every lot, in fixed-size ring buffers.
+
+    Each lot owns a row of two (lots x samples) arrays holding the time of each
+    sample and the availability it reported. A row is a ring buffer: `heads[row]`
+    is where the next sample goes, overwriting the oldest once the row is full,
+    so memory per lot is fixed. Positions never written hold NaN. Rows of removed
+    lots are recycled, and the arrays double in size when they run out.
+    """
+    def __init__(self, samples: int = 256, initial_lots: int = 256) -> None:
+        if samples < 1 or initial_lots < 1:
+            raise ValueError('samples and initial_lots must be positive')
+        self.times = np.full((initial_lots, samples), np.nan)
+        self.values = np.full((initial_lots, samples), np.nan, dtype=np.float32)
+        self.heads = np.zeros(initial_lots, dtype=np.int64)
+        self.rows: Dict[int, int] = {}
+        self.free: List[int] = list(range(initial_lots - 1, -1, -1))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def samples(self) -> int:
+        return self.times.shape[1]
+
+    def _grow(self) -> None:
+        old = len(self.heads)
+        self.times = np.concatenate((self.times, np.full((old, self.samples), np.nan)))
+        self.values = np.concatenate((self.values, np.full((old, self.samples), np.nan, dtype=np.float32)))
+        self.heads = np.concatenate((self.heads, np.zeros(old, dtype=np.int64)))
+        self.free.extend(range(2 * old - 1, old - 1, -1))
+
+    def _row(self, park_id: int) -> int:
+        row = self.rows.get(park_id)
+        if row is None:
+            if not self.free:
+                self._grow()
+            row = self.rows[park_id] = self.free.pop()
+        return row
+
+    def record(self, park_id: int, available: int, timestamp: Optional[float] = None) -> None:
+        row = self._row(park_id)
+        head = self.heads[row]
+        self.times[row, head] = time.time() if timestamp is None else timestamp
+        self.values[row, head] = available
+        self.heads[row] = (head + 1) % self.samples
+
+    def record_many(self, park_ids: Sequence[int], availables: Sequence[int],
+                    timestamp: Optional[float] = None) -> None:
+        """Record one sample per lot, all at the same time. If a lot appears more than once the last one wins."""
+        latest = dict(zip(park_ids, availables))
+        if not latest:
+            return
+        rows = np.fromiter((self._row(park_id) for park_id in latest), dtype=np.int64, count=len(latest))
+        heads = self.heads[rows]
+        self.times[rows, heads] = time.time() if timestamp is None else timestamp
+        self.values[rows, heads] = np.fromiter(latest.values(), dtype=np.float32, count=len(latest))
+        self.heads[rows] = (heads + 1) % self.samples
+
+    def remove(self, park_id: int) -> None:
+        row = self.rows.pop(park_id, None)
+        if row is not None:
+            self.times[row] = np.nan
+            self.values[row] = np.nan
+            self.heads[row] = 0
+            self.free.append(row)
+
+    def window(self, park_ids: Sequence[int], since: float,
+               until: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Samples of many lots taken between since and until, as (times, availability) arrays.
+
+        Both arrays are (len(park_ids) x samples), one row per lot in the order
+        given with its samples oldest first. Positions outside the window, and
+        every position of a lot without history, hold NaN.
+        """
+        rows = np.fromiter((self.rows.get(park_id, -1) for park_id in park_ids), dtype=np.int64,
+                           count=len(park_ids))
+        known = rows >= 0
+        rows = np.where(known, rows, 0)
+        # The head of a row is its oldest sample, so reading from there unrolls the ring.
+        order = (self.heads[rows][:, None] + np.arange(self.samples)) % self.samples
+        times = self.times[rows[:, None], order]
+        values = self.values[rows[:, None], order].astype(np.float64)
+        outside = ~known[:, None] | ~(times >= since)
+        if until is not None:
+            outside |= ~(times <= until)
+        times[outside] = np.nan
+        values[outside] = np.nan
+        return times, values
+
+    def rollup(self, since: float, until: float) -> List[Rollup]:
+        """Summarise the samples of every lot taken in [since, until), one Rollup per lot that has any."""
+        if not self.rows:
+            return []
+        park_ids = np.fromiter(self.rows.keys(), dtype=np.int64, count=len(self.rows))
+        rows = np.fromiter(self.rows.values(), dtype=np.int64, count=len(self.rows))
+        times = self.times[rows]
+        inside = (times >= since) & (times < until)
+        counts = inside.sum(axis=1)
+        present = counts > 0
+        if not present.any():
+            return []
+        park_ids, counts, times, inside = park_ids[present], counts[present], times[present], inside[present]
+        values = self.values[rows[present]].astype(np.float64)
+        low = np.where(inside, values, np.inf).min(axis=1)
+        high = np.where(inside, values, -np.inf).max(axis=1)
+        mean = np.where(inside, values, 0.0).sum(axis=1) / counts
+        times = np.where(inside, times, -np.inf)
+        latest = times.argmax(axis=1)
+        last = values[np.arange(len(values)), latest]
+        last_at = times[np.arange(len(times)), latest]
+        return [(int(p), since, int(n), int(lo), int(hi), float(m), int(la), float(at))
+                for p, n, lo, hi, m, la, at in zip(park_ids, counts, low, high, mean, last, last_at)]
+
+
+class RollupWriter(object):
+    """Periodically persists downsampled OccupancyHistory.
+
+    Every `interval` seconds the samples of each complete bucket of that length
+    since the last write are summarised with `OccupancyHistory.rollup` and
+    handed to `write_function` in one batch. Buckets start on multiples of
+    `interval` since the epoch, so every process agrees on them.
+    """
+    def __init__(self, history: OccupancyHistory, write_function: WriteFunction, interval: float = 300.0) -> None:
+        if interval <= 0:
+            raise ValueError('interval must be positive')
+        self.history = history
+        self.write_function = write_function
+        self.interval = interval
+        self.written_until = self._bucket(time.time())
+        self.written = 0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Future] = None
+
+    def _bucket(self, timestamp: float) -> float:
+        return floor(timestamp / self.interval) * self.interval
+
+    async def flush(self, now: Optional[float] = None, partial: bool = False) -> int:
+        """Write the buckets completed by now, and with partial the one in progress. Returns the rollups written."""
+        now = time.time() if now is None else now
+        async with self._lock:
+            end = now if partial else self._bucket(now)
+            rollups: List[Rollup] = []
+            start = self.written_until
+            while start < end:
+                rollups.extend(self.history.rollup(start, min(start + self.interval, end)))
+                start += self.interval
+            if rollups:
+                await self.write_function(rollups)
+            self.written_until = max(self.written_until, end)
+            self.written += len(rollups)
+            return len(rollups)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """Stop the periodic writes and write what has been sampled since the last one."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush(partial=True)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval - time.time() % self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to write occupancy rollups")
@@ -0,0 +1,72 @@
+import time
+from typing import Dict
+
+import asyncpg
+import attr
+
+from parking.backend.metrics import POOL_ACQUIRE_SECONDS
+
+
+@attr.s
+class PoolConfig:
+    """Tuning of the asyncpg connection pool.
+
+    The defaults are asyncpg's own, except that prepared statements stay cached
+    for the lifetime of their connection instead of expiring after five minutes.
+    """
+    min_size: int = attr.ib(default=10)
+    max_size: int = attr.ib(default=10)
+    max_queries: int = attr.ib(default=50000)
+    max_inactive_connection_lifetime: float = attr.ib(default=300.0)
+    statement_cache_size: int = attr.ib(default=100)
+    max_cached_statement_lifetime: float = attr.ib(default=0)
+
+    def __attrs_post_init__(self) -> None:
+        if self.min_size < 0 or self.max_size < 1 or self.min_size > self.max_size:
+            raise ValueError('Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1')
+
+
+class PoolStats(object):
+    """How long callers wait to get a connection out of the pool, and how many are out."""
+    def __init__(self) -> None:
+        self.acquisitions = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.waiting = 0
+        self.in_use = 0
+
+    def record_wait(self, wait: float) -> None:
+        self.acquisitions += 1
+        self.total_wait += wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+
+    def stats(self) -> Dict[str, float]:
+        mean = self.total_wait / self.acquisitions if self.acquisitions else 0.0
+        return {'acquisitions': self.acquisitions, 'mean_wait': mean, 'max_wait': self.max_wait,
+                'waiting': self.waiting, 'in_use': self.in_use}
+
+
+class TimedAcquire(object):
+    """Async context manager like `Pool.acquire()` that records the wait in a PoolStats."""
+    def __init__(self, pool: asyncpg.pool.Pool, stats: PoolStats) -> None:
+        self.pool = pool
+        self.stats = stats
+        self.conn = None
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        self.stats.waiting += 1
+        try:
+            self.conn = await self.pool.acquire()
+        finally:
+            self.stats.waiting -= 1
+        wait = time.perf_counter() - start
+        self.stats.record_wait(wait)
+        POOL_ACQUIRE_SECONDS.observe(wait)
+        self.stats.in_use += 1
+        return self.conn
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.stats.in_use -= 1
+        await self.pool.release(self.conn)
@@ -0,0 +1,73 @@
+import csv
+import json
+from typing import Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+from parking.shared.location import Location
+from parking.shared.rest_models import ParkingLot
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+# Line number and error of each row that failed validation.
+Rejected = List[Tuple[int, str]]
+Row = Union[dict, str]
+
+
+def read_rows(stream: TextIO, fmt: str) -> Iterator[Tuple[int, Row]]:
+    """(line number, row) of every row, read as it is consumed.
+
+    A CSV row is a dict keyed by the header. An NDJSON row is the line itself,
+    decoded by parse_lot so that a malformed line is rejected like any other
+    invalid row.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'ndjson':
+        for line_num, line in enumerate(stream, 1):
+            if line.strip():
+                yield line_num, line
+    else:
+        raise ValueError('Unknown import format {}'.format(fmt))
+
+
+def parse_lot(row: Row, fmt: str) -> ParkingLot:
+    """Build a lot from a row, subject to the ParkingLot validators.
+
+    NDJSON rows are ParkingLot objects as sent to POST /spaces. CSV rows have
+    the columns name, capacity, price, lat and long, converted from text first.
+    """
+    if fmt == 'ndjson':
+        data = json.loads(row)
+        if not isinstance(data, dict):
+            raise ValueError('expected an object')
+        data.pop('id', None)
+        return ParkingLot(**data)
+    try:
+        return ParkingLot(int(row['capacity']), row['name'], float(row['price']),
+                          Location(float(row['lat']), float(row['long'])))
+    except KeyError as err:
+        raise ValueError('missing column {}'.format(err))
+
+
+def validate_batches(rows: Iterable[Tuple[int, Row]], fmt: str, batch_size: int = 5000,
+                     rejected: Optional[Rejected] = None) -> Iterator[List[ParkingLot]]:
+    """Group rows into batches of valid lots.
+
+    An invalid row raises ValueError naming its line, unless a `rejected` list
+    is given, in which case the row is recorded there and skipped.
+    """
+    batch: List[ParkingLot] = []
+    for line_num, row in rows:
+        try:
+            batch.append(parse_lot(row, fmt))
+        except (TypeError, ValueError) as err:
+            if rejected is None:
+                raise ValueError('line {}: {}'.format(line_num, err))
+            rejected.append((line_num, str(err)))
+            continue
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,57 @@
+import asyncio
+from typing import TYPE_CHECKING, Dict, Optional
+
+if TYPE_CHECKING:
+    from parking.backend.db.dbaccess import DbAccess  # noqa: F401
+
+
+class ReservationLedger(object):
+    """Hands out lot slots from blocks reserved in advance.
+
+    Instead of bumping `num_allocated` on the lot's row for every allocation,
+    the ledger takes `block_size` slots at a time and hands them out locally, so
+    concurrent allocations on a popular lot only insert into Allocations. Slots
+    held by the ledger count as allocated in the database until they are used or
+    given back with `release`.
+    """
+    def __init__(self, dba: 'DbAccess', block_size: int = 16) -> None:
+        if block_size < 1:
+            raise ValueError('block_size must be positive')
+        self.dba = dba
+        self.block_size = block_size
+        self.slots: Dict[int, int] = {}
+        self.reservations = 0
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    async def _take_slot(self, park_id: int) -> bool:
+        while self.slots.get(park_id, 0) == 0:
+            lock = self._locks.setdefault(park_id, asyncio.Lock())
+            async with lock:
+                if self.slots.get(park_id, 0) > 0:
+                    break
+                reserved = await self.dba.reserve_parking_slots(park_id, self.block_size)
+                self.reservations += 1
+                if reserved == 0:
+                    return False
+                self.slots[park_id] = self.slots.get(park_id, 0) + reserved
+        self.slots[park_id] -= 1
+        return True
+
+    async def allocate(self, user_id: str, park_id: int) -> bool:
+        if not await self._take_slot(park_id):
+            return False
+        if await self.dba.insert_allocation(user_id, park_id):
+            return True
+        self.slots[park_id] = self.slots.get(park_id, 0) + 1
+        return False
+
+    async def release(self, park_id: Optional[int] = None) -> int:
+        """Give unused slots of one lot, or of every lot, back to the database."""
+        park_ids = list(self.slots) if park_id is None else [park_id]
+        released = 0
+        for lot_id in park_ids:
+            count = self.slots.pop(lot_id, 0)
+            if count:
+                await self.dba.release_parking_slots(lot_id, count)
+                released += count
+        return released
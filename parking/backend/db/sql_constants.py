@@ -17,6 +17,39 @@ PARKINGLOTS_DROP_TABLE = """
 DROP TABLE IF EXISTS ParkingLots;
 """
 
+PARKINGLOTS_CHANNEL = "parkinglots_changed"
+
+# Taken while DbAccess adds, on start, what databases created by earlier versions
+# lack, so that workers starting together do not race; see DbAccess._upgrade_tables.
+PARKINGLOTS_LOCK_FOR_UPGRADE = """
+LOCK TABLE ParkingLots IN SHARE ROW EXCLUSIVE MODE;
+"""
+
+# Notifies listeners of every change to ParkingLots. The payload is
+# "<application_name> <operation> <id>" so a process can ignore its own writes.
+PARKINGLOTS_CREATE_NOTIFY_FUNCTION = """
+CREATE OR REPLACE FUNCTION notify_parkinglots_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('parkinglots_changed', current_setting('application_name') || ' ' || TG_OP || ' ' || OLD.id);
+    ELSE
+        PERFORM pg_notify('parkinglots_changed', current_setting('application_name') || ' ' || TG_OP || ' ' || NEW.id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+PARKINGLOTS_DROP_NOTIFY_TRIGGER = """
+DROP TRIGGER IF EXISTS parkinglots_changed ON ParkingLots;
+"""
+
+PARKINGLOTS_CREATE_NOTIFY_TRIGGER = """
+CREATE TRIGGER parkinglots_changed
+AFTER INSERT OR UPDATE OR DELETE ON ParkingLots
+FOR EACH ROW EXECUTE PROCEDURE notify_parkinglots_changed();
+"""
+
 ALLOCATIONS_CREATE_TABLE = """
 CREATE TABLE Allocations (
     user_id text NOT NULL,
@@ -31,12 +64,142 @@ ALLOCATIONS_DROP_TABLE = """
 DROP TABLE IF EXISTS Allocations;
 """
 
+# Removes the given (user_id, park_id) allocations, if they still exist, and
+# gives their slots back to the lots. Returns the allocations removed.
+ALLOCATIONS_BULK_DELETE = """
+WITH removed AS (
+    DELETE FROM Allocations a
+    USING unnest($1::text[], $2::integer[]) AS r(user_id, park_id)
+    WHERE a.user_id = r.user_id AND a.park_id = r.park_id
+    RETURNING a.user_id, a.park_id
+), counts AS (
+    SELECT park_id, count(*) AS n FROM removed GROUP BY park_id
+), released AS (
+    UPDATE ParkingLots p
+    SET num_allocated = GREATEST(p.num_allocated - counts.n, 0)
+    FROM counts
+    WHERE p.id = counts.park_id
+)
+SELECT user_id, park_id FROM removed;
+"""
+
+# Which worker process holds the WebSocket of each connected user.
+# Also created on start by DbAccess, for databases whose tables predate it.
+SESSIONS_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS Sessions (
+    user_id         text PRIMARY KEY,
+    worker          text NOT NULL,
+    connected_at    timestamptz NOT NULL DEFAULT now()
+);
+"""
+
+SESSIONS_DROP_TABLE = """
+DROP TABLE IF EXISTS Sessions;
+"""
+
+SESSIONS_REGISTER = """
+INSERT INTO Sessions (user_id, worker)
+VALUES ($1, $2)
+ON CONFLICT (user_id) DO UPDATE SET worker = EXCLUDED.worker, connected_at = now();
+"""
+
+SESSIONS_UNREGISTER = """
+DELETE FROM Sessions WHERE user_id = $1 AND worker = $2;
+"""
+
+SESSIONS_UNREGISTER_WORKER = """
+DELETE FROM Sessions WHERE worker = $1;
+"""
+
+# Every worker keeps a connection open named after its instance_id, so a worker with none has died.
+SESSIONS_UNREGISTER_DEAD = """
+DELETE FROM Sessions
+WHERE worker NOT IN (SELECT application_name FROM pg_stat_activity WHERE application_name IS NOT NULL);
+"""
+
+SESSIONS_LOCATE = """
+SELECT worker FROM Sessions s
+WHERE user_id = $1 AND EXISTS (SELECT 1 FROM pg_stat_activity WHERE application_name = s.worker);
+"""
+
+NOTIFY = """
+SELECT pg_notify($1, $2);
+"""
+
+# Downsampled availability history, partitioned by day. Partitions are created
+# as rollups for each day arrive, see DbAccess.insert_occupancy_rollups. Every
+# worker rolls up the samples it saw, and partial rollups of the same lot and
+# bucket are merged into one row; last_at orders their last samples.
+# Declarative partitioning and the index on the partitioned table need PostgreSQL 11 or later.
+OCCUPANCY_ROLLUPS_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS OccupancyRollups (
+    park_id         integer NOT NULL,
+    bucket          timestamptz NOT NULL,
+    samples         integer NOT NULL,
+    min_available   integer NOT NULL,
+    max_available   integer NOT NULL,
+    mean_available  float NOT NULL,
+    last_available  integer NOT NULL,
+    last_at         timestamptz NOT NULL
+) PARTITION BY RANGE (bucket);
+"""
+
+OCCUPANCY_ROLLUPS_CREATE_INDEX = """
+CREATE UNIQUE INDEX IF NOT EXISTS occupancyrollups_park_id_bucket_key ON OccupancyRollups (park_id, bucket);
+"""
+
+OCCUPANCY_ROLLUPS_DROP_TABLE = """
+DROP TABLE IF EXISTS OccupancyRollups;
+"""
+
+# Formatted with the day, as YYYYMMDD, and the dates it starts and ends on.
+OCCUPANCY_ROLLUPS_CREATE_PARTITION = """
+CREATE TABLE IF NOT EXISTS occupancyrollups_{0} PARTITION OF OccupancyRollups
+FOR VALUES FROM ('{1}+00') TO ('{2}+00');
+"""
+
+OCCUPANCY_ROLLUPS_MERGE = """
+INSERT INTO OccupancyRollups AS r
+SELECT u.park_id, to_timestamp(u.bucket), u.samples, u.min_available, u.max_available, u.mean_available,
+       u.last_available, to_timestamp(u.last_at)
+FROM unnest($1::integer[], $2::float[], $3::integer[], $4::integer[], $5::integer[], $6::float[],
+            $7::integer[], $8::float[])
+     AS u(park_id, bucket, samples, min_available, max_available, mean_available, last_available, last_at)
+ON CONFLICT (park_id, bucket) DO UPDATE SET
+    samples = r.samples + EXCLUDED.samples,
+    min_available = least(r.min_available, EXCLUDED.min_available),
+    max_available = greatest(r.max_available, EXCLUDED.max_available),
+    mean_available = (r.mean_available * r.samples + EXCLUDED.mean_available * EXCLUDED.samples)
+                     / (r.samples + EXCLUDED.samples),
+    last_available = CASE WHEN EXCLUDED.last_at >= r.last_at THEN EXCLUDED.last_available
+                          ELSE r.last_available END,
+    last_at = greatest(r.last_at, EXCLUDED.last_at);
+"""
+
+OCCUPANCY_ROLLUPS_SELECT = """
+SELECT park_id, extract(epoch FROM bucket)::float AS bucket, samples, min_available, max_available,
+       mean_available, last_available, extract(epoch FROM last_at)::float AS last_at
+FROM OccupancyRollups
+WHERE park_id = ANY($1::integer[]) AND bucket >= to_timestamp($2) AND bucket < to_timestamp($3)
+ORDER BY park_id, bucket;
+"""
+
 PARKINGLOTS_INSERT = """
 INSERT INTO ParkingLots (name, capacity, lat, long, price, num_available, num_allocated)
 VALUES ($1, $2, $3, $4, $5, $6, $7)
 RETURNING id;
 """
 
+PARKINGLOTS_TABLE = 'parkinglots'
+
+PARKINGLOTS_COLUMNS = ('id', 'name', 'capacity', 'lat', 'long', 'price', 'num_available', 'num_allocated')
+
+# Takes $1 IDs from the sequence, for rows loaded with COPY.
+PARKINGLOTS_RESERVE_IDS = """
+SELECT nextval(pg_get_serial_sequence('parkinglots', 'id')) AS id
+FROM generate_series(1, $1);
+"""
+
 PARKINGLOTS_DELETE = """
 DELETE FROM ParkingLots where id=$1
 RETURNING id;
@@ -56,14 +219,146 @@ WHERE id = $1
 RETURNING id;
 """
 
-PARKINGLOTS_INCREMENT_ALLOCATION = """
-UPDATE ParkingLots
-SET num_allocated = num_allocated + 1
-WHERE id = $1
- AND num_allocated < num_available
+PARKINGLOTS_BULK_UPDATE_AVAILABILITY = """
+UPDATE ParkingLots p
+SET num_available = u.available
+FROM unnest($1::integer[], $2::integer[]) AS u(id, available)
+WHERE p.id = u.id
+RETURNING p.id;
+"""
+
+PARKINGLOTS_BULK_UPDATE_PRICE = """
+UPDATE ParkingLots p
+SET price = u.price
+FROM unnest($1::integer[], $2::float[]) AS u(id, price)
+WHERE p.id = u.id
+RETURNING p.id;
 """
 
 ALLOCATIONS_INSERT = """
 INSERT INTO Allocations (user_id, park_id)
 VALUES ($1, $2)
 """
+
+# Checks the user has no allocation, takes a slot and records the allocation
+# in one statement. Returns the lot ID, or no row if nothing was allocated.
+PARKINGLOTS_ALLOCATE = """
+WITH lot AS (
+    UPDATE ParkingLots
+    SET num_allocated = num_allocated + 1
+    WHERE id = $2
+      AND num_allocated < num_available
+      AND NOT EXISTS (SELECT 1 FROM Allocations WHERE user_id = $1)
+    RETURNING id
+)
+INSERT INTO Allocations (user_id, park_id)
+SELECT $1, id FROM lot
+RETURNING park_id;
+"""
+
+# Takes up to $2 free slots of a lot at once. Returns how many were taken.
+PARKINGLOTS_RESERVE = """
+UPDATE ParkingLots p
+SET num_allocated = p.num_allocated + r.n
+FROM (SELECT id, LEAST($2, num_available - num_allocated) AS n
+      FROM ParkingLots WHERE id = $1 FOR UPDATE) r
+WHERE p.id = r.id AND r.n > 0
+RETURNING r.n;
+"""
+
+PARKINGLOTS_RELEASE = """
+UPDATE ParkingLots
+SET num_allocated = GREATEST(num_allocated - $2, 0)
+WHERE id = $1;
+"""
+
+PARKINGLOTS_SELECT_ALL = """
+SELECT id, name, capacity, lat, long, price, num_available, num_allocated
+FROM ParkingLots;
+"""
+
+PARKINGLOTS_SELECT_BY_ID = """
+SELECT id, name, capacity, lat, long, price, num_available, num_allocated
+FROM ParkingLots
+WHERE id = $1;
+"""
+
+PARKINGLOTS_SELECT_BY_IDS = """
+SELECT id, name, capacity, lat, long, price, num_available, num_allocated
+FROM ParkingLots
+WHERE id = ANY($1::integer[]);
+"""
+
+PARKINGLOTS_LOCK_BY_IDS = """
+SELECT id FROM ParkingLots
+WHERE id = ANY($1::integer[])
+ORDER BY id
+FOR UPDATE;
+"""
+
+# Grants as many of the (user_id, park_id) pairs as capacity allows, skipping
+# users that already hold an allocation, and bumps each lot's counter once.
+ALLOCATIONS_BULK_INSERT = """
+WITH requested AS (
+    SELECT r.user_id, r.park_id,
+           row_number() OVER (PARTITION BY r.park_id ORDER BY r.ord) AS rank
+    FROM unnest($1::text[], $2::integer[]) WITH ORDINALITY AS r(user_id, park_id, ord)
+    WHERE NOT EXISTS (SELECT 1 FROM Allocations a WHERE a.user_id = r.user_id)
+), granted AS (
+    INSERT INTO Allocations (user_id, park_id)
+    SELECT q.user_id, q.park_id
+    FROM requested q JOIN ParkingLots p ON p.id = q.park_id
+    WHERE q.rank <= p.num_available - p.num_allocated
+    RETURNING user_id, park_id
+), bumped AS (
+    UPDATE ParkingLots p
+    SET num_allocated = p.num_allocated + g.n
+    FROM (SELECT park_id, count(*) AS n FROM granted GROUP BY park_id) g
+    WHERE p.id = g.park_id
+)
+SELECT user_id, park_id FROM granted;
+"""
+
+# Exports, read through a cursor. The optional filters are an ID range and a
+# (south, west, north, east) bounding box, NULL when unused; allocations are
+# filtered by the ID and location of their lot.
+PARKINGLOTS_EXPORT = """
+SELECT id, name, capacity, lat, long, price, num_available, num_allocated
+FROM ParkingLots
+WHERE ($1::integer IS NULL OR id >= $1) AND ($2::integer IS NULL OR id <= $2)
+  AND ($3::float IS NULL OR lat BETWEEN $3 AND $5 AND long BETWEEN $4 AND $6)
+ORDER BY id;
+"""
+
+ALLOCATIONS_EXPORT = """
+SELECT a.user_id, a.park_id
+FROM Allocations a JOIN ParkingLots p ON p.id = a.park_id
+WHERE ($1::integer IS NULL OR p.id >= $1) AND ($2::integer IS NULL OR p.id <= $2)
+  AND ($3::float IS NULL OR p.lat BETWEEN $3 AND $5 AND p.long BETWEEN $4 AND $6)
+ORDER BY a.park_id, a.user_id;
+"""
+
+# Statements that DbAccess prepares on every pooled connection.
+PREPARED_STATEMENTS = (
+    PARKINGLOTS_INSERT,
+    PARKINGLOTS_RESERVE_IDS,
+    PARKINGLOTS_DELETE,
+    PARKINGLOTS_UPDATE_AVAILABILITY,
+    PARKINGLOTS_UPDATE_PRICE,
+    PARKINGLOTS_BULK_UPDATE_AVAILABILITY,
+    PARKINGLOTS_BULK_UPDATE_PRICE,
+    PARKINGLOTS_ALLOCATE,
+    PARKINGLOTS_RESERVE,
+    PARKINGLOTS_RELEASE,
+    ALLOCATIONS_INSERT,
+    PARKINGLOTS_SELECT_ALL,
+    PARKINGLOTS_SELECT_BY_ID,
+    PARKINGLOTS_SELECT_BY_IDS,
+    PARKINGLOTS_LOCK_BY_IDS,
+    ALLOCATIONS_BULK_INSERT,
+    ALLOCATIONS_BULK_DELETE,
+    SESSIONS_REGISTER,
+    SESSIONS_UNREGISTER,
+    SESSIONS_LOCATE,
+    NOTIFY,
+)
@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import List, Optional, TextIO
+
+from parking.backend.db.dbaccess import DbAccess
+from parking.backend.db.export import CONTENT_TYPES, EXPORTS, ChunkFormatter, ExportFilter, parse_bbox
+from parking.backend.db.pool import PoolConfig
+from parking.backend.db.provision import IMPORT_FORMATS, Rejected, read_rows, validate_batches
+
+
+async def export(dba: DbAccess, table: str, fmt: str, export_filter: ExportFilter, chunk_size: int,
+                 out: TextIO) -> int:
+    """Write a table to out chunk by chunk. Returns the number of rows written."""
+    formatter = ChunkFormatter(fmt, EXPORTS[table][1])
+    async for records in dba.export(table, export_filter, chunk_size):
+        out.write(formatter.format(records))
+    out.write(formatter.finish())
+    return formatter.rows
+
+
+async def import_lots(dba: DbAccess, stream: TextIO, fmt: str, batch_size: int = 5000,
+                      rejected: Optional[Rejected] = None) -> List[int]:
+    """Load the lots in stream. Returns their IDs in the order of the input.
+
+    Servers already running pick the new lots up once the import commits: every
+    row fires the ParkingLots NOTIFY trigger, which their LotIndexSync follows.
+    """
+    return await dba.insert_parking_lots(validate_batches(read_rows(stream, fmt), fmt, batch_size, rejected))
+
+
+def add_commands(commands: argparse._SubParsersAction) -> None:
+    """Add the database commands to a parser that already has a --db option."""
+    export_parser = commands.add_parser('export', help="Stream a table out as NDJSON or CSV")
+    export_parser.add_argument("table", choices=sorted(EXPORTS))
+    export_parser.add_argument("--format", choices=sorted(CONTENT_TYPES), default='ndjson')
+    export_parser.add_argument("--output", default='-', help="File to write, - for standard output")
+    export_parser.add_argument("--min-id", type=int, help="Only lots with at least this ID")
+    export_parser.add_argument("--max-id", type=int, help="Only lots with at most this ID")
+    export_parser.add_argument("--bbox", type=parse_bbox, metavar='S,W,N,E', help="Only lots inside this box")
+    export_parser.add_argument("--chunk", type=int, default=1000, help="Rows read from the cursor at a time")
+
+    import_parser = commands.add_parser('import', help="Create lots in bulk from CSV or NDJSON")
+    import_parser.add_argument("input", help="File to read, - for standard input")
+    import_parser.add_argument("--format", choices=IMPORT_FORMATS,
+                               help="Input format, by default from the file extension")
+    import_parser.add_argument("--batch", type=int, default=5000, help="Lots validated and copied at a time")
+    import_parser.add_argument("--skip-invalid", action='store_true',
+                               help="Report invalid rows and load the rest, instead of loading nothing")
+    import_parser.add_argument("--ids", default='-', help="File to write the new IDs to, one per lot in input order")
+
+
+async def _run(args: argparse.Namespace, loop: asyncio.AbstractEventLoop) -> None:
+    dba = await DbAccess.create(args.db, loop=loop, cache_lots=False, pool_config=PoolConfig(min_size=1, max_size=1))
+    try:
+        if args.command == 'export':
+            export_filter = ExportFilter(args.min_id, args.max_id, args.bbox)
+            out = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+            try:
+                rows = await export(dba, args.table, args.format, export_filter, args.chunk, out)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+            print('Exported {} rows'.format(rows), file=sys.stderr)
+
+        elif args.command == 'import':
+            fmt = args.format or os.path.splitext(args.input)[1].lstrip('.').lower()
+            if fmt not in IMPORT_FORMATS:
+                raise SystemExit('Cannot tell the format of {}, give --format'.format(args.input))
+            rejected: Optional[Rejected] = [] if args.skip_invalid else None
+            start = time.perf_counter()
+            stream = sys.stdin if args.input == '-' else open(args.input, newline='')
+            try:
+                park_ids = await import_lots(dba, stream, fmt, args.batch, rejected)
+            except ValueError as err:
+                raise SystemExit('Nothing imported, invalid input at {}'.format(err))
+            finally:
+                if stream is not sys.stdin:
+                    stream.close()
+            for line_num, error in rejected or []:
+                print('Skipped line {}: {}'.format(line_num, error), file=sys.stderr)
+            out = sys.stdout if args.ids == '-' else open(args.ids, 'w')
+            try:
+                out.writelines('{}\n'.format(park_id) for park_id in park_ids)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+            print('Imported {} lots in {:.2f}s'.format(len(park_ids), time.perf_counter() - start), file=sys.stderr)
+    finally:
+        await dba.close()
+
+
+def run_command(args: argparse.Namespace) -> None:
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_run(args, loop))
+    finally:
+        loop.close()
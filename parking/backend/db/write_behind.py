@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger('backend')
+
+FlushFunction = Callable[[Iterable[Tuple[int, int]]], Awaitable[List[int]]]
+
+
+class AvailabilityBuffer(object):
+    """Write-behind buffer for lot availability.
+
+    Only the latest availability of each lot is kept. The dirty set is written
+    with one call to `flush_function` every `interval` seconds, or as soon as
+    `max_pending` lots are dirty. `coalesced` counts the row writes saved by
+    overwriting an update that had not been written yet.
+    """
+    def __init__(self, flush_function: FlushFunction, interval: float = 1.0, max_pending: int = 1000) -> None:
+        self.flush_function = flush_function
+        self.interval = interval
+        self.max_pending = max_pending
+        self.pending: Dict[int, int] = {}
+        self.received = 0
+        self.written = 0
+        self.coalesced = 0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Future] = None
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def add(self, park_id: int, availability: int) -> None:
+        self.received += 1
+        if park_id in self.pending:
+            self.coalesced += 1
+        self.pending[park_id] = availability
+        if len(self.pending) >= self.max_pending and not self._lock.locked():
+            asyncio.ensure_future(self.flush())
+
+    async def flush(self) -> int:
+        """Write out the dirty set. Returns the number of lots written."""
+        async with self._lock:
+            if not self.pending:
+                return 0
+            batch, self.pending = self.pending, {}
+            try:
+                await self.flush_function(batch.items())
+            except Exception:
+                # Keep the values for the next attempt unless they were overwritten meanwhile.
+                for park_id, availability in batch.items():
+                    self.pending.setdefault(park_id, availability)
+                raise
+            self.written += len(batch)
+            return len(batch)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """Stop the periodic flush and write out anything still pending."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush {} availability updates".format(len(self.pending)))
+
+    def stats(self) -> Dict[str, int]:
+        return {'pending': len(self.pending), 'received': self.received,
+                'written': self.written, 'coalesced': self.coalesced}
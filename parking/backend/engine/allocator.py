@@ -0,0 +1,232 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Sequence
+
+import attr
+import numpy as np
+
+from parking.backend.db.dbaccess import DbAccess
+from parking.backend.db.lot_cache import LotEntry
+from parking.backend.engine.forecast import AvailabilityForecaster
+from parking.backend.engine.lot_index import LotIndex
+from parking.backend.engine.offers import OfferExpiry
+from parking.backend.user_server.payload_cache import LotPayloadCache
+from parking.backend.user_server.wsserver import UserSessions
+from parking.shared.location import Location
+from parking.shared.location_array import LocationArray
+from parking.shared.rest_models import ParkingLot
+from parking.shared.util import trusted
+from parking.shared.ws_models import ParkingAllocationMessage, ParkingRequestMessage
+
+logger = logging.getLogger('backend')
+
+# The reason given in the error of the ParkingAllocationMessage sent to a user not granted a lot.
+NO_LOT_AVAILABLE = 'no_lot_available'
+ALLOCATION_FAILED = 'allocation_failed'
+
+
+@attr.s
+class PendingRequest:
+    user_id: str = attr.ib()
+    location: Location = attr.ib()
+    preferences: dict = attr.ib(factory=dict)
+
+
+def solve_assignment(cost: np.ndarray, capacity: np.ndarray) -> np.ndarray:
+    '''Assign each row (user) to at most one column (lot) without exceeding capacity.
+
+    Every unassigned user proposes to its cheapest remaining lot at once; each lot
+    accepts its cheapest proposals up to its remaining capacity and the rest mask
+    that lot out and try again. Infinite cost marks a forbidden pair. Returns the
+    chosen column for every row, or -1 where no lot could be assigned.
+    '''
+    cost = np.array(cost, dtype=np.float64)
+    n_users, n_lots = cost.shape
+    assignment = np.full(n_users, -1, dtype=np.int64)
+    remaining = np.array(capacity, dtype=np.int64)
+    cost[:, remaining <= 0] = np.inf
+    active = np.isfinite(cost).any(axis=1)
+
+    while active.any():
+        users = np.flatnonzero(active)
+        choice = np.argmin(cost[users], axis=1)
+        order = np.lexsort((cost[users, choice], choice))
+        users, choice = users[order], choice[order]
+        rank = np.arange(len(choice)) - np.searchsorted(choice, choice, side='left')
+        accepted = rank < remaining[choice]
+
+        assignment[users[accepted]] = choice[accepted]
+        remaining -= np.bincount(choice[accepted], minlength=n_lots)
+        cost[:, remaining <= 0] = np.inf
+
+        rejected = users[~accepted]
+        cost[rejected, choice[~accepted]] = np.inf
+        active[:] = False
+        active[rejected] = np.isfinite(cost[rejected]).any(axis=1)
+
+    return assignment
+
+
+class AllocationEngine(object):
+    """Allocates parking lots to users in short batched rounds.
+
+    Requests are collected as they arrive and every `interval` seconds the whole
+    batch is solved together: a users x candidate lots cost matrix is built from
+    distance, price and how full each lot is, the assignment is solved in bulk and
+    the result is written with a single `DbAccess.allocate_parking_lots` call.
+
+    Every user in a round is sent a ParkingAllocationMessage: with the lot
+    granted, or with no lot and an error giving the reason, whether no lot had
+    room, another request got there first or the round failed.
+
+    With `offers`, every allocation sent out is held as an offer that is taken
+    back if the driver rejects it or does not accept it in time. With a
+    `forecaster`, how full a lot is counts as forecast for when the driver gets
+    there, travelling at `travel_speed` metres per second, instead of as it is now.
+    """
+    def __init__(self, dba: DbAccess, lot_index: LotIndex, user_sessions: UserSessions,
+                 interval: float = 0.2, candidates: int = 10, distance_weight: float = 1.0,
+                 price_weight: float = 0.1, occupancy_weight: float = 1.0,
+                 offers: Optional[OfferExpiry] = None, forecaster: Optional[AvailabilityForecaster] = None,
+                 travel_speed: float = 8.0, payloads: Optional[LotPayloadCache] = None) -> None:
+        self.dba = dba
+        self.lot_index = lot_index
+        self.usessions = user_sessions
+        self.interval = interval
+        self.candidates = candidates
+        self.distance_weight = distance_weight
+        self.price_weight = price_weight
+        self.occupancy_weight = occupancy_weight
+        self.offers = offers
+        self.forecaster = forecaster
+        self.travel_speed = travel_speed
+        self.payloads = payloads
+        self.pending: Dict[str, PendingRequest] = {}
+        self._task: Optional[asyncio.Future] = None
+
+    def submit(self, user_id: str, msg: ParkingRequestMessage) -> None:
+        """Queue a request for the next round, replacing any earlier one from the same user."""
+        self.pending[user_id] = PendingRequest(user_id, msg.location, msg.preferences)
+
+    def accept(self, user_id: str, park_id: int) -> None:
+        if self.offers is not None:
+            self.offers.accept(user_id, park_id)
+
+    def reject(self, user_id: str, park_id: int) -> None:
+        if self.offers is not None:
+            self.offers.reject(user_id, park_id)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.pending:
+                try:
+                    await self.run_round()
+                except Exception:
+                    logger.exception("Allocation round failed")
+
+    def build_cost_matrix(self, requests: Sequence[PendingRequest], lots: Sequence[LotEntry],
+                          candidates: Sequence[Sequence[int]]) -> np.ndarray:
+        """Cost of sending each user to each lot; np.inf where the pair is not allowed.
+
+        candidates[i] holds the IDs of the lots request i may be sent to.
+        """
+        users = LocationArray.from_locations(r.location for r in requests)
+        lot_locations = LocationArray(np.fromiter((lot.lat for lot in lots), np.float64, len(lots)),
+                                      np.fromiter((lot.long for lot in lots), np.float64, len(lots)))
+        price = np.fromiter((lot.price for lot in lots), np.float64, len(lots))
+        available = np.fromiter((lot.num_available for lot in lots), np.float64, len(lots))
+        allocated = np.fromiter((lot.num_allocated for lot in lots), np.float64, len(lots))
+
+        distance = users.haversine_matrix(lot_locations)
+        if self.forecaster is not None:
+            forecast = self.forecaster.available_at([lot.id for lot in lots], distance / self.travel_speed,
+                                                    [lot.capacity for lot in lots])
+            available = np.where(np.isnan(forecast), available[None, :], forecast)
+        else:
+            available = available[None, :]
+        occupancy = np.divide(allocated, available, out=np.ones_like(available), where=available > 0)
+        cost = (self.distance_weight * distance / 1000.0
+                + self.price_weight * price[None, :]
+                + self.occupancy_weight * occupancy)
+
+        # Only the nearest candidates of each user are considered, minus any lots they rejected.
+        columns = {lot.id: col for col, lot in enumerate(lots)}
+        allowed = np.zeros(cost.shape, dtype=bool)
+        for row, request in enumerate(requests):
+            for lot_id in candidates[row]:
+                col = columns.get(lot_id)
+                if col is not None:
+                    allowed[row, col] = True
+            user = self.usessions.users.get(request.user_id)
+            if user is not None:
+                rejected = [columns[lot_id] for lot_id in user.rejections if lot_id in columns]
+                allowed[row, rejected] = False
+        cost[~allowed] = np.inf
+        return cost
+
+    async def run_round(self) -> Dict[str, Optional[int]]:
+        """Solve and commit one round. Returns the lot granted to each user, or None."""
+        requests = [r for r in self.pending.values() if r.user_id in self.usessions.users]
+        self.pending = {}
+        if not requests:
+            return {}
+
+        results: Dict[str, Optional[int]] = {r.user_id: None for r in requests}
+        reason = NO_LOT_AVAILABLE
+        try:
+            await self._allocate(requests, results)
+        except Exception:
+            reason = ALLOCATION_FAILED
+            raise
+        finally:
+            for user_id, park_id in results.items():
+                if park_id is None:
+                    self.usessions.send_message(user_id, trusted(ParkingAllocationMessage)(None, {'reason': reason}))
+        return results
+
+    async def _allocate(self, requests: Sequence[PendingRequest], results: Dict[str, Optional[int]]) -> None:
+        """Allocate lots to requests, recording each one granted in results and sending it to the user."""
+        candidates = [[lot_id for lot_id, _ in self.lot_index.nearest(r.location, k=self.candidates)]
+                      for r in requests]
+        lot_ids = set(lot_id for lot_ids in candidates for lot_id in lot_ids)
+        lots: List[LotEntry] = await self.dba.get_parking_lots_by_id(sorted(lot_ids))
+        if not lots:
+            logger.warning("No parking lots found for %d requests", len(requests))
+            return
+
+        cost = self.build_cost_matrix(requests, lots, candidates)
+        capacity = np.array([lot.num_available - lot.num_allocated for lot in lots])
+        assignment = solve_assignment(cost, capacity)
+
+        proposed = [(requests[row].user_id, lots[col].id) for row, col in enumerate(assignment) if col >= 0]
+        granted = await self.dba.allocate_parking_lots(proposed)
+        logger.debug("Allocation round: %d requests, %d proposed, %d granted", len(requests), len(proposed),
+                     len(granted))
+
+        by_id = {lot.id: lot for lot in lots}
+        for user_id, park_id in granted:
+            results[user_id] = park_id
+            self._send_allocation(user_id, by_id[park_id])
+            if self.offers is not None:
+                self.offers.offer(user_id, park_id)
+
+    def _send_allocation(self, user_id: str, lot: LotEntry) -> None:
+        """Send the allocation to the user, through the directory if they have since moved to another worker."""
+        user = self.usessions.users.get(user_id)
+        if user is not None and self.payloads is not None:
+            user.session.send_payload(self.payloads.allocation(lot))
+            return
+        # The lot came from the database, so it is valid already.
+        location = trusted(Location)(float(lot.lat), float(lot.long))
+        parking_lot = trusted(ParkingLot)(lot.capacity, lot.name, float(lot.price), location, lot.id)
+        self.usessions.send_message(user_id, trusted(ParkingAllocationMessage)(parking_lot))
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import time
+from typing import Optional, Sequence
+
+import numpy as np
+
+from parking.backend.db.occupancy import OccupancyHistory
+
+logger = logging.getLogger('backend')
+
+SECONDS_PER_DAY = 86400.0
+
+
+class AvailabilityForecaster(object):
+    """Forecasts the availability of every lot from its OccupancyHistory, all lots at once.
+
+    Each lot follows Holt's linear exponential smoothing, adapted to irregular
+    sampling, on top of an additive time-of-day profile: `level` and `trend` (per
+    second) smooth the availability with the profile taken out, and `profile`
+    holds the smoothed deviation from the level for every `bin_seconds` of the
+    day. The forecast h seconds after the last sample is
+
+        level + trend * damping * (1 - exp(-h / damping)) + profile[time of day]
+
+    where the damping keeps the trend from being extrapolated indefinitely.
+    Samples are taken to be at least `min_gap` seconds apart, so that a burst of
+    updates cannot blow up the trend. Forecasts are never below zero, and never
+    above the lot's capacity when `available_at` is given it.
+
+    State is kept per history row. `refresh` folds in only the samples recorded
+    since the previous refresh, one sample position at a time across all lots,
+    then caches forecasts for every multiple of `step` seconds up to
+    `max_horizon`, which `available_at` looks up until the next refresh.
+    """
+    def __init__(self, history: OccupancyHistory, alpha: float = 0.3, beta: float = 0.1, gamma: float = 0.1,
+                 bin_seconds: float = 900.0, damping: float = 900.0, step: float = 30.0,
+                 max_horizon: float = 3600.0, interval: float = 5.0, min_gap: float = 1.0) -> None:
+        self.history = history
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.bin_seconds = bin_seconds
+        self.damping = damping
+        self.step = step
+        self.horizons = np.arange(0.0, max_horizon + step, step)
+        self.interval = interval
+        self.min_gap = min_gap
+        self.level = np.zeros(0)
+        self.trend = np.zeros(0)
+        self.seen = np.zeros(0)
+        self.owner = np.zeros(0, dtype=np.int64)
+        self.profile = np.zeros((0, int(np.ceil(SECONDS_PER_DAY / bin_seconds))))
+        self.forecasts = np.zeros((0, len(self.horizons)))
+        self.refreshed_at: Optional[float] = None
+        self.processed = 0
+        self._task: Optional[asyncio.Future] = None
+
+    def _resize(self) -> None:
+        rows = len(self.history.heads)
+        old = len(self.level)
+        if rows == old:
+            return
+        extra = rows - old
+        self.level = np.concatenate((self.level, np.zeros(extra)))
+        self.trend = np.concatenate((self.trend, np.zeros(extra)))
+        self.seen = np.concatenate((self.seen, np.full(extra, -np.inf)))
+        self.owner = np.concatenate((self.owner, np.full(extra, -1, dtype=np.int64)))
+        self.profile = np.concatenate((self.profile, np.zeros((extra, self.profile.shape[1]))))
+        self.forecasts = np.concatenate((self.forecasts, np.full((extra, len(self.horizons)), np.nan)))
+
+    def _bin(self, timestamp: np.ndarray) -> np.ndarray:
+        return ((timestamp % SECONDS_PER_DAY) // self.bin_seconds).astype(np.int64)
+
+    def _update(self, rows: np.ndarray, t: np.ndarray, y: np.ndarray) -> None:
+        """Fold one sample into the state of each of rows, which must be distinct."""
+        bins = self._bin(t)
+        season = self.profile[rows, bins]
+        first = ~np.isfinite(self.seen[rows])
+        dt = np.where(first, 1.0, np.maximum(t - self.seen[rows], self.min_gap))
+        predicted = self.level[rows] + self.trend[rows] * dt
+        level = np.where(first, y - season, self.alpha * (y - season) + (1 - self.alpha) * predicted)
+        trend = np.where(first, 0.0, self.beta * (level - self.level[rows]) / dt + (1 - self.beta) * self.trend[rows])
+        self.profile[rows, bins] = self.gamma * (y - level) + (1 - self.gamma) * season
+        self.level[rows] = level
+        self.trend[rows] = trend
+        self.seen[rows] = t
+
+    def _fold(self, park_ids: np.ndarray, rows: np.ndarray) -> int:
+        seen = self.seen[rows]
+        times, values = self.history.window(park_ids, since=seen.min())
+        new = times > seen[:, None]
+        # Samples come oldest first, so the new ones of every lot are at the end of its row.
+        columns = np.flatnonzero(new.any(axis=0))
+        for column in range(columns[0] if len(columns) else times.shape[1], times.shape[1]):
+            fresh = new[:, column]
+            self._update(rows[fresh], times[fresh, column], values[fresh, column])
+        return int(new.sum())
+
+    def refresh(self, now: Optional[float] = None) -> int:
+        """Fold in the samples recorded since the last refresh and recompute the forecasts. Returns how many."""
+        now = time.time() if now is None else now
+        self._resize()
+        history = self.history
+        self.forecasts[:] = np.nan
+        self.refreshed_at = now
+        if not history.rows:
+            return 0
+        park_ids = np.fromiter(history.rows.keys(), dtype=np.int64, count=len(history.rows))
+        rows = np.fromiter(history.rows.values(), dtype=np.int64, count=len(history.rows))
+
+        # A row given to another lot since the last refresh starts over.
+        reused = rows[self.owner[rows] != park_ids]
+        self.level[reused] = self.trend[reused] = 0.0
+        self.seen[reused] = -np.inf
+        self.profile[reused] = 0.0
+        self.owner[rows] = park_ids
+
+        # Only lots whose latest sample is newer than what has been folded in need their history read.
+        latest = history.times[rows, (history.heads[rows] - 1) % history.samples]
+        changed = latest > self.seen[rows]
+        processed = 0
+        if changed.any():
+            processed = self._fold(park_ids[changed], rows[changed])
+        self.processed += processed
+
+        rows = rows[np.isfinite(self.seen[rows])]
+        # exp(-(elapsed + h) / damping) factored into one term per lot and one per horizon.
+        decay = np.exp(-(now - self.seen[rows]) / self.damping)[:, None] * np.exp(-self.horizons / self.damping)
+        trend = self.trend[rows][:, None] * self.damping * (1 - decay)
+        season = self.profile[rows[:, None], self._bin(now + self.horizons)[None, :]]
+        self.forecasts[rows] = np.maximum(self.level[rows][:, None] + trend + season, 0.0)
+        return processed
+
+    def available_at(self, park_ids: Sequence[int], horizons: np.ndarray,
+                     capacities: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Forecast availability of each lot horizons seconds after the last refresh.
+
+        horizons is broadcast against park_ids along the last axis, so a (users x
+        lots) matrix of arrival times gives a matrix of forecasts. Lots without a
+        forecast give NaN. Forecasts are capped at capacities, if given.
+        """
+        rows = np.fromiter((self.history.rows.get(park_id, -1) for park_id in park_ids), dtype=np.int64,
+                           count=len(park_ids))
+        known = rows >= 0
+        known[known] = rows[known] < len(self.owner)
+        known[known] = self.owner[rows[known]] == np.asarray(park_ids)[known]
+        rows = np.where(known, rows, 0)
+        steps = np.clip(np.rint(np.asarray(horizons) / self.step).astype(np.int64), 0, len(self.horizons) - 1)
+        steps, rows = np.broadcast_arrays(steps, rows)
+        if not len(self.forecasts):
+            return np.full(steps.shape, np.nan)
+        forecasts = self.forecasts[rows, steps]
+        if capacities is not None:
+            forecasts = np.minimum(forecasts, np.asarray(capacities, dtype=np.float64))
+        return np.where(known, forecasts, np.nan)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh availability forecasts")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,145 @@
+import heapq
+from math import cos, floor, radians
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from parking.shared.location import EARTH_RADIUS, Location, haversine
+
+CellKey = Tuple[int, int]
+
+# Length in metres of one degree of latitude.
+METRES_PER_DEGREE = radians(1) * EARTH_RADIUS
+
+
+class LotIndex(object):
+    """In-memory grid index over parking lot locations.
+
+    Lots are bucketed into square cells of `cell_size` degrees. Nearest
+    neighbour queries search outwards ring by ring and stop as soon as no
+    unvisited cell can hold a closer lot, so a lookup only touches the cells
+    around the query point. All distances are in metres.
+    """
+    def __init__(self, cell_size: float = 0.01) -> None:
+        if cell_size <= 0:
+            raise ValueError('cell_size must be positive')
+        self.cell_size = cell_size
+        self.lots: Dict[int, Tuple[float, float]] = {}
+        self.cells: Dict[CellKey, Dict[int, Tuple[float, float]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.lots)
+
+    def __contains__(self, lot_id: int) -> bool:
+        return lot_id in self.lots
+
+    def _cell(self, lat: float, long: float) -> CellKey:
+        return floor(lat / self.cell_size), floor(long / self.cell_size)
+
+    def insert(self, lot_id: int, location: Location) -> None:
+        """Add a lot to the index, moving it if it is already present."""
+        if lot_id in self.lots:
+            self.remove(lot_id)
+        point = (location.latitude, location.longitude)
+        self.lots[lot_id] = point
+        self.cells.setdefault(self._cell(*point), {})[lot_id] = point
+
+    def remove(self, lot_id: int) -> bool:
+        """Remove a lot from the index. Returns False if it was not indexed."""
+        point = self.lots.pop(lot_id, None)
+        if point is None:
+            return False
+        key = self._cell(*point)
+        cell = self.cells[key]
+        del cell[lot_id]
+        if not cell:
+            del self.cells[key]
+        return True
+
+    def get_location(self, lot_id: int) -> Optional[Location]:
+        point = self.lots.get(lot_id)
+        return None if point is None else Location(*point)
+
+    @staticmethod
+    def _ring(ci: int, cj: int, r: int) -> Iterator[CellKey]:
+        if r == 0:
+            yield ci, cj
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield ci - r, j
+            yield ci + r, j
+        for i in range(ci - r + 1, ci + r):
+            yield i, cj - r
+            yield i, cj + r
+
+    def _ring_bound(self, lat: float, r: int) -> float:
+        """Lower bound on the distance to any lot outside the first r rings."""
+        if r == 0:
+            return 0.0
+        shrink = cos(radians(min(90.0, abs(lat) + r * self.cell_size)))
+        return r * self.cell_size * METRES_PER_DEGREE * shrink
+
+    def nearest(self, location: Location, k: int = 1,
+                max_distance: Optional[float] = None) -> List[Tuple[int, float]]:
+        """Return up to k (lot_id, distance) pairs, closest first."""
+        if k < 1 or not self.lots:
+            return []
+        lat, long = location.latitude, location.longitude
+        ci, cj = self._cell(lat, long)
+        # Max-heap of the k best candidates, stored as (-distance, lot_id).
+        best: List[Tuple[float, int]] = []
+
+        def consider(cell: Dict[int, Tuple[float, float]]) -> None:
+            for lot_id, (plat, plong) in cell.items():
+                d = haversine(lat, long, plat, plong)
+                if max_distance is not None and d > max_distance:
+                    continue
+                if len(best) < k:
+                    heapq.heappush(best, (-d, lot_id))
+                elif d < -best[0][0]:
+                    heapq.heapreplace(best, (-d, lot_id))
+
+        visited = 0
+        r = 0
+        while visited < len(self.cells):
+            if 8 * r > len(self.cells) - visited:
+                # The ring is larger than what is left: scan the rest directly.
+                for (i, j), cell in self.cells.items():
+                    if max(abs(i - ci), abs(j - cj)) >= r:
+                        consider(cell)
+                break
+            for key in self._ring(ci, cj, r):
+                cell = self.cells.get(key)
+                if cell is not None:
+                    visited += 1
+                    consider(cell)
+            bound = self._ring_bound(lat, r)
+            if len(best) == k and -best[0][0] <= bound:
+                break
+            if max_distance is not None and bound > max_distance:
+                break
+            r += 1
+
+        return [(lot_id, -neg_d) for neg_d, lot_id in sorted(best, reverse=True)]
+
+    def cells_within(self, location: Location, radius: float) -> List[CellKey]:
+        """Keys of the non-empty cells that may hold a lot within radius metres of location."""
+        lat, long = location.latitude, location.longitude
+        dlat = radius / METRES_PER_DEGREE
+        dlong = dlat / max(cos(radians(min(90.0, abs(lat) + dlat))), 1e-9)
+        i0, j0 = self._cell(lat - dlat, long - dlong)
+        i1, j1 = self._cell(lat + dlat, long + dlong)
+
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.cells):
+            return [(i, j) for (i, j) in self.cells if i0 <= i <= i1 and j0 <= j <= j1]
+        return [key for key in ((i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)) if key in self.cells]
+
+    def within(self, location: Location, radius: float) -> List[Tuple[int, float]]:
+        """Return all (lot_id, distance) pairs within radius metres, closest first."""
+        lat, long = location.latitude, location.longitude
+        found = []
+        for key in self.cells_within(location, radius):
+            for lot_id, (plat, plong) in self.cells[key].items():
+                d = haversine(lat, long, plat, plong)
+                if d <= radius:
+                    found.append((lot_id, d))
+        found.sort(key=lambda pair: pair[1])
+        return found
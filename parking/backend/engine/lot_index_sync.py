@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Optional, Set
+
+from parking.backend.db.dbaccess import DbAccess
+from parking.backend.engine.lot_index import LotIndex
+from parking.shared.location import Location
+from parking.shared.util import trusted
+
+logger = logging.getLogger('backend')
+
+
+class LotIndexSync(object):
+    """Keeps a LotIndex in step with the lots that other processes insert and delete.
+
+    Each worker process has its own LotIndex and updates it for the lots created
+    and deleted through its own handlers; this follows the change notifications
+    of everyone else, e.g. other workers or a bulk import. Inserted lots are
+    fetched in batches, one query for all the lots notified while the previous
+    query was running, so a bulk import does not cost a query per lot.
+    """
+    def __init__(self, lot_index: LotIndex, dba: DbAccess) -> None:
+        self.lot_index = lot_index
+        self.dba = dba
+        self.inserted: Set[int] = set()
+        # Lots deleted while a fetch that may still return them is running.
+        self.deleted: Set[int] = set()
+        self._task: Optional[asyncio.Future] = None
+
+    async def start(self) -> None:
+        await self.dba.follow_lot_changes(self.changed)
+
+    def changed(self, operation: str, lot_id: int) -> None:
+        if operation == 'INSERT':
+            self.inserted.add(lot_id)
+            self.deleted.discard(lot_id)
+            if self._task is None:
+                self._task = asyncio.ensure_future(self._fetch())
+        elif operation == 'DELETE':
+            self.inserted.discard(lot_id)
+            self.lot_index.remove(lot_id)
+            if self._task is not None:
+                self.deleted.add(lot_id)
+
+    async def _fetch(self) -> None:
+        try:
+            while self.inserted:
+                park_ids, self.inserted = sorted(self.inserted), set()
+                lots = await self.dba.get_parking_lots_by_id(park_ids)
+                for lot in lots:
+                    if lot.id not in self.deleted:
+                        self.lot_index.insert(lot.id, trusted(Location)(float(lot.lat), float(lot.long)))
+                self.deleted.clear()
+        except Exception:
+            logger.exception("Failed to index parking lots added elsewhere")
+        finally:
+            self._task = None
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from parking.backend.db.dbaccess import DbAccess
+from parking.backend.engine.timer_wheel import TimerWheel
+from parking.backend.metrics import OFFERS_EXPIRED, OFFERS_REJECTED
+from parking.backend.user_server.wsserver import UserSessions
+from parking.shared.ws_models import ParkingDeallocationMessage
+
+logger = logging.getLogger('backend')
+
+
+class OfferExpiry(object):
+    """Takes back allocations that the driver did not answer in time, or rejected.
+
+    Every allocation sent to a driver is an offer held in a TimerWheel until
+    it is accepted. A single coroutine turns the wheel every `tick` seconds, and
+    the offers that expired or were rejected since the last turn are deallocated
+    together with one `DbAccess.deallocate_parking_lots` call. Drivers whose
+    offer expired are sent a ParkingDeallocationMessage.
+    """
+    def __init__(self, dba: DbAccess, user_sessions: Optional[UserSessions] = None, timeout: float = 60.0,
+                 tick: float = 0.5, slots: int = 512) -> None:
+        self.dba = dba
+        self.usessions = user_sessions
+        self.timeout = timeout
+        self.tick = tick
+        self.wheel = TimerWheel(tick, slots, start=time.monotonic())
+        self.rejected: Dict[str, int] = {}
+        # Expired offers whose release failed, retried on the next turn and still reported as expired.
+        self.retry_expired: Dict[str, int] = {}
+        self.expired = 0
+        self.released = 0
+        self._task: Optional[asyncio.Future] = None
+
+    def __len__(self) -> int:
+        return len(self.wheel)
+
+    def offer(self, user_id: str, park_id: int) -> None:
+        self.wheel.schedule(user_id, self.timeout, park_id)
+
+    def accept(self, user_id: str, park_id: int) -> bool:
+        """Keep the allocation. Returns False if there was no such offer, e.g. because it expired."""
+        if self.wheel.get(user_id) != park_id:
+            return False
+        self.wheel.cancel(user_id)
+        return True
+
+    def reject(self, user_id: str, park_id: int) -> bool:
+        """Give the allocation back on the next turn of the wheel."""
+        if self.wheel.get(user_id) != park_id:
+            return False
+        self.wheel.cancel(user_id)
+        self.rejected[user_id] = park_id
+        OFFERS_REJECTED.inc()
+        return True
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """Stop turning the wheel and release every offer still held.
+
+        Offers still waiting for an answer are withdrawn as if they had expired,
+        since nothing would release them after the process exits.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for user_id, park_id in self.wheel.clear():
+            self.retry_expired.setdefault(user_id, park_id)
+        await self.turn()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.turn()
+            except Exception:
+                logger.exception("Failed to release expired parking offers")
+
+    @staticmethod
+    def _take(offers: Dict[str, int]) -> List[Tuple[str, int]]:
+        taken = list(offers.items())
+        offers.clear()
+        return taken
+
+    def _take_rejected(self) -> List[Tuple[str, int]]:
+        return self._take(self.rejected)
+
+    async def turn(self, now: Optional[float] = None) -> List[Tuple[str, int]]:
+        """Release every offer that expired by now or was rejected. Returns the expired offers released."""
+        expired = self.wheel.advance(time.monotonic() if now is None else now) + self._take(self.retry_expired)
+        rejected = self._take_rejected()
+        try:
+            released = await self.release(expired + rejected)
+        except Exception:
+            # Try again on the next turn rather than leaking the slots.
+            for user_id, park_id in expired:
+                self.retry_expired.setdefault(user_id, park_id)
+            for user_id, park_id in rejected:
+                self.rejected.setdefault(user_id, park_id)
+            raise
+        expired_set = set(expired)
+        expired = [allocation for allocation in released if allocation in expired_set]
+        self.expired += len(expired)
+        OFFERS_EXPIRED.inc(len(expired))
+        if self.usessions is not None:
+            for user_id, park_id in expired:
+                self.usessions.send_message(user_id, ParkingDeallocationMessage(park_id))
+        return expired
+
+    async def release(self, allocations: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        if not allocations:
+            return []
+        released = await self.dba.deallocate_parking_lots(allocations)
+        self.released += len(released)
+        if released:
+            logger.info("Released %d unanswered or rejected parking offers", len(released))
+        return released
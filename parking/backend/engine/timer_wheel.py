@@ -0,0 +1,72 @@
+from math import ceil
+from typing import Any, Dict, Hashable, List, Tuple
+
+
+class TimerWheel(object):
+    """Hashed timing wheel holding many timeouts at O(1) per schedule or cancel.
+
+    Time advances in ticks of `tick` seconds. A timeout due at tick t lives in
+    slot t % slots, keyed by its key, so scheduling and cancelling are dict
+    operations. `advance` visits only the slots of the ticks that have passed;
+    timeouts further away than a full turn of the wheel stay in their slot until
+    their own tick comes round.
+    """
+    def __init__(self, tick: float = 0.1, slots: int = 512, start: float = 0.0) -> None:
+        if tick <= 0 or slots < 1:
+            raise ValueError('tick must be positive and slots at least 1')
+        self.tick = tick
+        self.wheel: List[Dict[Hashable, Tuple[int, Any]]] = [{} for _ in range(slots)]
+        self.positions: Dict[Hashable, int] = {}
+        self.start = start
+        self.current = 0
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.positions
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """The value of key's pending timeout."""
+        slot = self.positions.get(key)
+        if slot is None:
+            return default
+        return self.wheel[slot][key][1]
+
+    def schedule(self, key: Hashable, delay: float, value: Any = None) -> None:
+        """Time out key delay seconds after the last advance, replacing any timeout it already has."""
+        self.cancel(key)
+        due = self.current + max(1, ceil(delay / self.tick))
+        slot = due % len(self.wheel)
+        self.wheel[slot][key] = (due, value)
+        self.positions[key] = slot
+
+    def cancel(self, key: Hashable) -> Any:
+        """Remove key's timeout. Returns its value, or None if it had none."""
+        slot = self.positions.pop(key, None)
+        if slot is None:
+            return None
+        return self.wheel[slot].pop(key)[1]
+
+    def clear(self) -> List[Tuple[Hashable, Any]]:
+        """Remove every pending timeout and return their (key, value)."""
+        pending = [(key, value) for bucket in self.wheel for key, (_, value) in bucket.items()]
+        for bucket in self.wheel:
+            bucket.clear()
+        self.positions.clear()
+        return pending
+
+    def advance(self, now: float) -> List[Tuple[Hashable, Any]]:
+        """Move the wheel to time now and return the (key, value) of every timeout that expired."""
+        target = int((now - self.start) / self.tick)
+        expired: List[Tuple[Hashable, Any]] = []
+        # There is nothing to gain from turning the wheel more than once round.
+        first = max(self.current + 1, target - len(self.wheel) + 1)
+        for tick in range(first, target + 1):
+            bucket = self.wheel[tick % len(self.wheel)]
+            due = [key for key, (due, _) in bucket.items() if due <= target]
+            for key in due:
+                expired.append((key, bucket.pop(key)[1]))
+                del self.positions[key]
+        self.current = max(self.current, target)
+        return expired
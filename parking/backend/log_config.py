@@ -0,0 +1,82 @@
+import logging
+import logging.handlers
+import queue
+import sys
+from typing import Dict, Optional
+
+DEFAULT_FORMAT = '%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s'
+
+
+class EventSampler(object):
+    """Decides which occurrences of each event type get logged.
+
+    An event logged at rate r is kept once every 1/r occurrences, evenly spread:
+    rate 1.0 keeps everything and 0.0 nothing. Events without a rate use
+    `default`.
+    """
+    def __init__(self, rates: Optional[Dict[str, float]] = None, default: float = 1.0) -> None:
+        self.rates: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.default = default
+        for event, rate in (rates or {}).items():
+            self.set_rate(event, rate)
+
+    def set_rate(self, event: str, rate: float) -> None:
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError('Sampling rate of {} must be between 0 and 1'.format(event))
+        self.rates[event] = rate
+
+    def sample(self, event: str) -> bool:
+        rate = self.rates.get(event, self.default)
+        if rate >= 1.0:
+            return True
+        count = self.counts.get(event, 0) + 1
+        self.counts[event] = count
+        return int(count * rate) != int((count - 1) * rate)
+
+
+SAMPLER = EventSampler()
+
+
+def log_event(logger: logging.Logger, level: int, event: str, msg: str, *args) -> None:
+    """Log msg % args as an occurrence of event, subject to SAMPLER.
+
+    Nothing is built unless the level is enabled and the sampler keeps the
+    event, and the message is only formatted when the record is emitted.
+    """
+    if logger.isEnabledFor(level) and SAMPLER.sample(event):
+        logger.log(level, msg, *args, extra={'event': event})
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that leaves formatting to the listener's thread.
+
+    The stock QueueHandler formats every record before queueing it, on the
+    thread that logged it. This is safe only because records are handed over
+    with their arguments, which must not be mutated after logging.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def configure_logging(level: int = logging.INFO, sample_rates: Optional[Dict[str, float]] = None,
+                      stream=None, fmt: str = DEFAULT_FORMAT) -> logging.handlers.QueueListener:
+    """Send the 'backend' logger's records through a queue to a background thread.
+
+    Returns the started QueueListener; stop it at exit to flush what is queued.
+    """
+    for event, rate in (sample_rates or {}).items():
+        SAMPLER.set_rate(event, rate)
+    handler = logging.StreamHandler(sys.stderr if stream is None else stream)
+    handler.setFormatter(logging.Formatter(fmt))
+    records: queue.Queue = queue.Queue()
+    listener = logging.handlers.QueueListener(records, handler)
+
+    logger = logging.getLogger('backend')
+    logger.setLevel(level)
+    for old in [h for h in logger.handlers if isinstance(h, LazyQueueHandler)]:
+        logger.removeHandler(old)
+    logger.addHandler(LazyQueueHandler(records))
+    logger.propagate = False
+    listener.start()
+    return listener
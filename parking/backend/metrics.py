@@ -0,0 +1,240 @@
+import abc
+import functools
+import math
+from bisect import bisect_left
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Upper bounds in seconds, from 50 microseconds to 10 seconds.
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"') for v in labels.values())
+    return '{' + ','.join('{}="{}"'.format(k, v) for k, v in zip(labels, escaped)) + '}'
+
+
+class Registry(object):
+    """A set of metrics rendered together in the Prometheus text format."""
+    def __init__(self) -> None:
+        self.metrics: Dict[str, 'Metric'] = {}
+
+    def register(self, metric: 'Metric') -> None:
+        if metric.name in self.metrics:
+            raise ValueError('Duplicate metric: {}'.format(metric.name))
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation.replace('\n', ' ')))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            for suffix, labels, value in metric.samples():
+                lines.append('{}{}{} {}'.format(metric.name, suffix, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric(abc.ABC):
+    """Base of the metric types. A metric with label names holds one child per combination of values."""
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self.children[()] = self._new_child()
+        if registry is not None:
+            registry.register(self)
+
+    @abc.abstractmethod
+    def _new_child(self) -> object:
+        """A new child holding the value of one combination of label values."""
+
+    def labels(self, *values: str):
+        """The child for the given label values. Keep it around on hot paths to skip the lookup."""
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError('Expected {} label values'.format(len(self.labelnames)))
+            child = self.children[values] = self._new_child()
+        return child
+
+    def _children(self) -> Iterator[Tuple[Dict[str, str], object]]:
+        for values, child in list(self.children.items()):
+            yield dict(zip(self.labelnames, values)), child
+
+    @abc.abstractmethod
+    def samples(self) -> Iterator[Sample]:
+        """The (suffix, labels, value) of every sample to render."""
+
+
+class _CounterChild(object):
+    __slots__ = ('value',)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.children[()].inc(amount)
+
+    def samples(self) -> Iterator[Sample]:
+        for labels, child in self._children():
+            yield '_total', labels, child.value
+
+
+class _GaugeChild(object):
+    __slots__ = ('value', 'function')
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Read the value from function whenever the metrics are rendered."""
+        self.function = function
+
+    def get(self) -> float:
+        return self.value if self.function is None else self.function()
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self.children[()].set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.children[()].set_function(function)
+
+    def samples(self) -> Iterator[Sample]:
+        for labels, child in self._children():
+            yield '', labels, child.get()
+
+
+class _HistogramChild(object):
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        # One count per bucket, non-cumulative, plus one for values above the last bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(Metric):
+    """Counts observations into buckets; rendering makes the bucket counts cumulative."""
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float) -> None:
+        self.children[()].observe(value)
+
+    def samples(self) -> Iterator[Sample]:
+        for labels, child in self._children():
+            total = 0
+            for bound, count in zip(self.bounds + (math.inf,), child.counts):
+                total += count
+                yield '_bucket', dict(labels, le=_format_value(bound)), total
+            yield '_count', labels, total
+            yield '_sum', labels, child.sum
+
+
+def timed(histogram: Histogram, errors: Optional[Counter] = None):
+    """Decorator timing a coroutine function into histogram, labelled with the function's name.
+
+    Exceptions raised by the function are counted in errors.
+    """
+    def decorator(function):
+        child = histogram.labels(function.__name__)
+        error_child = None if errors is None else errors.labels(function.__name__)
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            except Exception:
+                if error_child is not None:
+                    error_child.inc()
+                raise
+            finally:
+                child.observe(perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def observe_request(handler) -> None:
+    """Record a finished request of a tornado RequestHandler in HTTP_REQUEST_SECONDS."""
+    child = HTTP_REQUEST_SECONDS.labels(type(handler).__name__, handler.request.method, str(handler.get_status()))
+    child.observe(handler.request.request_time())
+
+
+HTTP_REQUEST_SECONDS = Histogram('parking_http_request_seconds', 'Time to handle an HTTP request.',
+                                 ['handler', 'method', 'code'])
+WS_MESSAGE_SECONDS = Histogram('parking_ws_message_seconds', 'Time to handle a WebSocket message by type.',
+                               ['type'])
+WS_MESSAGE_ERRORS = Counter('parking_ws_message_errors', 'WebSocket messages that could not be handled.')
+WS_MESSAGES_LIMITED = Counter('parking_ws_messages_limited', 'WebSocket messages over a rate limit, by type.',
+                              ['type'])
+LOCATIONS_COALESCED = Counter('parking_locations_coalesced',
+                              'Location updates replaced by a newer one before being applied.')
+DB_SECONDS = Histogram('parking_db_seconds', 'Time spent in each DbAccess method.', ['method'])
+DB_ERRORS = Counter('parking_db_errors', 'DbAccess calls that raised an exception.', ['method'])
+POOL_ACQUIRE_SECONDS = Histogram('parking_db_pool_acquire_seconds', 'Wait for a pooled database connection.')
+POOL_IN_USE = Gauge('parking_db_pool_connections_in_use', 'Pooled database connections currently acquired.')
+POOL_WAITING = Gauge('parking_db_pool_waiting', 'Callers waiting for a pooled database connection.')
+USER_SESSIONS = Gauge('parking_user_sessions', 'Connected WebSocket users.')
+LOOP_LAG_SECONDS = Histogram('parking_loop_lag_seconds', 'How late the event loop ran a timer callback.')
+LOOP_BLOCKED = Counter('parking_loop_blocked', 'Times the event loop was blocked for longer than the threshold.')
+OFFERS_EXPIRED = Counter('parking_offers_expired', 'Allocations released because the driver did not answer.')
+OFFERS_REJECTED = Counter('parking_offers_rejected', 'Allocations rejected by the driver.')
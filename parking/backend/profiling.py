@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Dict, List, Optional
+
+from parking.backend.metrics import LOOP_BLOCKED, LOOP_LAG_SECONDS
+
+logger = logging.getLogger('backend')
+
+
+class LoopLagMonitor(object):
+    """Measures how late the event loop runs its callbacks, and reports what blocks it.
+
+    A coroutine sleeps for `interval` and records how much later than asked it
+    woke up. A watchdog thread checks that the coroutine keeps running. If it
+    has not run for `threshold` seconds, the watchdog logs the loop thread's
+    current stack, which is the callback holding up every other session.
+    """
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.max_lag = 0.0
+        self.blocked = 0
+        self._heartbeat = time.monotonic()
+        self._reported: Optional[float] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Future] = None
+        self._stopped = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.ensure_future(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._stopped.set()
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._heartbeat = now = time.monotonic()
+            lag = max(0.0, now - start - self.interval)
+            LOOP_LAG_SECONDS.observe(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled > self.threshold and self._reported != heartbeat:
+                # Report each stall once, with the stack as it is while the loop is stuck.
+                self._reported = heartbeat
+                self.blocked += 1
+                LOOP_BLOCKED.inc()
+                frame = sys._current_frames().get(self._loop_thread)
+                stack = ''.join(traceback.format_stack(frame)) if frame is not None else 'unavailable\n'
+                logger.warning("Event loop blocked for {:.3f}s, loop thread stack:\n{}".format(stalled, stack))
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return '{} ({}:{})'.format(code.co_name, code.co_filename, code.co_firstlineno)
+
+
+class SamplingProfiler(object):
+    """Samples the stack of a thread at a fixed interval, from another thread.
+
+    The result is in the collapsed-stack format read by flamegraph.pl and
+    speedscope: one line per distinct stack, outermost frame first, with the
+    frames separated by semicolons and followed by the number of samples.
+    """
+    def __init__(self, thread_id: int, interval: float = 0.005) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.stacks: Dict[str, int] = Counter()
+
+    def sample(self) -> None:
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        names: List[str] = []
+        while frame is not None:
+            names.append(_frame_name(frame))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(names))] += 1
+        self.samples += 1
+
+    def run(self, duration: float) -> str:
+        """Sample for duration seconds, blocking the calling thread, and return the collapsed stacks."""
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            self.sample()
+            time.sleep(self.interval)
+        return self.collapsed()
+
+    def collapsed(self) -> str:
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in sorted(self.stacks.items()))
@@ -0,0 +1,115 @@
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import attr
+import numpy as np
+
+from parking.backend.db.dbaccess import DbAccess
+from parking.backend.db.lot_cache import LotEntry
+from parking.backend.engine.lot_index import CellKey, LotIndex
+from parking.shared.location import Location
+from parking.shared.location_array import LocationArray
+from parking.shared.rest_models import ParkingLotStatus
+from parking.shared.util import serialize_model, trusted
+
+Signature = Tuple[Tuple[int, int], ...]
+
+
+@attr.s(slots=True)
+class Tile:
+    """The lots of one LotIndex cell, each already serialized."""
+    signature: Signature = attr.ib()
+    ids: np.ndarray = attr.ib()
+    locations: LocationArray = attr.ib()
+    fragments: List[str] = attr.ib()
+
+
+def serialize_lot(lot: LotEntry) -> str:
+    return serialize_model(trusted(ParkingLotStatus)(lot.id, lot.name, lot.capacity, float(lot.price),
+                                                     trusted(Location)(float(lot.lat), float(lot.long)),
+                                                     lot.num_available, lot.num_allocated))
+
+
+class LotSearch(object):
+    """Radius searches over the lots, answered from serialized tiles.
+
+    A tile is one cell of the LotIndex. Its signature is the (id, version) of
+    every lot in it, with versions from the LotCache, so it changes whenever a
+    lot in the cell is added, removed or changed. The ETag of a search is a
+    digest of the query and the signatures of the tiles it covers, and is known
+    before anything is fetched or serialized. Tiles are kept in an LRU of
+    `max_tiles` and rebuilt only when their signature has changed; a search then
+    only filters their locations by distance and joins the fragments.
+
+    Without the lot cache every version is 0, so tiles are rebuilt for every
+    search and ETags only change with the set of lots.
+    """
+    def __init__(self, dba: DbAccess, lot_index: LotIndex, max_tiles: int = 4096) -> None:
+        self.dba = dba
+        self.lot_index = lot_index
+        self.max_tiles = max_tiles
+        self.tiles: 'OrderedDict[CellKey, Tile]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _signature(self, key: CellKey) -> Signature:
+        cache = self.dba.cache
+        if cache is None:
+            return tuple((lot_id, 0) for lot_id in self.lot_index.cells.get(key, ()))
+        return tuple((lot_id, cache.version_of(lot_id)) for lot_id in self.lot_index.cells.get(key, ()))
+
+    async def refresh(self, keys: List[CellKey]) -> None:
+        """Refetch the lots of these cells that another process has changed."""
+        cache = self.dba.cache
+        if cache is None or not cache.stale:
+            return
+        stale = [lot_id for key in keys for lot_id in self.lot_index.cells.get(key, ()) if lot_id in cache.stale]
+        if stale:
+            await self.dba.get_parking_lots_by_id(stale)
+
+    async def prepare(self, location: Location, radius: float, limit: int) -> Tuple[List[CellKey], str]:
+        """The cells a search covers and its ETag."""
+        keys = self.lot_index.cells_within(location, radius)
+        await self.refresh(keys)
+        digest = hashlib.sha1(repr((location.latitude, location.longitude, radius, limit)).encode())
+        for key in keys:
+            digest.update(repr((key, self._signature(key))).encode())
+        return keys, '"{}"'.format(digest.hexdigest())
+
+    async def _tile(self, key: CellKey) -> Tile:
+        signature = self._signature(key)
+        tile = self.tiles.get(key)
+        if tile is not None and tile.signature == signature and self.dba.cache is not None:
+            self.tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+        self.misses += 1
+        lots = await self.dba.get_parking_lots_by_id([lot_id for lot_id, _ in signature])
+        lots.sort(key=lambda lot: lot.id)
+        tile = Tile(self._signature(key), np.array([lot.id for lot in lots], dtype=np.int64),
+                    LocationArray([lot.lat for lot in lots], [lot.long for lot in lots]),
+                    [serialize_lot(lot) for lot in lots])
+        self.tiles[key] = tile
+        self.tiles.move_to_end(key)
+        while len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return tile
+
+    async def search(self, location: Location, radius: float, limit: int,
+                     keys: Optional[List[CellKey]] = None) -> str:
+        """JSON of a ParkingLotSearchResponse with up to limit lots within radius metres, closest first."""
+        if keys is None:
+            keys = self.lot_index.cells_within(location, radius)
+        distances, fragments = [], []
+        for key in keys:
+            tile = await self._tile(key)
+            distance = tile.locations.haversine(location)
+            for i in np.flatnonzero(distance <= radius):
+                distances.append(distance[i])
+                fragments.append(tile.fragments[i])
+        order = np.argsort(np.array(distances), kind='stable')[:limit]
+        return '{"lots": [' + ', '.join(fragments[i] for i in order) + ']}'
+
+    def stats(self) -> Dict[str, int]:
+        return {'tiles': len(self.tiles), 'hits': self.hits, 'misses': self.misses}
@@ -1,14 +1,42 @@
 import json
+from typing import Any, Callable, Iterable, Optional
+
 from tornado import web
 from parking.shared.rest_models import (ParkingLot, ParkingLotCreationResponse, ParkingLotAvailableMessage,
-                                        ParkingLotPriceMessage)
+                                        ParkingLotPriceMessage, ParkingLotBulkUpdateMessage,
+                                        ParkingLotBulkUpdateResponse)
 from parking.shared.util import serialize_model
 from parking.backend.db.dbaccess import DbAccess
+from parking.backend.engine.lot_index import LotIndex
+from parking.backend.metrics import observe_request
+from parking.backend.sensor_server.lot_search import LotSearch
+from parking.shared.location import Location
+from parking.backend.user_server.notifier import LotUpdateNotifier
+from parking.backend.user_server.payload_cache import LotPayloadCache
 
 
 class ParkingLotHandlerBase(web.RequestHandler):
-    def initialize(self, dba: DbAccess) -> None:
+    def initialize(self, dba: DbAccess, lot_index: Optional[LotIndex] = None,
+                   notifier: Optional[LotUpdateNotifier] = None, lot_search: Optional[LotSearch] = None,
+                   payloads: Optional[LotPayloadCache] = None) -> None:
         self.dba = dba
+        self.lot_index = lot_index
+        self.notifier = notifier
+        self.lot_search = lot_search
+        self.payloads = payloads
+
+    def on_finish(self) -> None:
+        observe_request(self)
+
+    async def notify(self, park_ids: Iterable[int]) -> None:
+        """Drop the cached payloads of changed lots and push their current state to nearby users."""
+        park_ids = list(park_ids)
+        if self.payloads is not None:
+            for park_id in park_ids:
+                self.payloads.invalidate(park_id)
+        if self.notifier is not None:
+            for lot in await self.dba.get_parking_lots_by_id(park_ids):
+                self.notifier.notify(lot)
 
     def write_error(self, status_code, **kwargs):
         self.set_status(status_code)
@@ -21,6 +49,8 @@ class ParkingLotHandlerBase(web.RequestHandler):
             super.write_error(status_code, kwargs)
 
     def prepare(self):
+        if self.request.method in ('GET', 'HEAD'):
+            return
         if self.request.headers.get('Content-Type', '').startswith('application/json'):
             self.json_args = json.loads(self.request.body)
         else:
@@ -39,9 +69,54 @@ class ParkingLotHandlerBase(web.RequestHandler):
 
 
 class ParkingLotsCreationHandler(ParkingLotHandlerBase):
+    MAX_RADIUS = 50000.0
+    MAX_LIMIT = 1000
+
+    def _argument(self, name: str, convert: Callable[[str], Any], default: Any = None) -> Any:
+        value = self.get_query_argument(name, None)
+        if value is None:
+            if default is None:
+                raise web.HTTPError(400, 'Missing {}'.format(name))
+            return default
+        try:
+            return convert(value)
+        except ValueError:
+            raise web.HTTPError(400, 'Invalid {}'.format(name))
+
+    def _float_argument(self, name: str, default: Optional[float] = None) -> float:
+        return self._argument(name, float, default)
+
+    def _int_argument(self, name: str, default: Optional[int] = None) -> int:
+        return self._argument(name, int, default)
+
+    async def get(self):
+        """Lots within radius metres of lat, long, closest first. Answers 304 to an If-None-Match of the ETag."""
+        if self.lot_search is None:
+            raise web.HTTPError(405)
+        lat, long = self._float_argument('lat'), self._float_argument('long')
+        radius = self._float_argument('radius', 1000.0)
+        limit = self._int_argument('limit', 100)
+        if not (-90.0 <= lat <= 90.0 and -180.0 <= long <= 180.0):
+            raise web.HTTPError(400, 'Invalid location')
+        if not 0.0 < radius <= self.MAX_RADIUS:
+            raise web.HTTPError(400, 'radius must be positive and at most {:g}'.format(self.MAX_RADIUS))
+        if not 1 <= limit <= self.MAX_LIMIT:
+            raise web.HTTPError(400, 'limit must be an integer between 1 and {}'.format(self.MAX_LIMIT))
+        location = Location(lat, long)
+        keys, etag = await self.lot_search.prepare(location, radius, limit)
+        self.set_header('Etag', etag)
+        self.set_header('Cache-Control', 'no-cache')
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        self.set_header('Content-Type', 'application/json')
+        self.write(await self.lot_search.search(location, radius, limit, keys))
+
     async def post(self):
         lot = self.load_from_json_data(ParkingLot, self.json_args, 'Invalid parking lot data')
         pid = await self.dba.insert_parking_lot(lot)
+        if self.lot_index is not None:
+            self.lot_index.insert(pid, lot.location)
         self.write(serialize_model(ParkingLotCreationResponse(id=pid)))
 
 
@@ -51,6 +126,7 @@ class IndividualLotPriceHandler(ParkingLotHandlerBase):
         park_id = await self.dba.update_parking_lot_price(int(lot_id), msg.price)
         if not park_id:
             raise web.HTTPError(404, 'Unknown lot ID')
+        await self.notify([park_id])
 
 
 class IndividualLotAvailableHandler(ParkingLotHandlerBase):
@@ -59,14 +135,37 @@ class IndividualLotAvailableHandler(ParkingLotHandlerBase):
         park_id = await self.dba.update_parking_lot_availability(int(lot_id), msg.available)
         if not park_id:
             raise web.HTTPError(404, 'Unknown lot ID')
+        await self.notify([park_id])
+
+
+class ParkingLotsBulkUpdateHandler(ParkingLotHandlerBase):
+    async def post(self):
+        msg = self.load_from_json_data(ParkingLotBulkUpdateMessage, self.json_args, 'Invalid bulk update data')
+        updated = set(await self.dba.update_parking_lots_availability((u.id, u.available) for u in msg.available))
+        updated.update(await self.dba.update_parking_lots_price((u.id, u.price) for u in msg.price))
+        requested = set(u.id for u in msg.available)
+        requested.update(u.id for u in msg.price)
+        response = ParkingLotBulkUpdateResponse(updated=sorted(updated), unknown=sorted(requested - updated))
+        self.write(serialize_model(response))
+        await self.notify(response.updated)
 
 
 class IndividualLotDeleteHandler(web.RequestHandler):
-    def initialize(self, dba: DbAccess) -> None:
+    def initialize(self, dba: DbAccess, lot_index: Optional[LotIndex] = None,
+                   payloads: Optional[LotPayloadCache] = None) -> None:
         self.dba = dba
+        self.lot_index = lot_index
+        self.payloads = payloads
+
+    def on_finish(self) -> None:
+        observe_request(self)
 
     async def delete(self, lot_id: str):
         lot_id = int(lot_id)
         park_id = await self.dba.delete_parking_lot(lot_id)
         if not park_id:
             raise web.HTTPError(404, 'Unknown lot ID')
+        if self.lot_index is not None:
+            self.lot_index.remove(park_id)
+        if self.payloads is not None:
+            self.payloads.invalidate(park_id)
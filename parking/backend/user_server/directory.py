@@ -0,0 +1,104 @@
+import asyncio
+import json
+import logging
+from typing import Optional
+
+import attr
+
+from parking.backend.db.dbaccess import DbAccess
+from parking.backend.user_server.notifier import LotUpdateNotifier
+from parking.backend.user_server.wsserver import UserSessions
+from parking.shared.location import Location
+from parking.shared.ws_models import ParkingLotUpdateMessage, load_ws_message
+
+logger = logging.getLogger('backend')
+
+# Each worker listens on its own channel for messages to its users; lot updates go to every worker.
+SESSION_CHANNEL = 'sessions_{}'
+LOT_UPDATES_CHANNEL = 'lot_updates'
+
+
+class SessionDirectory(object):
+    """Routes messages to users whose WebSocket is held by another worker process.
+
+    Every worker records the users connected to it in the Sessions table. A
+    message for a user held elsewhere is looked up there and sent to the owning
+    worker over Postgres NOTIFY, on a channel named after that worker's
+    `DbAccess.instance_id`. Lot updates pushed by the notifier are broadcast to
+    every worker so that each can reach its own nearby users. Sessions of workers
+    that have died are ignored, and forgotten whenever a worker starts. Once started, the
+    directory is the `relay` of the UserSessions, so that messages sent to a user
+    through them reach the user wherever they are connected.
+    """
+    def __init__(self, dba: DbAccess, user_sessions: UserSessions,
+                 notifier: Optional[LotUpdateNotifier] = None) -> None:
+        self.dba = dba
+        self.usessions = user_sessions
+        self.notifier = notifier
+        self.worker = dba.instance_id
+        self.routed = 0
+        self.received = 0
+
+    async def start(self) -> None:
+        await self.dba.listen(SESSION_CHANNEL.format(self.worker), self._on_message)
+        # Sessions of workers that crashed, or were restarted under a new instance_id, are left behind.
+        dead = await self.dba.unregister_dead_sessions()
+        if dead:
+            logger.info("Forgot %d sessions of workers no longer running", dead)
+        self.usessions.relay = self.relay
+        if self.notifier is not None:
+            await self.dba.listen(LOT_UPDATES_CHANNEL, self._on_lot_update)
+            self.notifier.relay = self.relay_lot_update
+
+    async def close(self) -> None:
+        self.usessions.relay = None
+        if self.notifier is not None:
+            self.notifier.relay = None
+        await self.dba.unregister_sessions()
+
+    async def register(self, user_id: str) -> None:
+        await self.dba.register_session(user_id)
+
+    async def unregister(self, user_id: str) -> None:
+        await self.dba.unregister_session(user_id)
+
+    async def send(self, user_id: str, msg) -> bool:
+        """Send msg to user_id, wherever it is connected. Returns False if it is not connected."""
+        user = self.usessions.users.get(user_id)
+        if user is not None:
+            user.session.send_message(msg)
+            return True
+        worker = await self.dba.locate_session(user_id)
+        if worker is None:
+            return False
+        await self.dba.notify(SESSION_CHANNEL.format(worker), json.dumps([user_id, attr.asdict(msg)]))
+        self.routed += 1
+        return True
+
+    def relay(self, user_id: str, msg) -> None:
+        asyncio.ensure_future(self._relay(user_id, msg))
+
+    async def _relay(self, user_id: str, msg) -> None:
+        try:
+            if not await self.send(user_id, msg):
+                logger.debug("Dropping message for disconnected user_id = '%s'", user_id)
+        except Exception:
+            logger.exception("Failed to route a message to user_id = '%s'", user_id)
+
+    def _on_message(self, conn, pid: int, channel: str, payload: str) -> None:
+        user_id, data = json.loads(payload)
+        user = self.usessions.users.get(user_id)
+        if user is None:
+            logger.debug("Dropping routed message for disconnected user_id = '%s'", user_id)
+            return
+        self.received += 1
+        user.session.send_message(load_ws_message(data))
+
+    def relay_lot_update(self, msg: ParkingLotUpdateMessage, location: Location) -> None:
+        payload = json.dumps([self.worker, location.latitude, location.longitude, attr.asdict(msg)])
+        asyncio.ensure_future(self.dba.notify(LOT_UPDATES_CHANNEL, payload))
+
+    def _on_lot_update(self, conn, pid: int, channel: str, payload: str) -> None:
+        worker, latitude, longitude, data = json.loads(payload)
+        if worker != self.worker:
+            self.notifier.notify_update(load_ws_message(data), Location(latitude, longitude))
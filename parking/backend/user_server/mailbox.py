@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Dict, Optional
+
+from parking.backend.metrics import LOCATIONS_COALESCED
+from parking.shared.location import Location
+
+if TYPE_CHECKING:
+    from parking.backend.user_server.wsserver import UserSessions  # noqa: F401
+
+logger = logging.getLogger('backend')
+
+
+class LocationMailbox(object):
+    """Latest-wins mailbox for the location updates of every user.
+
+    `put` only keeps the location, replacing any the user sent since the last
+    tick; every `interval` seconds `flush` applies what is kept to the session
+    store. A burst of updates from one user therefore costs one store write,
+    and users who have disconnected in the meantime are skipped.
+    """
+    def __init__(self, user_sessions: 'UserSessions', interval: float = 0.1) -> None:
+        self.usessions = user_sessions
+        self.interval = interval
+        self.pending: Dict[str, Location] = {}
+        self.received = 0
+        self.applied = 0
+        self._task: Optional[asyncio.Future] = None
+
+    def put(self, user_id: str, location: Location) -> None:
+        self.received += 1
+        if user_id in self.pending:
+            LOCATIONS_COALESCED.inc()
+        self.pending[user_id] = location
+
+    def flush(self) -> int:
+        """Apply the pending locations. Returns how many were applied."""
+        pending, self.pending = self.pending, {}
+        applied = 0
+        users = self.usessions.users
+        for user_id, location in pending.items():
+            if user_id in users:
+                self.usessions.update_user_location(user_id, location)
+                applied += 1
+        self.applied += applied
+        return applied
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to apply location updates")
+
+    def stats(self) -> Dict[str, int]:
+        return {'pending': len(self.pending), 'received': self.received, 'applied': self.applied}
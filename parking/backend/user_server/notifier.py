@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from tornado.websocket import WebSocketClosedError
+
+from parking.backend.db.lot_cache import LotEntry
+from parking.backend.user_server.payload_cache import LotPayloadCache
+from parking.backend.user_server.wsserver import UserSessions, UserWSHandler
+from parking.shared import ws_codec
+from parking.shared.ws_codec import Payload
+from parking.shared.location import Location
+from parking.shared.util import serialize_model, trusted
+from parking.shared.ws_models import ParkingLotUpdateMessage
+
+logger = logging.getLogger('backend')
+
+
+class LotUpdateNotifier(object):
+    """Pushes lot changes to the connected users near the lot.
+
+    `notify` looks up the users within `radius` metres of the lot in the
+    session store and serializes the update once per wire format, or takes it
+    from `payloads`, where it is serialized once per version of the lot. Each session
+    has an outbox holding at most one update per lot, drained by its own
+    coroutine that waits for every write to reach the socket. A session on a slow
+    connection therefore never blocks the IOLoop or other sessions, and an update
+    still queued when a newer one for the same lot arrives is dropped.
+
+    When running several worker processes, `relay` is called with every update
+    so that it can be passed on to the users connected to the other workers.
+    """
+    def __init__(self, user_sessions: UserSessions, radius: float = 2000.0,
+                 payloads: Optional[LotPayloadCache] = None) -> None:
+        self.usessions = user_sessions
+        self.payloads = payloads
+        self.radius = radius
+        self.outboxes: Dict[UserWSHandler, 'OrderedDict[int, Payload]'] = {}
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.relay: Optional[Callable[[ParkingLotUpdateMessage, Location], None]] = None
+
+    def notify(self, lot: LotEntry) -> int:
+        """Queue the lot's current state for every nearby user. Returns how many were queued."""
+        msg = trusted(ParkingLotUpdateMessage)(lot.id, lot.num_available, float(lot.price))
+        location = trusted(Location)(float(lot.lat), float(lot.long))
+        if self.relay is not None:
+            self.relay(msg, location)
+        return self.notify_update(msg, location, lot)
+
+    def notify_update(self, msg: ParkingLotUpdateMessage, location: Location, lot: Optional[LotEntry] = None) -> int:
+        """Queue msg for every local user near location. With the lot msg is about, its cached payload is sent."""
+        nearby = self.usessions.users_within(location, self.radius)
+        if not nearby:
+            return 0
+        if lot is not None and self.payloads is not None:
+            payload = self.payloads.update(lot)
+        else:
+            payload = (serialize_model(msg), ws_codec.encode_binary(msg))
+
+        queued = 0
+        for user_id, _ in nearby:
+            user = self.usessions.users.get(user_id)
+            if user is None:
+                continue
+            outbox = self.outboxes.get(user.session)
+            if outbox is None:
+                outbox = self.outboxes[user.session] = OrderedDict()
+                asyncio.ensure_future(self._drain(user.session, outbox))
+            elif msg.id in outbox:
+                self.dropped += 1
+            outbox[msg.id] = payload
+            queued += 1
+        self.queued += queued
+        return queued
+
+    async def _drain(self, session: UserWSHandler, outbox: 'OrderedDict[int, Payload]') -> None:
+        try:
+            while outbox:
+                _, (text, data) = outbox.popitem(last=False)
+                await session.write_message(data if session.binary else text, binary=session.binary)
+                self.sent += 1
+        except WebSocketClosedError:
+            self.dropped += len(outbox)
+        except Exception:
+            logger.exception("Failed to push lot updates")
+        finally:
+            del self.outboxes[session]
+
+    def stats(self) -> Dict[str, int]:
+        return {'outboxes': len(self.outboxes), 'queued': self.queued, 'sent': self.sent, 'dropped': self.dropped}
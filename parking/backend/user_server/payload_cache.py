@@ -0,0 +1,84 @@
+from typing import Dict, Optional
+
+import attr
+
+from parking.backend.db.lot_cache import LotEntry
+from parking.shared import ws_codec
+from parking.shared.location import Location
+from parking.shared.rest_models import ParkingLot
+from parking.shared.util import serialize_model, trusted
+from parking.shared.ws_codec import Payload
+from parking.shared.ws_models import ParkingLotUpdateMessage
+
+
+@attr.s(slots=True)
+class LotPayloads:
+    """One version of a lot, serialized as each message needs it. Filled in as they are first asked for."""
+    version: int = attr.ib()
+    lot_text: Optional[str] = attr.ib(default=None)
+    lot_data: Optional[bytes] = attr.ib(default=None)
+    allocation: Optional[Payload] = attr.ib(default=None)
+    update: Optional[Payload] = attr.ib(default=None)
+
+
+class LotPayloadCache(object):
+    """The messages sent to users about each lot, serialized once per version of the lot.
+
+    Every user offered a lot gets the same ParkingAllocationMessage, and every
+    user near a lot the same ParkingLotUpdateMessage. The lot is serialized in
+    both wire formats the first time either is needed, and allocations are
+    spliced together from those fragments.
+
+    Entries are keyed by lot ID and checked against the version the LotCache
+    stamps on every LotEntry, so any change to the lot, from this process or
+    another, is picked up on the next message. The sensor REST handlers also
+    `invalidate` the lots they change or delete. Entries without a version,
+    read while the LotCache is off, cannot be checked and are never kept.
+    """
+    def __init__(self) -> None:
+        self.lots: Dict[int, LotPayloads] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _payloads(self, lot: LotEntry) -> LotPayloads:
+        payloads = self.lots.get(lot.id)
+        if payloads is not None and payloads.version == lot.version:
+            self.hits += 1
+            return payloads
+        self.misses += 1
+        payloads = LotPayloads(lot.version)
+        if lot.version:
+            self.lots[lot.id] = payloads
+        return payloads
+
+    def allocation(self, lot: LotEntry, error: Optional[dict] = None) -> Payload:
+        """A ParkingAllocationMessage offering lot, in both wire formats."""
+        payloads = self._payloads(lot)
+        if payloads.lot_text is None:
+            # The lot came from the database, so it is valid already.
+            parking_lot = trusted(ParkingLot)(lot.capacity, lot.name, float(lot.price),
+                                              trusted(Location)(float(lot.lat), float(lot.long)), lot.id)
+            payloads.lot_text = serialize_model(parking_lot)
+            payloads.lot_data = ws_codec.encode_lot(parking_lot)
+        if error:
+            return ws_codec.allocation_payload(payloads.lot_text, payloads.lot_data, error)
+        if payloads.allocation is None:
+            payloads.allocation = ws_codec.allocation_payload(payloads.lot_text, payloads.lot_data)
+        return payloads.allocation
+
+    def update(self, lot: LotEntry) -> Payload:
+        """A ParkingLotUpdateMessage with the lot's availability and price, in both wire formats."""
+        payloads = self._payloads(lot)
+        if payloads.update is None:
+            msg = trusted(ParkingLotUpdateMessage)(lot.id, lot.num_available, float(lot.price))
+            payloads.update = (serialize_model(msg), ws_codec.encode_binary(msg))
+        return payloads.update
+
+    def invalidate(self, lot_id: int) -> None:
+        self.invalidations += 1
+        self.lots.pop(lot_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self.lots), 'hits': self.hits, 'misses': self.misses,
+                'invalidations': self.invalidations}
@@ -0,0 +1,47 @@
+from typing import Dict, Mapping, Tuple
+
+import attr
+
+from parking.shared.ws_models import WebSocketMessageType
+
+# Messages a second on average, and the most that may arrive at once.
+RateLimit = Tuple[float, float]
+
+DEFAULT_RATE_LIMITS: Dict[WebSocketMessageType, RateLimit] = {
+    WebSocketMessageType.LOCATION_UPDATE: (10.0, 20.0),
+    WebSocketMessageType.PARKING_REQUEST: (1.0, 5.0),
+    WebSocketMessageType.PARKING_ALLOCATION: (1.0, 5.0),
+    WebSocketMessageType.PARKING_ACCEPTANCE: (5.0, 10.0),
+    WebSocketMessageType.PARKING_REJECTION: (5.0, 10.0),
+    WebSocketMessageType.PARKING_DEALLOC: (5.0, 10.0),
+    WebSocketMessageType.PARKING_CANCEL: (5.0, 10.0),
+    WebSocketMessageType.LOT_UPDATE: (1.0, 5.0),
+}
+
+
+@attr.s(slots=True)
+class TokenBucket:
+    """Allows `rate` events a second on average, and up to `burst` at once."""
+    rate: float = attr.ib()
+    burst: float = attr.ib()
+    tokens: float = attr.ib()
+    updated: float = attr.ib()
+
+    def take(self, now: float) -> bool:
+        """Spend a token if there is one. now is a monotonic time in seconds."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+class RateLimiter(object):
+    """The token buckets of one connection, one per limited message type. Each starts full."""
+    def __init__(self, limits: Mapping[int, RateLimit], now: float) -> None:
+        self.buckets = {int(_type): TokenBucket(rate, burst, burst, now) for _type, (rate, burst) in limits.items()}
+
+    def allow(self, _type: int, now: float) -> bool:
+        bucket = self.buckets.get(_type)
+        return bucket is None or bucket.take(now)
@@ -0,0 +1,95 @@
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from parking.shared.location import Location
+from parking.shared.location_array import LocationArray, bounding_box, haversine_distance
+from parking.shared.util import trusted
+
+
+class SessionStore(object):
+    """Locations of connected users, kept column-wise in numpy arrays.
+
+    Each user is given a slot, an index into contiguous float64 arrays of
+    latitude, longitude and time of the last update, so a location update is two
+    array stores and queries over every user are vectorized. Slots of closed
+    sessions are recycled, and the arrays double in size when they run out.
+    Slots without a known location hold NaN.
+    """
+    def __init__(self, initial_capacity: int = 1024) -> None:
+        if initial_capacity < 1:
+            raise ValueError('initial_capacity must be positive')
+        self.lat = np.full(initial_capacity, np.nan)
+        self.long = np.full(initial_capacity, np.nan)
+        self.updated = np.zeros(initial_capacity)
+        self.active = np.zeros(initial_capacity, dtype=bool)
+        self.user_ids: List[Optional[str]] = [None] * initial_capacity
+        self.free: List[int] = list(range(initial_capacity - 1, -1, -1))
+
+    def __len__(self) -> int:
+        return len(self.user_ids) - len(self.free)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.user_ids)
+
+    def _grow(self) -> None:
+        old = self.capacity
+        new = old * 2
+        self.lat = np.concatenate((self.lat, np.full(old, np.nan)))
+        self.long = np.concatenate((self.long, np.full(old, np.nan)))
+        self.updated = np.concatenate((self.updated, np.zeros(old)))
+        self.active = np.concatenate((self.active, np.zeros(old, dtype=bool)))
+        self.user_ids.extend([None] * old)
+        self.free.extend(range(new - 1, old - 1, -1))
+
+    def allocate(self, user_id: str) -> int:
+        """Give a user a slot, with no location yet."""
+        if not self.free:
+            self._grow()
+        slot = self.free.pop()
+        self.user_ids[slot] = user_id
+        self.active[slot] = True
+        self.updated[slot] = time.time()
+        return slot
+
+    def release(self, slot: int) -> None:
+        self.user_ids[slot] = None
+        self.active[slot] = False
+        self.lat[slot] = self.long[slot] = np.nan
+        self.free.append(slot)
+
+    def set_location(self, slot: int, location: Optional[Location], timestamp: Optional[float] = None) -> None:
+        if location is None:
+            self.lat[slot] = self.long[slot] = np.nan
+        else:
+            self.lat[slot] = location.latitude
+            self.long[slot] = location.longitude
+        self.updated[slot] = time.time() if timestamp is None else timestamp
+
+    def get_location(self, slot: int) -> Optional[Location]:
+        lat = self.lat[slot]
+        if np.isnan(lat):
+            return None
+        return trusted(Location)(float(lat), float(self.long[slot]))
+
+    def within(self, location: Location, radius: float) -> List[Tuple[str, float]]:
+        """(user ID, distance in metres) of every located user within radius, nearest first."""
+        # The bounding box cheaply rules out most slots before any trigonometry.
+        # NaN compares false, so users without a location drop out here.
+        points = LocationArray(self.lat, self.long)
+        slots = np.flatnonzero(points.within_box(*bounding_box(location, radius)))
+        if len(slots) == 0:
+            return []
+        distance = haversine_distance(self.lat[slots], self.long[slots], location.latitude, location.longitude)
+        inside = distance <= radius
+        slots, distance = slots[inside], distance[inside]
+        order = np.argsort(distance, kind='stable')
+        return [(self.user_ids[slot], float(d)) for slot, d in zip(slots[order], distance[order])]
+
+    def stale(self, max_age: float, now: Optional[float] = None) -> List[str]:
+        """IDs of users whose location has not been updated in the last max_age seconds."""
+        now = time.time() if now is None else now
+        slots = np.flatnonzero(self.active & (self.updated < now - max_age))
+        return [self.user_ids[slot] for slot in slots]
@@ -1,76 +1,214 @@
+import asyncio
 import logging
-from typing import Dict, List
+from time import perf_counter
+from typing import TYPE_CHECKING, Callable, Dict, List, Mapping, Optional, Sequence, Tuple, Union
 
 import attr
 from tornado import websocket
 
 import parking.shared.ws_models as models
+from parking.backend.log_config import log_event
+from parking.backend.metrics import WS_MESSAGE_ERRORS, WS_MESSAGE_SECONDS, WS_MESSAGES_LIMITED
+from parking.backend.user_server.mailbox import LocationMailbox
+from parking.backend.user_server.rate_limit import RateLimit, RateLimiter
+from parking.backend.user_server.session_store import SessionStore
+from parking.shared import ws_codec
 from parking.shared.location import Location
 
+if TYPE_CHECKING:
+    from parking.backend.engine.allocator import AllocationEngine  # noqa: F401
+    from parking.backend.user_server.directory import SessionDirectory  # noqa: F401
+
 logger = logging.getLogger('backend')
 
+# Histogram children looked up once, so that timing a message costs a dict lookup and an observe.
+MESSAGE_SECONDS = {t: WS_MESSAGE_SECONDS.labels(t.name.lower()) for t in models.WebSocketMessageType}
+MESSAGES_LIMITED = {t: WS_MESSAGES_LIMITED.labels(t.name.lower()) for t in models.WebSocketMessageType}
+
 
 class UserWSHandler(websocket.WebSocketHandler):
-    """The WebSocket handler. Handles user ws connections."""
+    """The WebSocket handler. Handles user ws connections.
+
+    With `rate_limits`, each connection gets a token bucket per message type,
+    checked against the _type peeked from the raw message before it is decoded.
+    Location updates over the limit are dropped, since a newer one will follow;
+    any other message over its limit closes the connection, so that requests
+    and answers to offers are never silently lost. With a `mailbox`, location
+    updates are left there and applied on its next tick.
+    """
     def check_origin(self, origin) -> bool:
         return True
 
-    def initialize(self, user_sessions: 'UserSessions') -> None:
+    def initialize(self, user_sessions: 'UserSessions', engine: Optional['AllocationEngine'] = None,
+                   directory: Optional['SessionDirectory'] = None, mailbox: Optional[LocationMailbox] = None,
+                   rate_limits: Optional[Mapping[int, RateLimit]] = None) -> None:
         self.usessions = user_sessions
-
-    def open(self, user_id: str) -> None:
+        self.engine = engine
+        self.directory = directory
+        self.mailbox = mailbox
+        self.rate_limits = rate_limits
+        self.limiter: Optional[RateLimiter] = None
+        self.binary = False
+
+    def select_subprotocol(self, subprotocols: Sequence[str]) -> Optional[str]:
+        """Use the binary wire format if the client offers it, falling back to JSON."""
+        if ws_codec.BINARY_SUBPROTOCOL in subprotocols:
+            self.binary = True
+            return ws_codec.BINARY_SUBPROTOCOL
+        if ws_codec.JSON_SUBPROTOCOL in subprotocols:
+            return ws_codec.JSON_SUBPROTOCOL
+        return None
+
+    async def open(self, user_id: str) -> None:
         self.user_id = user_id
-        logger.info("WebSocket opened for user_id = '{}'".format(self.user_id))
+        logger.info("WebSocket opened for user_id = '%s'", self.user_id)
+        if self.rate_limits is not None:
+            self.limiter = RateLimiter(self.rate_limits, perf_counter())
         self.usessions.add_user(user_id, self)
-
-    def on_message(self, message: str) -> None:
-        logger.debug("Received message from user_id = '{}' : '{}'".format(self.user_id, message))
-        msg = models.deserialize_ws_message(message)
-
+        if self.directory is not None:
+            await self.directory.register(user_id)
+
+    def send_message(self, msg) -> None:
+        """Send a message model in the wire format negotiated for this connection."""
+        self.write_message(ws_codec.encode(msg, self.binary), binary=self.binary)
+
+    def send_payload(self, payload: ws_codec.Payload) -> None:
+        """Send a message already serialized in both wire formats."""
+        text, data = payload
+        self.write_message(data if self.binary else text, binary=self.binary)
+
+    def on_message(self, message: Union[str, bytes]) -> None:
+        start = perf_counter()
+        peeked = None
+        if self.limiter is not None:
+            peeked = ws_codec.peek_type(message)
+            if peeked is not None and not self.limiter.allow(peeked, start):
+                self.limited(peeked)
+                return
+        try:
+            msg = ws_codec.decode(message)
+        except (ValueError, TypeError):
+            WS_MESSAGE_ERRORS.inc()
+            logger.warning("Invalid message from user_id = '%s': %r", self.user_id, message[:200])
+            raise
+        # The peeked _type is only a hint; a message that was not charged to its own bucket is now.
+        if self.limiter is not None and msg._type != peeked and not self.limiter.allow(msg._type, start):
+            self.limited(msg._type)
+            return
+        self.handle_message(msg)
+        MESSAGE_SECONDS[msg._type].observe(perf_counter() - start)
+
+    def limited(self, _type: int) -> None:
+        """Deal with a message over its rate limit."""
+        MESSAGES_LIMITED[_type].inc()
+        if _type == models.WebSocketMessageType.LOCATION_UPDATE:
+            return
+        logger.warning("Closing connection of user_id = '%s', over the rate limit for %s",
+                       self.user_id, models.WebSocketMessageType(_type).name)
+        self.close(1008, 'Rate limit exceeded')
+
+    def handle_message(self, msg) -> None:
         if isinstance(msg, models.LocationUpdateMessage):
-            logger.debug("Received location update from user_id = '{}'".format(self.user_id))
-            self.usessions.update_user_location(self.user_id, msg.location)
+            log_event(logger, logging.DEBUG, 'location_update', "Received location update from user_id = '%s'",
+                      self.user_id)
+            if self.mailbox is not None:
+                self.mailbox.put(self.user_id, msg.location)
+            else:
+                self.usessions.update_user_location(self.user_id, msg.location)
         elif isinstance(msg, models.ParkingRequestMessage):
-            logger.debug("Received parking request from user_id = '{}'".format(self.user_id))
+            log_event(logger, logging.DEBUG, 'parking_request', "Received parking request from user_id = '%s'",
+                      self.user_id)
+            if self.engine is not None:
+                self.engine.submit(self.user_id, msg)
         elif isinstance(msg, models.ParkingAcceptanceMessage):
-            logger.debug("Received parking acceptance from user_id = '{}'".format(self.user_id))
+            log_event(logger, logging.DEBUG, 'parking_acceptance', "Received parking acceptance from user_id = '%s'",
+                      self.user_id)
+            if self.engine is not None:
+                self.engine.accept(self.user_id, msg.id)
         elif isinstance(msg, models.ParkingRejectionMessage):
-            logger.debug("Received parking rejection from user_id = '{}'".format(self.user_id))
+            log_event(logger, logging.DEBUG, 'parking_rejection', "Received parking rejection from user_id = '%s'",
+                      self.user_id)
             self.usessions.add_user_rejection(self.user_id, msg.id)
+            if self.engine is not None:
+                self.engine.reject(self.user_id, msg.id)
         elif isinstance(msg, models.ParkingCancellationMessage):
-            logger.info("Parking cancelled for user_id = '{}'".format(self.user_id))
+            log_event(logger, logging.INFO, 'parking_cancel', "Parking cancelled for user_id = '%s'", self.user_id)
             self.close()
 
     def on_close(self) -> None:
-        self.usessions.remove_user(self.user_id)
-        logger.info("WebSocket closed for user_id = {}".format(self.user_id))
+        # The user may have reconnected already, in which case the new session stays.
+        user = self.usessions.users.get(self.user_id)
+        if user is not None and user.session is self:
+            self.usessions.remove_user(self.user_id)
+            if self.directory is not None:
+                asyncio.ensure_future(self.directory.unregister(self.user_id))
+        logger.info("WebSocket closed for user_id = '%s'", self.user_id)
 
 
-@attr.s
+@attr.s(slots=True)
 class User(object):
-    """Object to represent a connected user."""
+    """Object to represent a connected user.
+
+    The location lives in the SessionStore, in the user's slot.
+    """
     user_id: str = attr.ib()
     session: UserWSHandler = attr.ib()
-    location: Location = attr.ib(default=None)
+    store: SessionStore = attr.ib(repr=False)
+    slot: int = attr.ib()
     rejections: List[int] = attr.ib(default=attr.Factory(list), init=False)
 
+    @property
+    def location(self) -> Optional[Location]:
+        return self.store.get_location(self.slot)
+
+    @location.setter
+    def location(self, location: Optional[Location]) -> None:
+        self.store.set_location(self.slot, location)
+
 
 class UserSessions(object):
-    """Class to hold references to open ws connections"""
-    def __init__(self) -> None:
+    """Class to hold references to open ws connections
+
+    When running several worker processes, `relay` is called with every message
+    for a user who is not connected here, so that it can be passed on to the
+    worker holding their connection.
+    """
+    def __init__(self, store: Optional[SessionStore] = None) -> None:
         self.users: Dict[str, User] = {}
+        self.store = SessionStore() if store is None else store
+        self.relay: Optional[Callable[[str, object], None]] = None
 
     def add_user(self, user_id: str, session: UserWSHandler) -> None:
-        self.users[user_id] = User(user_id, session)
+        old = self.users.get(user_id)
+        if old is not None:
+            self.store.release(old.slot)
+        self.users[user_id] = User(user_id, session, self.store, self.store.allocate(user_id))
 
     def remove_user(self, user_id: str) -> User:
-        return self.users.pop(user_id)
+        user = self.users.pop(user_id)
+        self.store.release(user.slot)
+        return user
 
     def get_user(self, user_id: str) -> User:
         return self.users[user_id]
 
+    def send_message(self, user_id: str, msg) -> bool:
+        """Send msg to user_id here, or pass it to `relay`. Returns False if neither was possible."""
+        user = self.users.get(user_id)
+        if user is not None:
+            user.session.send_message(msg)
+            return True
+        if self.relay is not None:
+            self.relay(user_id, msg)
+            return True
+        return False
+
     def update_user_location(self, user_id: str, location: Location) -> None:
-        self.get_user(user_id).location = location
+        self.store.set_location(self.users[user_id].slot, location)
 
     def add_user_rejection(self, user_id: str, parking_id: int) -> None:
         self.get_user(user_id).rejections.append(parking_id)
+
+    def users_within(self, location: Location, radius: float) -> List[Tuple[str, float]]:
+        """(user ID, distance in metres) of every user within radius of location, nearest first."""
+        return self.store.within(location, radius)
@@ -1,7 +1,20 @@
+from math import asin, cos, radians, sin, sqrt
+
 import attr
 
+# Mean earth radius in metres.
+EARTH_RADIUS = 6371008.8
+
 
-@attr.s
+@attr.s(slots=True)
 class Location:
     latitude: float = attr.ib(validator=attr.validators.instance_of(float))
     longitude: float = attr.ib(validator=attr.validators.instance_of(float))
+
+
+def haversine(lat1: float, long1: float, lat2: float, long2: float) -> float:
+    '''Great-circle distance in metres between two points given in degrees.'''
+    dlat = radians(lat2 - lat1)
+    dlong = radians(long2 - long1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlong / 2) ** 2
+    return 2 * EARTH_RADIUS * asin(min(1.0, sqrt(a)))
@@ -0,0 +1,144 @@
+from typing import Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from parking.shared.location import EARTH_RADIUS, Location
+
+METRES_PER_DEGREE = np.pi * EARTH_RADIUS / 180.0
+
+
+def haversine_distance(lat1, long1, lat2, long2) -> np.ndarray:
+    '''Great-circle distances in metres between points given in degrees, broadcast like any numpy operation.'''
+    lat1, long1, lat2, long2 = np.radians(lat1), np.radians(long1), np.radians(lat2), np.radians(long2)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((long2 - long1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def equirectangular_distance(lat1, long1, lat2, long2) -> np.ndarray:
+    '''Approximate distances in metres, treating the earth as flat around each pair of points.
+
+    Within a few tens of kilometres this is within a fraction of a percent of
+    haversine_distance.
+    '''
+    lat1, long1, lat2, long2 = np.radians(lat1), np.radians(long1), np.radians(lat2), np.radians(long2)
+    dlong = (long2 - long1 + np.pi) % (2 * np.pi) - np.pi
+    x = dlong * np.cos((lat1 + lat2) / 2)
+    return EARTH_RADIUS * np.hypot(x, lat2 - lat1)
+
+
+def initial_bearing(lat1, long1, lat2, long2) -> np.ndarray:
+    '''Bearing in degrees clockwise from north, in [0, 360), to set off on from the first point to the second.'''
+    lat1, long1, lat2, long2 = np.radians(lat1), np.radians(long1), np.radians(lat2), np.radians(long2)
+    dlong = long2 - long1
+    y = np.sin(dlong) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlong)
+    return np.degrees(np.arctan2(y, x)) % 360.0
+
+
+def haversine_matrix(lat1: np.ndarray, long1: np.ndarray, lat2: np.ndarray, long2: np.ndarray) -> np.ndarray:
+    '''Pairwise great-circle distances in metres, shaped (len(lat1), len(lat2)).'''
+    return haversine_distance(np.asarray(lat1)[:, None], np.asarray(long1)[:, None],
+                              np.asarray(lat2)[None, :], np.asarray(long2)[None, :])
+
+
+def bounding_box(location: Location, radius: float) -> Tuple[float, float, float, float]:
+    '''(south, west, north, east) in degrees of a box holding every point within radius metres of location.
+
+    West is greater than east when the box crosses the antimeridian. Near the
+    poles the box spans every longitude.
+    '''
+    dlat = radius / METRES_PER_DEGREE
+    south, north = max(location.latitude - dlat, -90.0), min(location.latitude + dlat, 90.0)
+    cos_lat = min(np.cos(np.radians(south)), np.cos(np.radians(north)))
+    if cos_lat <= 0 or radius / (METRES_PER_DEGREE * cos_lat) >= 180.0:
+        return south, -180.0, north, 180.0
+    dlong = radius / (METRES_PER_DEGREE * cos_lat)
+    west = (location.longitude - dlong + 180.0) % 360.0 - 180.0
+    east = (location.longitude + dlong + 180.0) % 360.0 - 180.0
+    return south, west, north, east
+
+
+LocationLike = Union[Location, 'LocationArray']
+
+
+class LocationArray(object):
+    """Many locations, as contiguous float64 arrays of latitude and longitude in degrees.
+
+    The batch counterpart of Location: distances, bearings and box filters are
+    computed for every location at once. Measured against a single Location the
+    result has one value per location; against another LocationArray of the
+    same length it is elementwise, and the `*_matrix` methods give every pair.
+    """
+    __slots__ = ('latitude', 'longitude')
+
+    def __init__(self, latitude, longitude) -> None:
+        self.latitude = np.ascontiguousarray(latitude, dtype=np.float64)
+        self.longitude = np.ascontiguousarray(longitude, dtype=np.float64)
+        if self.latitude.ndim != 1 or self.latitude.shape != self.longitude.shape:
+            raise ValueError('latitude and longitude must be one-dimensional and of equal length')
+
+    @classmethod
+    def from_locations(cls, locations: Iterable[Location]) -> 'LocationArray':
+        locations = list(locations)
+        return cls(np.fromiter((loc.latitude for loc in locations), np.float64, len(locations)),
+                   np.fromiter((loc.longitude for loc in locations), np.float64, len(locations)))
+
+    def to_locations(self) -> List[Location]:
+        return [Location(lat, long) for lat, long in zip(self.latitude.tolist(), self.longitude.tolist())]
+
+    def __len__(self) -> int:
+        return len(self.latitude)
+
+    def __iter__(self) -> Iterator[Location]:
+        return iter(self.to_locations())
+
+    def __getitem__(self, index) -> Union[Location, 'LocationArray']:
+        """A Location for an integer index, otherwise a LocationArray of the selection, e.g. a mask."""
+        if isinstance(index, (int, np.integer)):
+            return Location(float(self.latitude[index]), float(self.longitude[index]))
+        return LocationArray(self.latitude[index], self.longitude[index])
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, LocationArray):
+            return NotImplemented
+        return np.array_equal(self.latitude, other.latitude) and np.array_equal(self.longitude, other.longitude)
+
+    def __repr__(self) -> str:
+        return 'LocationArray({} locations)'.format(len(self))
+
+    def haversine(self, other: LocationLike) -> np.ndarray:
+        return haversine_distance(self.latitude, self.longitude, other.latitude, other.longitude)
+
+    def equirectangular(self, other: LocationLike) -> np.ndarray:
+        return equirectangular_distance(self.latitude, self.longitude, other.latitude, other.longitude)
+
+    def bearing(self, other: LocationLike) -> np.ndarray:
+        """Initial bearing from each location to other."""
+        return initial_bearing(self.latitude, self.longitude, other.latitude, other.longitude)
+
+    def haversine_matrix(self, other: 'LocationArray') -> np.ndarray:
+        """Distances from every location to every location of other, shaped (len(self), len(other))."""
+        return haversine_matrix(self.latitude, self.longitude, other.latitude, other.longitude)
+
+    def equirectangular_matrix(self, other: 'LocationArray') -> np.ndarray:
+        return equirectangular_distance(self.latitude[:, None], self.longitude[:, None],
+                                        other.latitude[None, :], other.longitude[None, :])
+
+    def within_box(self, south: float, west: float, north: float, east: float) -> np.ndarray:
+        """Mask of the locations inside the box. West greater than east means the box crosses the antimeridian."""
+        inside = (self.latitude >= south) & (self.latitude <= north)
+        if west <= east:
+            return inside & (self.longitude >= west) & (self.longitude <= east)
+        return inside & ((self.longitude >= west) | (self.longitude <= east))
+
+    def within(self, location: Location, radius: float) -> np.ndarray:
+        """Mask of the locations within radius metres of location.
+
+        The bounding box rules out most locations before any trigonometry, and NaN
+        coordinates are never within.
+        """
+        mask = self.within_box(*bounding_box(location, radius))
+        candidates = np.flatnonzero(mask)
+        mask[candidates] = haversine_distance(self.latitude[candidates], self.longitude[candidates],
+                                              location.latitude, location.longitude) <= radius
+        return mask
@@ -1,9 +1,11 @@
+from typing import List
+
 import attr
 from parking.shared.location import Location
-from parking.shared.util import ensure, validate_non_neg, validate_pos
+from parking.shared.util import ensure, ensure_list, validate_non_neg, validate_pos
 
 
-@attr.s
+@attr.s(slots=True)
 class ParkingLot:
     capacity: int = attr.ib(validator=[attr.validators.instance_of(int), validate_pos])
     name: str = attr.ib(validator=attr.validators.instance_of(str))
@@ -12,16 +14,57 @@ class ParkingLot:
     id: int = attr.ib(validator=attr.validators.instance_of(int), default=0)
 
 
-@attr.s
+@attr.s(slots=True)
 class ParkingLotCreationResponse:
     id: int = attr.ib(validator=[attr.validators.instance_of(int), validate_non_neg], default=0)
 
 
-@attr.s
+@attr.s(slots=True)
 class ParkingLotAvailableMessage:
     available: int = attr.ib(validator=[attr.validators.instance_of(int), validate_non_neg])
 
 
-@attr.s
+@attr.s(slots=True)
 class ParkingLotPriceMessage:
     price: float = attr.ib(validator=[attr.validators.instance_of(float), validate_non_neg])
+
+
+@attr.s(slots=True)
+class ParkingLotAvailableUpdate:
+    id: int = attr.ib(validator=[attr.validators.instance_of(int), validate_non_neg])
+    available: int = attr.ib(validator=[attr.validators.instance_of(int), validate_non_neg])
+
+
+@attr.s(slots=True)
+class ParkingLotPriceUpdate:
+    id: int = attr.ib(validator=[attr.validators.instance_of(int), validate_non_neg])
+    price: float = attr.ib(validator=[attr.validators.instance_of(float), validate_non_neg])
+
+
+@attr.s(slots=True)
+class ParkingLotBulkUpdateMessage:
+    available: List[ParkingLotAvailableUpdate] = attr.ib(converter=ensure_list(ParkingLotAvailableUpdate),
+                                                         factory=list)
+    price: List[ParkingLotPriceUpdate] = attr.ib(converter=ensure_list(ParkingLotPriceUpdate), factory=list)
+
+
+@attr.s(slots=True)
+class ParkingLotBulkUpdateResponse:
+    updated: List[int] = attr.ib(factory=list)
+    unknown: List[int] = attr.ib(factory=list)
+
+
+@attr.s(slots=True)
+class ParkingLotStatus:
+    id: int = attr.ib(validator=[attr.validators.instance_of(int), validate_non_neg])
+    name: str = attr.ib(validator=attr.validators.instance_of(str))
+    capacity: int = attr.ib(validator=[attr.validators.instance_of(int), validate_pos])
+    price: float = attr.ib(validator=[attr.validators.instance_of(float), validate_non_neg])
+    location: Location = attr.ib(converter=ensure(Location), validator=attr.validators.instance_of(Location))
+    num_available: int = attr.ib(validator=attr.validators.instance_of(int))
+    num_allocated: int = attr.ib(validator=attr.validators.instance_of(int))
+
+
+@attr.s(slots=True)
+class ParkingLotSearchResponse:
+    lots: List[ParkingLotStatus] = attr.ib(converter=ensure_list(ParkingLotStatus), factory=list)
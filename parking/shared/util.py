@@ -1,5 +1,6 @@
+import functools
 import json
-from typing import Union
+from typing import Any, Callable, Dict, List, Optional, Union
 import attr
 
 
@@ -19,9 +20,102 @@ def ensure(t):
     return check
 
 
+def ensure_list(t):
+    '''Returns a function that ensures a list of t, converting each item as `ensure(t)` does'''
+    check = ensure(t)
+
+    def check_list(lst):
+        if not isinstance(lst, list):
+            raise TypeError('Expected list of {}'.format(t))
+        return [check(item) for item in lst]
+    return check_list
+
+
+def _compile(name: str, source: str, namespace: Dict[str, Any]) -> Callable:
+    exec(compile(source, '<{}>'.format(name), 'exec'), namespace)
+    return namespace[name]
+
+
+def _nested(t) -> bool:
+    '''Whether a field of type t holds a list of attrs objects'''
+    # Python 3.6 gives typing.List as the origin of List[X], later versions list.
+    return getattr(t, '__origin__', None) in (list, List) and attr.has(t.__args__[0])
+
+
+def _optional(t) -> Optional[type]:
+    '''The attrs class X if a field of type t holds an Optional[X], else None'''
+    args = getattr(t, '__args__', None) or ()
+    if getattr(t, '__origin__', None) is not Union or len(args) != 2 or type(None) not in args:
+        return None
+    inner = args[0] if args[1] is type(None) else args[1]
+    return inner if attr.has(inner) else None
+
+
+@functools.lru_cache(maxsize=None)
+def trusted(cls: type) -> Callable[..., Any]:
+    '''Returns a function that builds cls from values that are already valid, without converters or validators.
+
+    For data that has been validated once already, such as lots read back from
+    the database or messages built by the engine from them. It takes the same
+    arguments as cls, with the same defaults, and is compiled once per class.
+    '''
+    namespace: Dict[str, Any] = {'_new': object.__new__, '_setattr': object.__setattr__, '_cls': cls,
+                                 '_NOTHING': attr.NOTHING}
+    # Frozen classes refuse plain assignment, so go around their __setattr__.
+    assign = '_setattr(self, {0!r}, {1})' if cls.__setattr__ is not object.__setattr__ else 'self.{0} = {1}'
+    args: List[str] = []
+    body: List[str] = []
+    for a in attr.fields(cls):
+        arg = a.name.lstrip('_')
+        if isinstance(a.default, attr.Factory):
+            namespace['_factory_' + a.name] = a.default.factory
+            value = '_factory_{}()'.format(a.name)
+        else:
+            namespace['_default_' + a.name] = a.default
+            value = '_default_' + a.name
+        if not a.init:
+            body.append(assign.format(a.name, value))
+            continue
+        if a.default is attr.NOTHING:
+            args.append(arg)
+        elif isinstance(a.default, attr.Factory):
+            args.append(arg + '=_NOTHING')
+            body.append('if {0} is _NOTHING: {0} = {1}'.format(arg, value))
+        else:
+            args.append('{}={}'.format(arg, value))
+        body.append(assign.format(a.name, arg))
+    source = 'def build({}):\n    self = _new(_cls)\n{}    return self\n'.format(
+        ', '.join(args), ''.join('    {}\n'.format(line) for line in body))
+    return _compile('build', source, namespace)
+
+
+@functools.lru_cache(maxsize=None)
+def serializer(cls: type) -> Callable[[Any], dict]:
+    '''Returns a function equivalent to attr.asdict for instances of cls, compiled once per class.
+
+    Fields typed as attrs classes, optional ones or lists of them, are converted
+    by their own serializers; any other value is passed through as it is.
+    '''
+    namespace: Dict[str, Any] = {}
+    items = []
+    for a in attr.fields(cls):
+        value = 'm.' + a.name
+        if attr.has(a.type):
+            namespace['_' + a.name] = serializer(a.type)
+            value = '_{}({})'.format(a.name, value)
+        elif _nested(a.type):
+            namespace['_' + a.name] = serializer(a.type.__args__[0])
+            value = '[_{}(v) for v in {}]'.format(a.name, value)
+        elif _optional(a.type) is not None:
+            namespace['_' + a.name] = serializer(_optional(a.type))
+            value = 'None if {1} is None else _{0}({1})'.format(a.name, value)
+        items.append('{!r}: {}'.format(a.name, value))
+    return _compile('to_dict', 'def to_dict(m):\n    return {{{}}}\n'.format(', '.join(items)), namespace)
+
+
 def serialize_model(model: object) -> str:
     '''Handy function to dump an attr object to a JSON encoded string'''
-    return json.dumps(attr.asdict(model))
+    return json.dumps(serializer(model.__class__)(model))
 
 
 def validate_pos(cls, attribute, value: Union[int, float]) -> None:
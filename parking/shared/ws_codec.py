@@ -0,0 +1,151 @@
+import json
+import re
+import struct
+from typing import Optional, Tuple, Union
+
+from parking.shared.location import Location
+from parking.shared.rest_models import ParkingLot
+from parking.shared.util import serialize_model
+import parking.shared.ws_models as models
+from parking.shared.ws_models import WebSocketMessageType as MessageType
+
+# WebSocket subprotocols a client may ask for. Without either, JSON is used.
+BINARY_SUBPROTOCOL = 'parking.binary.v1'
+JSON_SUBPROTOCOL = 'parking.json'
+
+# Every binary message starts with its WebSocketMessageType as one byte, followed
+# by a fixed little-endian layout. Variable-length fields (names, preferences and
+# errors) follow the fixed part, with free-form dicts stored as UTF-8 JSON.
+LOCATION = struct.Struct('<Bdd')
+ALLOCATION = struct.Struct('<BIdddiH')
+ID = struct.Struct('<BI')
+CANCEL = struct.Struct('<BIi')
+LOT_UPDATE = struct.Struct('<BIId')
+# The lot of an ALLOCATION, without the leading _type byte.
+ALLOCATION_LOT = struct.Struct('<IdddiH')
+# Stands in for the lot of an allocation that has none, only an error.
+NO_LOT = ALLOCATION_LOT.pack(0, 0.0, 0.0, 0.0, -1, 0)
+
+# A message serialized once in each wire format: (JSON text, binary).
+Payload = Tuple[str, bytes]
+
+TYPE_FIELD = re.compile(r'"_type"\s*:\s*(\d+)')
+
+
+def _dump_dict(d: dict) -> bytes:
+    return json.dumps(d).encode() if d else b''
+
+
+def _load_dict(data: bytes) -> dict:
+    if not data:
+        return {}
+    d = json.loads(data.decode())
+    if not isinstance(d, dict):
+        raise ValueError('Expected a JSON object')
+    return d
+
+
+def encode_binary(msg) -> bytes:
+    '''Encode a WebSocket message in the compact binary format.
+
+    Raises ValueError for a value the format cannot hold, such as an ID or count
+    beyond 32 bits or a lot name longer than 65535 bytes.
+    '''
+    _type = msg._type
+    try:
+        if _type == MessageType.LOCATION_UPDATE:
+            return LOCATION.pack(_type, msg.location.latitude, msg.location.longitude)
+        elif _type == MessageType.PARKING_REQUEST:
+            return LOCATION.pack(_type, msg.location.latitude, msg.location.longitude) + _dump_dict(msg.preferences)
+        elif _type == MessageType.PARKING_ALLOCATION:
+            return bytes((_type,)) + (NO_LOT if msg.lot is None else encode_lot(msg.lot)) + _dump_dict(msg.error)
+        elif _type == MessageType.PARKING_CANCEL:
+            return CANCEL.pack(_type, msg.id, msg.reason)
+        elif _type == MessageType.LOT_UPDATE:
+            return LOT_UPDATE.pack(_type, msg.id, msg.available, msg.price)
+        elif _type in models.message_types:
+            return ID.pack(_type, msg.id)
+    except struct.error as e:
+        raise ValueError('Cannot encode message of _type {} in binary: {}'.format(_type, e))
+    raise ValueError('Invalid _type: {}'.format(_type))
+
+
+def encode_lot(lot: ParkingLot) -> bytes:
+    '''The binary form of a lot within a ParkingAllocationMessage.'''
+    name = lot.name.encode()
+    try:
+        return (ALLOCATION_LOT.pack(lot.capacity, lot.price, lot.location.latitude, lot.location.longitude, lot.id,
+                                    len(name))
+                + name)
+    except struct.error as e:
+        raise ValueError('Cannot encode lot {} in binary: {}'.format(lot.id, e))
+
+
+def allocation_payload(lot_text: str, lot_data: bytes, error: Optional[dict] = None) -> Payload:
+    '''A ParkingAllocationMessage in both wire formats, spliced together from its lot already serialized.
+
+    lot_text is the lot as serialize_model gives it and lot_data as encode_lot
+    gives it; the result is the same as serializing the whole message.
+    '''
+    text = '{{"lot": {}, "error": {}, "_type": {}}}'.format(
+        lot_text, json.dumps(error or {}), MessageType.PARKING_ALLOCATION.value)
+    return text, bytes((MessageType.PARKING_ALLOCATION,)) + lot_data + _dump_dict(error or {})
+
+
+def decode_binary(data: bytes):
+    '''Decode a message produced by `encode_binary`.'''
+    if not data:
+        raise ValueError('Missing _type')
+    _type = data[0]
+    try:
+        if _type == MessageType.LOCATION_UPDATE:
+            _, latitude, longitude = LOCATION.unpack(data)
+            return models.LocationUpdateMessage(Location(latitude, longitude))
+        elif _type == MessageType.PARKING_REQUEST:
+            _, latitude, longitude = LOCATION.unpack_from(data)
+            return models.ParkingRequestMessage(Location(latitude, longitude), _load_dict(data[LOCATION.size:]))
+        elif _type == MessageType.PARKING_ALLOCATION:
+            _, capacity, price, latitude, longitude, lot_id, name_length = ALLOCATION.unpack_from(data)
+            end = ALLOCATION.size + name_length
+            if len(data) < end:
+                raise ValueError('Truncated lot name')
+            lot = None
+            if lot_id != -1:
+                lot = ParkingLot(capacity, data[ALLOCATION.size:end].decode(), price, Location(latitude, longitude),
+                                 lot_id)
+            return models.ParkingAllocationMessage(lot, _load_dict(data[end:]))
+        elif _type == MessageType.PARKING_CANCEL:
+            _, lot_id, reason = CANCEL.unpack(data)
+            return models.ParkingCancellationMessage(lot_id, reason)
+        elif _type == MessageType.LOT_UPDATE:
+            _, lot_id, available, price = LOT_UPDATE.unpack(data)
+            return models.ParkingLotUpdateMessage(lot_id, available, price)
+        elif _type in models.message_types:
+            _, lot_id = ID.unpack(data)
+            return models.message_types[_type](lot_id)
+    except struct.error as e:
+        raise ValueError('Malformed message of _type {}: {}'.format(_type, e))
+    raise ValueError('Invalid _type: {}'.format(_type))
+
+
+def peek_type(data: Union[str, bytes]) -> Optional[int]:
+    '''The _type of a message in either wire format, found without decoding the rest of it.
+
+    Only a hint, e.g. for deciding whether a message is worth decoding: None if
+    no _type is found, and the decoded message may still turn out invalid.
+    '''
+    if isinstance(data, bytes):
+        return data[0] if data else None
+    match = TYPE_FIELD.search(data)
+    return int(match.group(1)) if match else None
+
+
+def encode(msg, binary: bool) -> Union[str, bytes]:
+    return encode_binary(msg) if binary else serialize_model(msg)
+
+
+def decode(data: Union[str, bytes]):
+    '''Decode a message from either wire format; binary frames arrive as bytes.'''
+    if isinstance(data, bytes):
+        return decode_binary(data)
+    return models.deserialize_ws_message(data)
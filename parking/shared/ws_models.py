@@ -1,5 +1,6 @@
 import json
 from enum import IntEnum
+from typing import Optional
 import attr
 from parking.shared.location import Location
 from parking.shared.util import ensure, validate_non_neg
@@ -14,28 +15,35 @@ class WebSocketMessageType(IntEnum):
     PARKING_REJECTION = 5
     PARKING_DEALLOC = 6
     PARKING_CANCEL = 7
+    LOT_UPDATE = 8
 
 
 def deserialize_ws_message(data: str):
-    json_data = json.loads(data)
+    return load_ws_message(json.loads(data))
+
+
+def load_ws_message(json_data: dict):
+    """Build a message from its decoded JSON form, as produced by attr.asdict."""
     if '_type' not in json_data:
         raise ValueError('Missing _type')
 
     _type = json_data.pop('_type')
 
-    if _type not in [e.value for e in WebSocketMessageType]:
+    # JSON true and false load as bools, which are ints too.
+    message_type = message_types.get(_type) if isinstance(_type, int) and not isinstance(_type, bool) else None
+    if message_type is None:
         raise ValueError('Invalid _type: {}'.format(_type))
 
-    return message_types[_type](**json_data)
+    return message_type(**json_data)
 
 
-@attr.s
+@attr.s(slots=True)
 class LocationUpdateMessage:
     location: Location = attr.ib(converter=ensure(Location), validator=attr.validators.instance_of(Location))
     _type: int = attr.ib(default=WebSocketMessageType.LOCATION_UPDATE.value, init=False)
 
 
-@attr.s
+@attr.s(slots=True)
 class ParkingRequestMessage:
     location: Location = attr.ib(converter=ensure(Location), validator=attr.validators.instance_of(Location))
     # TODO: Maybe make a preferences class so that we can validate the content
@@ -44,33 +52,35 @@ class ParkingRequestMessage:
     _type: int = attr.ib(default=WebSocketMessageType.PARKING_REQUEST.value, init=False)
 
 
-@attr.s
+@attr.s(slots=True)
 class ParkingAllocationMessage:
     # TODO: Maybe have an error class to validate the error.
-    lot: ParkingLot = attr.ib(converter=ensure(ParkingLot), validator=attr.validators.instance_of(ParkingLot))
+    # No lot when none could be allocated, and error says why.
+    lot: Optional[ParkingLot] = attr.ib(converter=attr.converters.optional(ensure(ParkingLot)),
+                                        validator=attr.validators.optional(attr.validators.instance_of(ParkingLot)))
     error: dict = attr.ib(validator=attr.validators.instance_of(dict), factory=dict)
     _type: int = attr.ib(default=WebSocketMessageType.PARKING_ALLOCATION.value, init=False)
 
 
-@attr.s
+@attr.s(slots=True)
 class ParkingAcceptanceMessage:
     id: int = attr.ib(validator=[attr.validators.instance_of(int), validate_non_neg])
     _type: int = attr.ib(default=WebSocketMessageType.PARKING_ACCEPTANCE.value, init=False)
 
 
-@attr.s
+@attr.s(slots=True)
 class ParkingRejectionMessage:
     id: int = attr.ib(validator=[attr.validators.instance_of(int), validate_non_neg])
     _type: int = attr.ib(default=WebSocketMessageType.PARKING_REJECTION.value, init=False)
 
 
-@attr.s
+@attr.s(slots=True)
 class ParkingDeallocationMessage:
     id: int = attr.ib(validator=[attr.validators.instance_of(int), validate_non_neg])
     _type: int = attr.ib(default=WebSocketMessageType.PARKING_DEALLOC.value, init=False)
 
 
-@attr.s
+@attr.s(slots=True)
 class ParkingCancellationMessage:
     # TODO: Add a reason enum somewhere, with 0 being REASON_UNKNOWN or similar.
     id: int = attr.ib(validator=[attr.validators.instance_of(int), validate_non_neg])
@@ -78,6 +88,14 @@ class ParkingCancellationMessage:
     _type: int = attr.ib(default=WebSocketMessageType.PARKING_CANCEL.value, init=False)
 
 
+@attr.s(slots=True)
+class ParkingLotUpdateMessage:
+    id: int = attr.ib(validator=[attr.validators.instance_of(int), validate_non_neg])
+    available: int = attr.ib(validator=[attr.validators.instance_of(int), validate_non_neg])
+    price: float = attr.ib(validator=[attr.validators.instance_of(float), validate_non_neg])
+    _type: int = attr.ib(default=WebSocketMessageType.LOT_UPDATE.value, init=False)
+
+
 message_types = {
     WebSocketMessageType.LOCATION_UPDATE: LocationUpdateMessage,
     WebSocketMessageType.PARKING_REQUEST: ParkingRequestMessage,
@@ -85,5 +103,6 @@ message_types = {
     WebSocketMessageType.PARKING_ACCEPTANCE: ParkingAcceptanceMessage,
     WebSocketMessageType.PARKING_REJECTION: ParkingRejectionMessage,
     WebSocketMessageType.PARKING_DEALLOC: ParkingDeallocationMessage,
-    WebSocketMessageType.PARKING_CANCEL: ParkingCancellationMessage
+    WebSocketMessageType.PARKING_CANCEL: ParkingCancellationMessage,
+    WebSocketMessageType.LOT_UPDATE: ParkingLotUpdateMessage
 }
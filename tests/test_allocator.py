@@ -0,0 +1,141 @@
+import json
+
+import numpy as np
+import pytest
+import testing.postgresql
+
+from parking.backend.db.dbaccess import DbAccess
+from parking.backend.db.lot_cache import LotEntry
+from parking.backend.db.occupancy import OccupancyHistory
+from parking.backend.engine.allocator import (ALLOCATION_FAILED, NO_LOT_AVAILABLE, AllocationEngine, PendingRequest,
+                                              solve_assignment)
+from parking.backend.engine.forecast import AvailabilityForecaster
+from parking.backend.engine.lot_index import LotIndex
+from parking.backend.user_server.payload_cache import LotPayloadCache
+from parking.backend.user_server.wsserver import UserSessions
+from parking.shared.location import Location
+from parking.shared.rest_models import ParkingLot
+from parking.shared.util import serialize_model
+from parking.shared.ws_models import ParkingRequestMessage, WebSocketMessageType
+
+Postgresql = testing.postgresql.PostgresqlFactory(cache_initialized_db=True)
+
+
+def teardown_module(module):
+    Postgresql.clear_cache()
+
+
+class RecordingSession:
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, msg):
+        self.messages.append(json.loads(serialize_model(msg)))
+
+    def send_payload(self, payload):
+        self.messages.append(json.loads(payload[0]))
+
+
+def test_solve_assignment_respects_capacity():
+    cost = np.array([[1.0, 5.0],
+                     [2.0, 3.0],
+                     [0.5, 9.0]])
+    assignment = solve_assignment(cost, np.array([1, 5]))
+    # Lot 0 has room for one user and goes to the cheapest proposal.
+    assert list(assignment) == [1, 1, 0]
+
+
+def test_solve_assignment_unassignable():
+    cost = np.array([[1.0, np.inf],
+                     [2.0, np.inf]])
+    assignment = solve_assignment(cost, np.array([1, 1]))
+    assert list(assignment) == [0, -1]
+
+
+def test_solve_assignment_full_lot():
+    assignment = solve_assignment(np.array([[1.0, 2.0]]), np.array([0, 1]))
+    assert list(assignment) == [1]
+
+
+def test_cost_matrix_masks_rejections():
+    sessions = UserSessions()
+    sessions.add_user('a', RecordingSession())
+    sessions.add_user_rejection('a', 1)
+    engine = AllocationEngine(None, LotIndex(), sessions)
+
+    lots = [LotEntry(1, 'a', 10, 0.0, 0.0, 1.0, 10, 0), LotEntry(2, 'b', 10, 0.0, 0.01, 1.0, 10, 0)]
+    cost = engine.build_cost_matrix([PendingRequest('a', Location(0.0, 0.0))], lots, [[1, 2]])
+    assert np.isinf(cost[0, 0])
+    assert np.isfinite(cost[0, 1])
+
+
+def test_cost_matrix_uses_forecast():
+    sessions = UserSessions()
+    sessions.add_user('a', RecordingSession())
+    history = OccupancyHistory()
+    for t in range(30):
+        history.record(1, 100 - 3 * t, timestamp=60.0 * t)
+        history.record(2, 40, timestamp=60.0 * t)
+    forecaster = AvailabilityForecaster(history)
+    forecaster.refresh(now=1800.0)
+
+    # Both lots have 10 of 40 slots allocated now, but lot 1 is filling up fast.
+    lots = [LotEntry(1, 'a', 100, 0.0, 0.05, 1.0, 40, 10), LotEntry(2, 'b', 40, 0.0, 0.05, 1.0, 40, 10)]
+    requests = [PendingRequest('a', Location(0.0, 0.0))]
+    without = AllocationEngine(None, LotIndex(), sessions).build_cost_matrix(requests, lots, [[1, 2]])
+    assert without[0, 0] == pytest.approx(without[0, 1])
+    cost = AllocationEngine(None, LotIndex(), sessions, forecaster=forecaster).build_cost_matrix(
+        requests, lots, [[1, 2]])
+    assert cost[0, 0] > cost[0, 1]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('cached', [False, True])
+async def test_run_round_allocates_and_notifies(event_loop, cached):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True)
+        index = LotIndex()
+        for name, location in (('near', Location(0.0, 0.0)), ('far', Location(0.0, 0.05))):
+            lot = ParkingLot(1, name, 1.0, location)
+            index.insert(await db.insert_parking_lot(lot), location)
+
+        sessions = UserSessions()
+        for user_id in ('a', 'b', 'c'):
+            sessions.add_user(user_id, RecordingSession())
+        payloads = LotPayloadCache() if cached else None
+        engine = AllocationEngine(db, index, sessions, payloads=payloads)
+        for user_id in ('a', 'b', 'c'):
+            engine.submit(user_id, ParkingRequestMessage(Location(0.0, 0.0)))
+
+        results = await engine.run_round()
+        assert sorted(lot_id for lot_id in results.values() if lot_id is not None) == [1, 2]
+        assert list(results.values()).count(None) == 1
+        assert engine.pending == {}
+
+        for user_id, lot_id in results.items():
+            messages = sessions.get_user(user_id).session.messages
+            if lot_id is None:
+                assert messages == [{'lot': None, 'error': {'reason': NO_LOT_AVAILABLE},
+                                     '_type': WebSocketMessageType.PARKING_ALLOCATION}]
+            else:
+                assert messages[0]['_type'] == WebSocketMessageType.PARKING_ALLOCATION
+                assert messages[0]['lot']['id'] == lot_id
+
+
+@pytest.mark.asyncio
+async def test_failed_round_refuses_everyone(event_loop):
+    class FailingDb:
+        async def get_parking_lots_by_id(self, lot_ids):
+            raise RuntimeError('database is down')
+
+    index = LotIndex()
+    index.insert(1, Location(0.0, 0.0))
+    sessions = UserSessions()
+    sessions.add_user('a', RecordingSession())
+    engine = AllocationEngine(FailingDb(), index, sessions)
+    engine.submit('a', ParkingRequestMessage(Location(0.0, 0.0)))
+
+    with pytest.raises(RuntimeError):
+        await engine.run_round()
+    assert sessions.get_user('a').session.messages == [
+        {'lot': None, 'error': {'reason': ALLOCATION_FAILED}, '_type': WebSocketMessageType.PARKING_ALLOCATION}]
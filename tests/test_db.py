@@ -1,11 +1,15 @@
+import asyncio
 from asyncio import AbstractEventLoop
 from typing import List
 
+import numpy as np
 import pytest
 import testing.postgresql
 from asyncpg import Record
 
+import parking.backend.db.sql_constants as c
 from parking.backend.db.dbaccess import DbAccess
+from parking.backend.db.pool import PoolConfig
 from parking.shared.location import Location
 from parking.shared.rest_models import ParkingLot
 
@@ -138,3 +142,344 @@ async def test_allocate_parking_lot_to_user_already_allocated_fail(event_loop):
 
         assert await db.allocate_parking_lot("test_user", 1) is True
         assert await db.allocate_parking_lot("test_user", 2) is False
+
+
+@pytest.mark.asyncio
+async def test_allocate_parking_lots_in_bulk(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True)
+
+        await db.insert_parking_lot(ParkingLot(2, 'test_name1', 0.0, Location(0.0, 1.0)))
+        await db.insert_parking_lot(ParkingLot(100, 'test_name2', 0.0, Location(0.0, 1.0)))
+        assert await db.allocate_parking_lot("already", 2) is True
+
+        granted = await db.allocate_parking_lots([("a", 1), ("b", 1), ("c", 1), ("already", 2), ("d", 2)])
+        assert sorted(granted) == [("a", 1), ("b", 1), ("d", 2)]
+
+        lots = {lot.id: lot for lot in await db.get_parking_lots_by_id([1, 2])}
+        assert lots[1].num_allocated == 2
+        assert lots[2].num_allocated == 2
+
+
+@pytest.mark.asyncio
+async def test_deallocate_parking_lots(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True)
+
+        await db.insert_parking_lot(ParkingLot(10, 'test_name', 0.0, Location(0.0, 1.0)))
+        assert sorted(await db.allocate_parking_lots([("a", 1), ("b", 1)])) == [("a", 1), ("b", 1)]
+
+        removed = await db.deallocate_parking_lots([("a", 1), ("a", 2), ("c", 1)])
+        assert removed == [("a", 1)]
+        assert (await db.get_parking_lots_by_id([1]))[0].num_allocated == 1
+        assert await db.deallocate_parking_lots([]) == []
+
+
+@pytest.mark.asyncio
+async def test_occupancy_history_and_rollups(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True,
+                                   write_behind_interval=60, history_samples=8, rollup_interval=3600)
+        await db.insert_parking_lot(ParkingLot(10, 'test_name', 0.0, Location(0.0, 1.0)))
+        await db.update_parking_lot_availability(1, 7)
+        await db.update_parking_lots_availability([(1, 5), (2, 1)])
+        await db.availability_buffer.flush()
+
+        _, values = db.history.window([1], since=0.0)
+        assert list(values[0][~np.isnan(values[0])]) == [10.0, 7.0, 5.0]
+
+        day = 86400.0 * 20000
+        await db.insert_occupancy_rollups([(1, day - 300.0, 3, 5, 10, 7.3, 5, day - 10.0),
+                                           (1, day, 1, 5, 5, 5.0, 5, day + 10.0)])
+        await db.insert_occupancy_rollups([(1, day + 300.0, 1, 4, 4, 4.0, 4, day + 310.0)])
+        rollups = await db.get_occupancy_rollups([1], day, day + 600.0)
+        assert rollups == [(1, day, 1, 5, 5, 5.0, 5, day + 10.0), (1, day + 300.0, 1, 4, 4, 4.0, 4, day + 310.0)]
+
+        # Another worker's partial rollup of the same buckets is merged in; the later last sample wins.
+        await db.insert_occupancy_rollups([(1, day, 3, 2, 6, 3.0, 6, day + 5.0),
+                                           (1, day + 300.0, 1, 8, 8, 8.0, 8, day + 320.0)])
+        rollups = await db.get_occupancy_rollups([1], day, day + 600.0)
+        assert rollups == [(1, day, 4, 2, 6, 3.5, 5, day + 10.0), (1, day + 300.0, 2, 4, 8, 6.0, 8, day + 320.0)]
+        async with db.pool.acquire() as conn:
+            partitions = await conn.fetchval("SELECT count(*) FROM pg_inherits "
+                                             "WHERE inhparent = 'occupancyrollups'::regclass")
+        assert partitions == 2
+        await db.close()
+
+
+@pytest.mark.asyncio
+async def test_rollup_table_only_with_rollups(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True, history_samples=8)
+        async with db.pool.acquire() as conn:
+            assert await conn.fetchval("SELECT to_regclass('occupancyrollups')") is None
+        await db.close()
+
+
+@pytest.mark.asyncio
+async def test_cache_follows_writes(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True)
+
+        park_id = await db.insert_parking_lot(ParkingLot(100, 'test_name', 0.0, Location(0.0, 1.0)))
+        await db.update_parking_lot_price(park_id, 5.0)
+        await db.update_parking_lot_availability(park_id, 10)
+        assert await db.allocate_parking_lot("test_user", park_id) is True
+
+        lot = db.cache.get(park_id)
+        assert (lot.price, lot.num_available, lot.num_allocated) == (5.0, 10, 1)
+
+        other_id = await db.insert_parking_lot(ParkingLot(100, 'test_name2', 0.0, Location(0.0, 1.0)))
+        assert db.cache.get(other_id) is not None
+        await db.delete_parking_lot(other_id)
+        assert db.cache.get(other_id) is None
+        assert await db.get_parking_lot(other_id) is None
+
+
+@pytest.mark.asyncio
+async def test_cache_invalidated_by_other_process(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True)
+        other = await DbAccess.create(postgresql.url(), event_loop)
+
+        park_id = await db.insert_parking_lot(ParkingLot(100, 'test_name', 0.0, Location(0.0, 1.0)))
+        version = db.cache.version_of(park_id)
+        await other.update_parking_lot_price(park_id, 7.0)
+
+        for _ in range(100):
+            if db.cache.version_of(park_id) != version:
+                break
+            await asyncio.sleep(0.01)
+        assert db.cache.get(park_id) is None
+        assert (await db.get_parking_lot(park_id)).price == 7.0
+        assert db.cache.get(park_id).price == 7.0
+        # Our own writes do not invalidate our cache.
+        assert db.cache.stats()['invalidations'] == 1
+
+        await other.close()
+        await db.close()
+
+
+@pytest.mark.asyncio
+async def test_cache_drops_lots_deleted_by_other_process(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True, history_samples=8)
+        other = await DbAccess.create(postgresql.url(), event_loop)
+        park_id = await db.insert_parking_lot(ParkingLot(100, 'test_name', 0.0, Location(0.0, 1.0)))
+        version = db.cache.version_of(park_id)
+        assert park_id in db.history.rows
+
+        await other.delete_parking_lot(park_id)
+        for _ in range(100):
+            if park_id not in db.cache.lots:
+                break
+            await asyncio.sleep(0.01)
+        assert park_id not in db.cache.lots and park_id not in db.cache.stale
+        assert db.cache.version > version
+        assert park_id not in db.history.rows
+
+        await other.close()
+        await db.close()
+
+
+@pytest.mark.asyncio
+async def test_notify_trigger_installed_on_start(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True)
+        triggers = "SELECT count(*) FROM pg_trigger WHERE tgname = 'parkinglots_changed'"
+        async with db.pool.acquire() as conn:
+            # As in a database whose tables predate the trigger.
+            await conn.execute('DROP TRIGGER parkinglots_changed ON ParkingLots')
+
+        other = await DbAccess.create(postgresql.url(), event_loop)
+        again = await DbAccess.create(postgresql.url(), event_loop)
+        async with db.pool.acquire() as conn:
+            assert await conn.fetchval(triggers) == 1
+
+        park_id = await db.insert_parking_lot(ParkingLot(100, 'test_name', 0.0, Location(0.0, 1.0)))
+        for _ in range(100):
+            if other.cache.stats()['invalidations']:
+                break
+            await asyncio.sleep(0.01)
+        assert other.cache.stats()['invalidations'] == 1 and park_id in other.cache.stale
+
+        await again.close()
+        await other.close()
+        await db.close()
+
+
+@pytest.mark.asyncio
+async def test_bulk_update_parking_lots(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True)
+
+        for name in ('test_name1', 'test_name2'):
+            await db.insert_parking_lot(ParkingLot(100, name, 0.0, Location(0.0, 1.0)))
+        updated = await db.update_parking_lots_availability([(1, 10), (3, 10), (1, 20)])
+        assert updated == [1]
+        assert sorted(await db.update_parking_lots_price([(1, 2.0), (2, 3.0)])) == [1, 2]
+        assert await db.update_parking_lots_price([]) == []
+
+        async with db.pool.acquire() as conn:
+            records = {r['id']: r for r in await conn.fetch('SELECT * from ParkingLots;')}
+        assert records[1]['num_available'] == 20
+        assert records[2]['price'] == 3.0
+        assert db.cache.get(1).num_available == 20
+
+
+@pytest.mark.asyncio
+async def test_write_behind_availability(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True, write_behind_interval=60)
+
+        park_id = await db.insert_parking_lot(ParkingLot(100, 'test_name', 0.0, Location(0.0, 1.0)))
+        assert await db.update_parking_lot_availability(park_id, 10) == park_id
+        assert await db.update_parking_lot_availability(park_id, 20) == park_id
+        assert await db.update_parking_lot_availability(2, 20) is None
+        assert db.cache.get(park_id).num_available == 20
+
+        async with db.pool.acquire() as conn:
+            assert await conn.fetchval('SELECT num_available from ParkingLots;') == 100
+        await db.close()
+        assert db.availability_buffer.stats()['coalesced'] == 1
+
+        db = await DbAccess.create(postgresql.url(), event_loop)
+        assert (await db.get_parking_lot(park_id)).num_available == 20
+        await db.close()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_skips_lots_changed_elsewhere(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True, write_behind_interval=60)
+        other = await DbAccess.create(postgresql.url(), event_loop)
+        kept = await db.insert_parking_lot(ParkingLot(100, 'kept', 0.0, Location(0.0, 1.0)))
+        deleted = await db.insert_parking_lot(ParkingLot(100, 'deleted', 0.0, Location(0.0, 1.0)))
+        await other.update_parking_lot_price(kept, 2.0)
+        await other.delete_parking_lot(deleted)
+        for _ in range(100):
+            if db.cache.get(kept) is None and db.cache.get(deleted) is None:
+                break
+            await asyncio.sleep(0.01)
+
+        # Neither is buffered: the deleted lot is reported missing, the changed one written at once.
+        assert await db.update_parking_lot_availability(deleted, 5) is None
+        assert await db.update_parking_lot_availability(kept, 5) == kept
+        assert db.availability_buffer.pending == {}
+        assert (await db.get_parking_lot(kept)).num_available == 5
+
+        await other.close()
+        await db.close()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_flush_keeps_newer_update(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True, write_behind_interval=60)
+        park_id = await db.insert_parking_lot(ParkingLot(100, 'test_name', 0.0, Location(0.0, 1.0)))
+        await db.update_parking_lot_availability(park_id, 10)
+
+        # An update arriving while the flush waits on the database must survive it.
+        flush = asyncio.ensure_future(db.availability_buffer.flush())
+        await asyncio.sleep(0)
+        await db.update_parking_lot_availability(park_id, 20)
+        version = db.cache.version_of(park_id)
+        assert await flush == 1
+        assert db.cache.get(park_id).num_available == 20
+        assert db.cache.version_of(park_id) == version
+        assert db.availability_buffer.pending == {park_id: 20}
+
+        # Left alone, a flushed lot keeps its cached entry and version.
+        await db.availability_buffer.flush()
+        assert db.cache.version_of(park_id) == version
+        async with db.pool.acquire() as conn:
+            assert await conn.fetchval('SELECT num_available from ParkingLots;') == 20
+        await db.close()
+
+
+@pytest.mark.asyncio
+async def test_statements_prepared_on_pool_connections(event_loop):
+    with Postgresql() as postgresql:
+        pool_config = PoolConfig(min_size=1, max_size=2)
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True, pool_config=pool_config)
+        await db.insert_parking_lot(ParkingLot(100, 'test_name', 0.0, Location(0.0, 1.0)))
+
+        async with db.pool.acquire() as conn:
+            prepared = set(r['statement'] for r in await conn.fetch('SELECT statement FROM pg_prepared_statements;'))
+        assert set(c.PREPARED_STATEMENTS) <= prepared
+        assert db.pool_stats.stats()['acquisitions'] >= 1
+        assert db.pool_stats.stats()['in_use'] == 0
+        await db.close()
+
+        # Guards the private asyncpg API that _init_connection relies on: the statements it prepares must be
+        # the ones queries find in the statement cache, so running them prepares nothing more.
+        count = 'SELECT count(*) FROM pg_prepared_statements WHERE statement = ANY($1::text[])'
+        pool_config = PoolConfig(min_size=1, max_size=1)
+        db = await DbAccess.create(postgresql.url(), event_loop, cache_lots=False, pool_config=pool_config)
+        async with db.pool.acquire() as conn:
+            before = await conn.fetchval(count, list(c.PREPARED_STATEMENTS))
+        assert before == len(c.PREPARED_STATEMENTS)
+        await db.get_parking_lot(1)
+        await db.get_parking_lots_by_id([1])
+        await db.update_parking_lot_price(1, 2.0)
+        await db.allocate_parking_lots([('a', 1)])
+        await db.register_session('a')
+        async with db.pool.acquire() as conn:
+            assert await conn.fetchval(count, list(c.PREPARED_STATEMENTS)) == before
+        await db.close()
+
+
+def test_pool_config_validation():
+    with pytest.raises(ValueError):
+        PoolConfig(min_size=5, max_size=2)
+
+
+@pytest.mark.asyncio
+async def test_allocate_parking_lot_full(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True)
+
+        await db.insert_parking_lot(ParkingLot(1, 'test_name', 0.0, Location(0.0, 1.0)))
+        assert await db.allocate_parking_lot("test_user1", 1) is True
+        assert await db.allocate_parking_lot("test_user2", 1) is False
+        assert db.cache.get(1).num_allocated == 1
+
+
+@pytest.mark.asyncio
+async def test_allocate_parking_lot_with_reservation_ledger(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True, reservation_block=4)
+        await db.insert_parking_lot(ParkingLot(5, 'test_name', 0.0, Location(0.0, 1.0)))
+
+        for i in range(3):
+            assert await db.allocate_parking_lot("test_user{}".format(i), 1) is True
+        assert await db.allocate_parking_lot("test_user0", 1) is False
+        assert db.ledger.slots[1] == 1
+        assert db.ledger.reservations == 1
+
+        async with db.pool.acquire() as conn:
+            assert await conn.fetchval('SELECT num_allocated from ParkingLots;') == 4
+            assert await conn.fetchval('SELECT count(*) from Allocations;') == 3
+
+        assert await db.allocate_parking_lot("test_user3", 1) is True
+        assert await db.allocate_parking_lot("test_user4", 1) is True
+        assert await db.allocate_parking_lot("test_user5", 1) is False
+
+        await db.close()
+        db = await DbAccess.create(postgresql.url(), event_loop)
+        async with db.pool.acquire() as conn:
+            assert await conn.fetchval('SELECT num_allocated from ParkingLots;') == 5
+
+
+@pytest.mark.asyncio
+async def test_reservation_ledger_release(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True, reservation_block=10)
+        await db.insert_parking_lot(ParkingLot(100, 'test_name', 0.0, Location(0.0, 1.0)))
+
+        assert await db.allocate_parking_lot("test_user", 1) is True
+        assert db.cache.get(1).num_allocated == 10
+        assert await db.ledger.release() == 9
+        assert db.cache.get(1).num_allocated == 1
+        async with db.pool.acquire() as conn:
+            assert await conn.fetchval('SELECT num_allocated from ParkingLots;') == 1
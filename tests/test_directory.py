@@ -0,0 +1,170 @@
+import asyncio
+import json
+
+import pytest
+import testing.postgresql
+from parking.backend.db.dbaccess import DbAccess
+from parking.backend.db.lot_cache import LotEntry
+from parking.backend.user_server.directory import SessionDirectory
+from parking.backend.user_server.notifier import LotUpdateNotifier
+from parking.backend.user_server.wsserver import UserSessions
+from parking.shared.location import Location
+from parking.shared.ws_models import ParkingAcceptanceMessage, ParkingDeallocationMessage
+
+Postgresql = testing.postgresql.PostgresqlFactory(cache_initialized_db=True)
+
+
+def teardown_module(module):
+    Postgresql.clear_cache()
+
+
+class RecordingSession:
+    binary = False
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, msg):
+        self.messages.append(msg)
+
+    def write_message(self, message, binary=False):
+        self.messages.append(json.loads(message))
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(None)
+        return future
+
+
+async def wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+
+
+async def create_worker(url, event_loop, **kwargs):
+    dba = await DbAccess.create(url, event_loop, **kwargs)
+    sessions = UserSessions()
+    notifier = LotUpdateNotifier(sessions, radius=500.0)
+    directory = SessionDirectory(dba, sessions, notifier)
+    await directory.start()
+    return dba, sessions, directory
+
+
+@pytest.mark.asyncio
+async def test_route_to_other_worker(event_loop):
+    with Postgresql() as postgresql:
+        dba_a, sessions_a, directory_a = await create_worker(postgresql.url(), event_loop, reset_tables=True)
+        dba_b, sessions_b, directory_b = await create_worker(postgresql.url(), event_loop)
+
+        session = RecordingSession()
+        sessions_a.add_user('user', session)
+        await directory_a.register('user')
+        assert await dba_b.locate_session('user') == dba_a.instance_id
+
+        assert await directory_b.send('user', ParkingAcceptanceMessage(3))
+        await wait_for(lambda: session.messages)
+        assert session.messages == [ParkingAcceptanceMessage(3)]
+        assert directory_b.routed == 1 and directory_a.received == 1
+
+        assert not await directory_b.send('nobody', ParkingAcceptanceMessage(3))
+
+        # Messages sent through the other worker's sessions, as the engine and offers do, are relayed too.
+        assert sessions_b.send_message('user', ParkingDeallocationMessage(4))
+        await wait_for(lambda: len(session.messages) == 2)
+        assert session.messages[1] == ParkingDeallocationMessage(4)
+
+        # Closing a worker forgets its sessions.
+        await directory_a.close()
+        assert await dba_b.locate_session('user') is None
+
+        await dba_b.close()
+        await dba_a.close()
+
+
+@pytest.mark.asyncio
+async def test_start_on_tables_without_sessions(event_loop):
+    with Postgresql() as postgresql:
+        setup = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True)
+        async with setup.pool.acquire() as conn:
+            # As in a database whose tables predate the Sessions table.
+            await conn.execute('DROP TABLE Sessions')
+        await setup.close()
+
+        dba_a, sessions_a, directory_a = await create_worker(postgresql.url(), event_loop)
+        dba_b, _, directory_b = await create_worker(postgresql.url(), event_loop)
+        session = RecordingSession()
+        sessions_a.add_user('user', session)
+        await directory_a.register('user')
+        assert await directory_b.send('user', ParkingAcceptanceMessage(3))
+        await wait_for(lambda: session.messages)
+        assert session.messages == [ParkingAcceptanceMessage(3)]
+
+        await dba_b.close()
+        await dba_a.close()
+
+
+@pytest.mark.asyncio
+async def test_unregister_keeps_newer_session(event_loop):
+    with Postgresql() as postgresql:
+        dba_a, _, directory_a = await create_worker(postgresql.url(), event_loop, reset_tables=True)
+        dba_b, _, directory_b = await create_worker(postgresql.url(), event_loop)
+
+        await directory_a.register('user')
+        await directory_b.register('user')
+        await directory_a.unregister('user')
+        assert await dba_a.locate_session('user') == dba_b.instance_id
+
+        await dba_b.close()
+        await dba_a.close()
+
+
+@pytest.mark.asyncio
+async def test_dead_worker_sessions_forgotten(event_loop):
+    with Postgresql() as postgresql:
+        dba_a, _, directory_a = await create_worker(postgresql.url(), event_loop, reset_tables=True)
+        dba_b, _, directory_b = await create_worker(postgresql.url(), event_loop)
+        await directory_a.register('user')
+        await directory_b.register('other')
+
+        # A dies without closing its directory, leaving its session behind.
+        await dba_a.close()
+        located = []
+
+        async def locate():
+            located.append(await dba_b.locate_session('user'))
+            return located[-1] is None
+
+        for _ in range(100):
+            if await locate():
+                break
+            await asyncio.sleep(0.01)
+        assert located[-1] is None
+
+        # The next worker to start forgets it, and keeps the live worker's.
+        dba_c, _, directory_c = await create_worker(postgresql.url(), event_loop)
+        async with dba_c.pool.acquire() as conn:
+            assert await conn.fetch('SELECT user_id FROM Sessions') == [('other',)]
+        assert await dba_c.locate_session('other') == dba_b.instance_id
+
+        await dba_c.close()
+        await dba_b.close()
+
+
+@pytest.mark.asyncio
+async def test_lot_updates_reach_other_workers(event_loop):
+    with Postgresql() as postgresql:
+        dba_a, sessions_a, directory_a = await create_worker(postgresql.url(), event_loop, reset_tables=True)
+        dba_b, sessions_b, directory_b = await create_worker(postgresql.url(), event_loop)
+
+        session = RecordingSession()
+        sessions_b.add_user('user', session)
+        sessions_b.update_user_location('user', Location(0.0, 0.001))
+
+        directory_a.notifier.notify(LotEntry(1, 'lot', 100, 0.0, 0.0, 2.0, 10, 0))
+        await wait_for(lambda: session.messages)
+        assert session.messages == [{'id': 1, 'available': 10, 'price': 2.0, '_type': 8}]
+        # The worker that published the update does not get it back.
+        assert directory_a.notifier.queued == 0
+
+        await dba_b.close()
+        await dba_a.close()
@@ -0,0 +1,110 @@
+import csv
+import io
+import json
+from asyncio import AbstractEventLoop
+
+import pytest
+import testing.postgresql
+import tornado.ioloop
+
+from parking.backend.__main__ import build_parser
+from parking.backend.admin_server.admin import make_admin_app
+from parking.backend.db import tools
+from parking.backend.db.dbaccess import DbAccess
+from parking.backend.db.export import ChunkFormatter, ExportFilter, parse_bbox
+from parking.shared.location import Location
+from parking.shared.rest_models import ParkingLot
+
+
+@pytest.fixture(scope="module")
+def postgresql():
+    postgresql_con = testing.postgresql.Postgresql()
+    yield postgresql_con
+    postgresql_con.stop()
+
+
+async def fill(dba: DbAccess) -> None:
+    for i in range(5):
+        await dba.insert_parking_lot(ParkingLot(10, 'lot{}'.format(i), 1.0, Location(float(i), float(i))))
+    await dba.allocate_parking_lots([('a', 1), ('b', 2), ('c', 2), ('d', 5)])
+
+
+@pytest.fixture
+def dba(postgresql):
+    loop: AbstractEventLoop = tornado.ioloop.IOLoop.current().asyncio_loop
+    dba = tornado.ioloop.IOLoop.current().run_sync(
+        lambda: DbAccess.create(postgresql.url(), loop=loop, reset_tables=True))
+    tornado.ioloop.IOLoop.current().run_sync(lambda: fill(dba))
+    yield dba
+    tornado.ioloop.IOLoop.current().run_sync(dba.close)
+
+
+@pytest.fixture
+def app(dba):
+    return make_admin_app(dba)
+
+
+@pytest.fixture
+def io_loop():
+    return tornado.ioloop.IOLoop.current()
+
+
+def test_formatter():
+    formatter = ChunkFormatter('csv', ('user_id', 'park_id'))
+    assert formatter.format([('a', 1)]) + formatter.format([('b,c', 2)]) == 'user_id,park_id\na,1\n"b,c",2\n'
+    assert formatter.finish() == ''
+    assert ChunkFormatter('csv', ('user_id',)).finish() == 'user_id\n'
+    assert ChunkFormatter('ndjson', ('user_id', 'park_id')).format([('a', 1)]) == '{"user_id": "a", "park_id": 1}\n'
+    with pytest.raises(ValueError):
+        ChunkFormatter('xml', ())
+
+
+def test_parse_bbox():
+    assert parse_bbox('1,2,3,4.5') == (1.0, 2.0, 3.0, 4.5)
+    for text in ('1,2,3', 'a,b,c,d', '3,0,1,1', '0,0,91,1'):
+        with pytest.raises(ValueError):
+            parse_bbox(text)
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_export_in_chunks(dba):
+    chunks = [[record['id'] for record in records] async for records in dba.export('lots', chunk_size=2)]
+    assert chunks == [[1, 2], [3, 4], [5]]
+
+    filtered = ExportFilter(min_id=2, bbox=(0.5, 0.5, 3.5, 3.5))
+    assert [r['id'] async for records in dba.export('lots', filtered) for r in records] == [2, 3, 4]
+    allocations = [tuple(r) async for records in dba.export('allocations', ExportFilter(max_id=2)) for r in records]
+    assert allocations == [('a', 1), ('b', 2), ('c', 2)]
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_export_endpoint(http_client, base_url):
+    response = await http_client.fetch(base_url + '/export/lots?chunk=2&min_id=4')
+    assert response.headers['Content-Type'].startswith('application/x-ndjson')
+    lots = [json.loads(line) for line in response.body.decode().splitlines()]
+    assert [lot['name'] for lot in lots] == ['lot3', 'lot4']
+
+    response = await http_client.fetch(base_url + '/export/allocations?format=csv&bbox=0.5,0.5,5,5')
+    rows = list(csv.reader(io.StringIO(response.body.decode())))
+    assert rows == [['user_id', 'park_id'], ['b', '2'], ['c', '2'], ['d', '5']]
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_admin_app_serves_metrics(http_client, base_url):
+    response = await http_client.fetch(base_url + '/metrics')
+    assert response.headers['Content-Type'].startswith('text/plain')
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_export_endpoint_errors(http_client, base_url):
+    for path in ('/export/users', '/export/lots?format=xml', '/export/lots?chunk=0', '/export/lots?min_id=x',
+                 '/export/lots?bbox=1,2'):
+        response = await http_client.fetch(base_url + path, raise_error=False)
+        assert response.code in (400, 404)
+
+
+def test_export_command(postgresql, dba, tmp_path):
+    output = tmp_path / 'allocations.csv'
+    tools.run_command(build_parser().parse_args(['--db', postgresql.url(), 'export', 'allocations', '--format', 'csv',
+                                                 '--output', str(output), '--min-id', '2', '--chunk', '1']))
+    assert output.read_text() == 'user_id,park_id\nb,2\nc,2\nd,5\n'
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from parking.backend.db.occupancy import OccupancyHistory
+from parking.backend.engine.forecast import AvailabilityForecaster
+
+
+def test_constant_availability():
+    history = OccupancyHistory(samples=16)
+    for t in range(10):
+        history.record(1, 20, timestamp=60.0 * t)
+    forecaster = AvailabilityForecaster(history)
+    assert forecaster.refresh(now=600.0) == 10
+    assert forecaster.available_at([1], np.array([0.0]))[0] == pytest.approx(20.0)
+    assert forecaster.available_at([1], np.array([1800.0]))[0] == pytest.approx(20.0)
+
+
+def test_falling_availability_forecast_lower():
+    history = OccupancyHistory(samples=64)
+    for t in range(40):
+        history.record(1, 100 - t, timestamp=60.0 * t)
+        history.record(2, 50, timestamp=60.0 * t)
+    forecaster = AvailabilityForecaster(history)
+    forecaster.refresh(now=2400.0)
+
+    # Lots along the last axis, so each row is one driver's arrival times.
+    forecast = forecaster.available_at([1, 2], np.array([[0.0, 0.0], [900.0, 900.0]]))
+    assert forecast.shape == (2, 2)
+    assert forecast[1, 0] < forecast[0, 0] < 65
+    assert forecast[1, 1] == pytest.approx(50.0)
+
+
+def test_refresh_is_incremental():
+    history = OccupancyHistory(samples=16)
+    history.record_many([1, 2], [5, 6], timestamp=10.0)
+    forecaster = AvailabilityForecaster(history)
+    assert forecaster.refresh(now=10.0) == 2
+    assert forecaster.refresh(now=20.0) == 0
+    history.record(2, 4, timestamp=30.0)
+    assert forecaster.refresh(now=30.0) == 1
+    assert forecaster.processed == 3
+
+
+def test_unknown_and_reused_lots():
+    history = OccupancyHistory(samples=4, initial_lots=1)
+    history.record(1, 100, timestamp=0.0)
+    forecaster = AvailabilityForecaster(history)
+    forecaster.refresh(now=0.0)
+    assert np.isnan(forecaster.available_at([7], np.array([0.0]))[0])
+
+    history.remove(1)
+    history.record(2, 3, timestamp=10.0)
+    # Lot 2 took over lot 1's row but has no forecast until the next refresh.
+    assert np.isnan(forecaster.available_at([2], np.array([0.0]))[0])
+    forecaster.refresh(now=10.0)
+    assert forecaster.available_at([2], np.array([0.0]))[0] == pytest.approx(3.0)
+
+
+def test_close_samples_and_capacity():
+    history = OccupancyHistory(samples=16)
+    history.record(1, 10, timestamp=100.0)
+    # Same timestamp, then a millisecond later: the trend stays finite and moderate.
+    history.record(1, 12, timestamp=100.0)
+    history.record(1, 14, timestamp=100.001)
+    forecaster = AvailabilityForecaster(history)
+    forecaster.refresh(now=100.001)
+    assert np.isfinite(forecaster.trend).all()
+    assert abs(forecaster.trend[0]) <= 2.0
+
+    forecast = forecaster.available_at([1], np.array([3600.0]), capacities=[16])
+    assert 0.0 <= forecast[0] <= 16.0
+    forecast = forecaster.available_at([1], np.array([[0.0], [3600.0]]), capacities=[12])
+    assert forecast.shape == (2, 1) and (forecast <= 12.0).all()
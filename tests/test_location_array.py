@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from parking.shared.location import Location, haversine
+from parking.shared.location_array import LocationArray, bounding_box, haversine_matrix
+
+LONDON = Location(51.5074, -0.1278)
+PARIS = Location(48.8566, 2.3522)
+
+
+def test_round_trip_locations():
+    locations = [LONDON, PARIS, Location(0.0, 0.0)]
+    points = LocationArray.from_locations(locations)
+    assert len(points) == 3
+    assert points.to_locations() == locations
+    assert points[1] == PARIS
+    assert points[np.array([True, False, True])].to_locations() == [LONDON, Location(0.0, 0.0)]
+    assert LocationArray.from_locations([]).to_locations() == []
+
+
+def test_mismatched_arrays():
+    with pytest.raises(ValueError):
+        LocationArray([0.0, 1.0], [0.0])
+
+
+def test_haversine_matches_scalar():
+    points = LocationArray.from_locations([LONDON, PARIS])
+    expected = haversine(LONDON.latitude, LONDON.longitude, PARIS.latitude, PARIS.longitude)
+    assert points.haversine(PARIS)[0] == pytest.approx(expected)
+    assert points.haversine(PARIS)[1] == 0.0
+    assert points.haversine(LocationArray.from_locations([PARIS, LONDON]))[0] == pytest.approx(expected)
+
+
+def test_haversine_matrix_matches_scalar():
+    lats, longs = np.array([0.0, 51.5]), np.array([0.0, -0.1])
+    d = haversine_matrix(lats, longs, np.array([1.0]), np.array([1.0]))
+    assert d.shape == (2, 1)
+    assert d[1, 0] == pytest.approx(haversine(51.5, -0.1, 1.0, 1.0))
+
+
+def test_equirectangular_close_to_haversine():
+    points = LocationArray([51.50, 51.52, 51.45], [-0.12, -0.10, -0.20])
+    others = LocationArray([51.51, 51.48], [-0.13, -0.05])
+    assert points.equirectangular_matrix(others) == pytest.approx(points.haversine_matrix(others), rel=1e-3)
+    # Across the antimeridian the short way round is taken.
+    across = LocationArray([0.0], [179.99]).equirectangular(Location(0.0, -179.99))
+    assert across[0] == pytest.approx(haversine(0.0, 179.99, 0.0, -179.99), rel=1e-6)
+
+
+def test_bearing():
+    origin = LocationArray([0.0, 0.0, 0.0, 0.0], [0.0, 0.0, 0.0, 0.0])
+    targets = LocationArray([1.0, 0.0, -1.0, 0.0], [0.0, 1.0, 0.0, -1.0])
+    assert origin.bearing(targets) == pytest.approx([0.0, 90.0, 180.0, 270.0])
+
+
+def test_within():
+    points = LocationArray([0.0, 0.0, 0.01, 1.0, np.nan], [0.0, 0.005, 0.0, 0.0, np.nan])
+    assert list(points.within(Location(0.0, 0.0), 1200.0)) == [True, True, True, False, False]
+    assert list(points.within(Location(0.0, 0.0), 600.0)) == [True, True, False, False, False]
+
+
+def test_bounding_box_antimeridian_and_poles():
+    south, west, north, east = bounding_box(Location(0.0, 179.99), 5000.0)
+    assert west > east
+    points = LocationArray([0.0, 0.0, 0.0], [-179.99, 179.0, 0.0])
+    assert list(points.within_box(south, west, north, east)) == [True, False, False]
+    assert list(points.within(Location(0.0, 179.99), 5000.0)) == [True, False, False]
+
+    assert bounding_box(Location(89.99, 0.0), 5000.0)[1:4:2] == (-180.0, 180.0)
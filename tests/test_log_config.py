@@ -0,0 +1,66 @@
+import io
+import logging
+import threading
+
+import pytest
+from parking.backend import log_config
+from parking.backend.log_config import EventSampler, configure_logging, log_event
+
+
+def test_sampler_rates():
+    sampler = EventSampler({'location_update': 0.01, 'parking_cancel': 1.0, 'never': 0.0})
+    assert sum(sampler.sample('location_update') for _ in range(1000)) == 10
+    assert all(sampler.sample('parking_cancel') for _ in range(10))
+    assert not any(sampler.sample('never') for _ in range(10))
+    assert all(sampler.sample('unknown') for _ in range(10))
+
+
+def test_sampler_spreads_evenly():
+    sampler = EventSampler({'event': 0.25})
+    assert [sampler.sample('event') for _ in range(8)] == [False, False, False, True] * 2
+
+
+def test_invalid_rate():
+    with pytest.raises(ValueError):
+        EventSampler({'event': 2.0})
+
+
+@pytest.fixture
+def backend_logger():
+    logger = logging.getLogger('backend')
+    handlers, level, propagate = list(logger.handlers), logger.level, logger.propagate
+    sampler = log_config.SAMPLER
+    log_config.SAMPLER = EventSampler()
+    yield logger
+    log_config.SAMPLER = sampler
+    logger.handlers, logger.level, logger.propagate = handlers, level, propagate
+
+
+class ThreadRecorder:
+    """A log argument that remembers which thread formatted it."""
+    def __init__(self):
+        self.thread = None
+
+    def __str__(self):
+        self.thread = threading.get_ident()
+        return 'arg'
+
+
+def test_records_formatted_off_thread(backend_logger):
+    stream = io.StringIO()
+    listener = configure_logging(logging.DEBUG, {'location_update': 0.5}, stream=stream, fmt='%(message)s')
+    arg = ThreadRecorder()
+    for _ in range(4):
+        log_event(backend_logger, logging.DEBUG, 'location_update', 'update %s', arg)
+    listener.stop()
+
+    assert stream.getvalue() == 'update arg\nupdate arg\n'
+    assert arg.thread is not None and arg.thread != threading.get_ident()
+
+
+def test_disabled_level_builds_nothing(backend_logger):
+    backend_logger.setLevel(logging.INFO)
+    log_config.SAMPLER.set_rate('location_update', 0.5)
+    log_event(backend_logger, logging.DEBUG, 'location_update', 'update %s', 'x')
+    # The sampler is not consulted for records that would be dropped anyway.
+    assert log_config.SAMPLER.counts == {}
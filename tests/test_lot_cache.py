@@ -0,0 +1,52 @@
+from parking.backend.db.lot_cache import LotCache, LotEntry
+
+
+def make_entry(lot_id=1):
+    return LotEntry(lot_id, 'test_name', 100, 0.0, 1.0, 2.0, 100, 0)
+
+
+def test_get_hit_and_miss():
+    cache = LotCache()
+    cache.put(make_entry())
+    assert cache.get(1).name == 'test_name'
+    assert cache.get(2) is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_update_bumps_version():
+    cache = LotCache()
+    cache.put(make_entry())
+    before = cache.version_of(1)
+    cache.update(1, price=3.0)
+    assert cache.get(1).price == 3.0
+    assert cache.version_of(1) > before
+
+
+def test_add_allocations():
+    cache = LotCache()
+    cache.put(make_entry())
+    cache.add_allocations(1, 2)
+    assert cache.get(1).num_allocated == 2
+
+
+def test_invalidate_marks_stale_until_put():
+    cache = LotCache()
+    cache.put(make_entry())
+    before = cache.version_of(1)
+    cache.invalidate(1)
+    assert cache.version_of(1) > before
+    assert cache.get(1) is None
+    cache.put(make_entry())
+    assert cache.get(1) is not None
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_remove():
+    cache = LotCache()
+    cache.load([{'id': 1, 'name': 'a', 'capacity': 1, 'lat': 0.0, 'long': 0.0, 'price': 0.0,
+                 'num_available': 1, 'num_allocated': 0}])
+    assert len(cache) == 1
+    cache.remove(1)
+    assert cache.get(1) is None
+    assert cache.version_of(1) == 0
@@ -0,0 +1,79 @@
+import random
+
+import pytest
+from parking.backend.engine.lot_index import LotIndex
+from parking.shared.location import Location, haversine
+
+
+def brute_force_nearest(points, location, k):
+    dists = sorted((haversine(location.latitude, location.longitude, lat, long), lot_id)
+                   for lot_id, (lat, long) in points.items())
+    return [lot_id for _, lot_id in dists[:k]]
+
+
+def test_insert_and_remove():
+    index = LotIndex()
+    index.insert(1, Location(0.0, 1.0))
+    assert 1 in index
+    assert len(index) == 1
+    assert index.get_location(1) == Location(0.0, 1.0)
+    assert index.remove(1) is True
+    assert 1 not in index
+    assert index.cells == {}
+    assert index.remove(1) is False
+
+
+def test_insert_existing_moves_lot():
+    index = LotIndex()
+    index.insert(1, Location(0.0, 1.0))
+    index.insert(1, Location(50.0, 1.0))
+    assert len(index) == 1
+    assert index.nearest(Location(50.0, 1.0))[0] == (1, 0.0)
+
+
+def test_nearest_empty_index():
+    assert LotIndex().nearest(Location(0.0, 0.0), k=3) == []
+
+
+def test_invalid_cell_size():
+    with pytest.raises(ValueError):
+        LotIndex(cell_size=0)
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(42)
+    index = LotIndex(cell_size=0.01)
+    points = {}
+    for lot_id in range(2000):
+        lat, long = 53.9 + rng.random() * 0.2, -1.2 + rng.random() * 0.3
+        points[lot_id] = (lat, long)
+        index.insert(lot_id, Location(lat, long))
+
+    for _ in range(50):
+        query = Location(53.9 + rng.random() * 0.2, -1.2 + rng.random() * 0.3)
+        result = index.nearest(query, k=5)
+        assert [lot_id for lot_id, _ in result] == brute_force_nearest(points, query, 5)
+
+
+def test_nearest_far_away_lot():
+    index = LotIndex(cell_size=0.001)
+    index.insert(1, Location(10.0, 10.0))
+    index.insert(2, Location(-10.0, -10.0))
+    assert [lot_id for lot_id, _ in index.nearest(Location(9.0, 9.0), k=2)] == [1, 2]
+
+
+def test_nearest_max_distance():
+    index = LotIndex()
+    index.insert(1, Location(0.0, 0.0))
+    index.insert(2, Location(0.0, 0.1))
+    assert [lot_id for lot_id, _ in index.nearest(Location(0.0, 0.0), k=2, max_distance=1000.0)] == [1]
+
+
+def test_within_radius():
+    index = LotIndex()
+    index.insert(1, Location(0.0, 0.0))
+    index.insert(2, Location(0.0, 0.005))
+    index.insert(3, Location(0.0, 0.05))
+    result = index.within(Location(0.0, 0.0), 1000.0)
+    assert [lot_id for lot_id, _ in result] == [1, 2]
+    assert all(d <= 1000.0 for _, d in result)
@@ -0,0 +1,66 @@
+import asyncio
+import io
+
+import pytest
+import testing.postgresql
+
+from parking.backend.__main__ import load_lot_index
+from parking.backend.db import tools
+from parking.backend.db.dbaccess import DbAccess
+from parking.shared.location import Location
+from parking.shared.rest_models import ParkingLot
+
+Postgresql = testing.postgresql.PostgresqlFactory(cache_initialized_db=True)
+
+
+def teardown_module(module):
+    Postgresql.clear_cache()
+
+
+async def wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('cache_lots', [True, False])
+async def test_index_follows_other_workers(event_loop, cache_lots):
+    with Postgresql() as postgresql:
+        dba_a = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True)
+        first = await dba_a.insert_parking_lot(ParkingLot(10, 'first', 1.0, Location(0.0, 0.0)))
+        dba_b = await DbAccess.create(postgresql.url(), event_loop, cache_lots=cache_lots)
+        index_b = await load_lot_index(dba_b)
+        assert first in index_b
+
+        second = await dba_a.insert_parking_lot(ParkingLot(10, 'second', 1.0, Location(0.0, 0.001)))
+        await wait_for(lambda: second in index_b)
+        assert index_b.get_location(second) == Location(0.0, 0.001)
+
+        await dba_a.delete_parking_lot(first)
+        await wait_for(lambda: first not in index_b)
+        assert first not in index_b and second in index_b
+
+        # Changes made through dba_b itself are left to its handlers.
+        third = await dba_b.insert_parking_lot(ParkingLot(10, 'third', 1.0, Location(0.0, 0.002)))
+        await asyncio.sleep(0.1)
+        assert third not in index_b
+        await dba_a.close()
+        await dba_b.close()
+
+
+@pytest.mark.asyncio
+async def test_index_follows_bulk_import(event_loop):
+    with Postgresql() as postgresql:
+        dba_server = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True)
+        index = await load_lot_index(dba_server)
+
+        # The import command runs in a process of its own while the server keeps running.
+        dba_import = await DbAccess.create(postgresql.url(), event_loop, cache_lots=False)
+        csv = 'name,capacity,price,lat,long\n' + ''.join('lot{0},10,1.5,0.0,0.00{0}\n'.format(i) for i in range(5))
+        ids = await tools.import_lots(dba_import, io.StringIO(csv), 'csv')
+        await wait_for(lambda: all(lot_id in index for lot_id in ids))
+        assert [index.get_location(lot_id) for lot_id in ids] == [Location(0.0, i / 1000) for i in range(5)]
+        await dba_import.close()
+        await dba_server.close()
@@ -0,0 +1,97 @@
+import pytest
+import tornado.web
+from parking.backend.admin_server.admin import MetricsHandler
+from parking.backend.metrics import Counter, Gauge, Histogram, Metric, Registry, timed
+
+
+def test_histogram_render():
+    registry = Registry()
+    histogram = Histogram('latency_seconds', 'Latency.', ['route'], registry=registry, buckets=[0.1, 1.0])
+    child = histogram.labels('a')
+    for value in (0.05, 0.1, 0.5, 5.0):
+        child.observe(value)
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ['# HELP latency_seconds Latency.', '# TYPE latency_seconds histogram']
+    assert lines[2:] == ['latency_seconds_bucket{route="a",le="0.1"} 2.0',
+                         'latency_seconds_bucket{route="a",le="1.0"} 3.0',
+                         'latency_seconds_bucket{route="a",le="+Inf"} 4.0',
+                         'latency_seconds_count{route="a"} 4.0',
+                         'latency_seconds_sum{route="a"} 5.65']
+
+
+def test_counter_and_gauge():
+    registry = Registry()
+    Counter('events', 'Events.', registry=registry).inc(3)
+    gauge = Gauge('users', 'Users.', registry=registry)
+    gauge.set_function(lambda: 7)
+    text = registry.render()
+    assert 'events_total 3.0\n' in text
+    assert 'users 7.0\n' in text
+
+
+def test_label_escaping():
+    registry = Registry()
+    Counter('events', 'Events.', ['name'], registry=registry).labels('a"b\\c\nd').inc()
+    assert 'events_total{name="a\\"b\\\\c\\nd"} 1.0' in registry.render()
+
+
+def test_wrong_label_count():
+    counter = Counter('events', 'Events.', ['a', 'b'], registry=None)
+    with pytest.raises(ValueError):
+        counter.labels('x')
+
+
+def test_duplicate_metric():
+    registry = Registry()
+    Counter('events', 'Events.', registry=registry)
+    with pytest.raises(ValueError):
+        Counter('events', 'Events.', registry=registry)
+
+
+def test_metric_is_abstract():
+    class Incomplete(Metric):
+        def _new_child(self):
+            return object()
+
+    with pytest.raises(TypeError):
+        Metric('events', 'Events.', registry=None)
+    with pytest.raises(TypeError):
+        Incomplete('events', 'Events.', registry=None)
+
+
+@pytest.mark.asyncio
+async def test_timed():
+    histogram = Histogram('calls_seconds', 'Calls.', ['method'], registry=None)
+    errors = Counter('call_errors', 'Errors.', ['method'], registry=None)
+
+    @timed(histogram, errors)
+    async def work(fail):
+        if fail:
+            raise RuntimeError()
+        return 1
+
+    assert await work(False) == 1
+    with pytest.raises(RuntimeError):
+        await work(True)
+    assert sum(histogram.labels('work').counts) == 2
+    assert errors.labels('work').value == 1
+
+
+@pytest.fixture
+def app():
+    registry = Registry()
+    Counter('events', 'Events.', registry=registry).inc()
+    return tornado.web.Application([(r'/metrics', MetricsHandler, {'registry': registry})])
+
+
+@pytest.fixture
+def io_loop():
+    return tornado.ioloop.IOLoop.current()
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_metrics_endpoint(http_client, base_url):
+    response = await http_client.fetch(base_url + '/metrics')
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    assert b'events_total 1.0' in response.body
@@ -1,6 +1,16 @@
+import json
+from types import SimpleNamespace
+from typing import List
+
+import attr
 import pytest
-from parking.shared.util import serialize_model
-from parking.shared.rest_models import ParkingLotAvailableMessage
+from parking.shared.location import Location
+from parking.shared.util import _nested, serialize_model, serializer, trusted
+from parking.shared.rest_models import (ParkingLot, ParkingLotAvailableMessage, ParkingLotAvailableUpdate,
+                                        ParkingLotBulkUpdateMessage, ParkingLotBulkUpdateResponse,
+                                        ParkingLotPriceUpdate, ParkingLotSearchResponse, ParkingLotStatus)
+from parking.shared.ws_models import (ParkingAllocationMessage, ParkingCancellationMessage, ParkingRequestMessage,
+                                      WebSocketMessageType)
 
 
 def test_serialize_model():
@@ -12,3 +22,46 @@ def test_serialize_model():
 def test_serialize_model_raises_error():
     with pytest.raises(ValueError):
         serialize_model(None)
+
+
+def test_serializer_matches_asdict():
+    loc = Location(51.5, -0.1)
+    models = [
+        ParkingAllocationMessage(ParkingLot(10, 'lot', 1.5, loc, 3)),
+        ParkingAllocationMessage(None, {'reason': 'no_lot_available'}),
+        ParkingRequestMessage(loc, {'max_price': 2.0}),
+        ParkingLotSearchResponse([ParkingLotStatus(1, 'a', 3, 1.0, loc, 1, 2),
+                                  ParkingLotStatus(2, 'b', 3, 1.0, loc, 0, 3)]),
+        ParkingLotBulkUpdateMessage([ParkingLotAvailableUpdate(1, 2)], [ParkingLotPriceUpdate(1, 2.0)]),
+        ParkingLotBulkUpdateResponse([1], [2]),
+    ]
+    for model in models:
+        assert serializer(type(model))(model) == attr.asdict(model)
+        assert serialize_model(model) == json.dumps(attr.asdict(model))
+
+
+def test_nested():
+    assert _nested(List[Location])
+    assert not _nested(List[int]) and not _nested(Location) and not _nested(dict)
+    # How Python 3.6 represents List[Location].
+    assert _nested(SimpleNamespace(__origin__=List, __args__=(Location,)))
+
+
+def test_trusted():
+    loc = trusted(Location)(51.5, -0.1)
+    assert loc == Location(51.5, -0.1)
+    assert trusted(ParkingLot)(10, 'lot', 1.5, loc) == ParkingLot(10, 'lot', 1.5, loc)
+    assert trusted(ParkingCancellationMessage)(3, reason=1) == ParkingCancellationMessage(3, 1)
+    assert trusted(ParkingCancellationMessage)(3)._type == WebSocketMessageType.PARKING_CANCEL
+    first, second = trusted(ParkingRequestMessage)(loc), trusted(ParkingRequestMessage)(loc)
+    assert first.preferences == {} and first.preferences is not second.preferences
+
+    # Nothing is checked, which is the point.
+    assert trusted(ParkingLot)(0, 'lot', 1.5, loc).capacity == 0
+    with pytest.raises(ValueError):
+        ParkingLot(0, 'lot', 1.5, loc)
+
+
+def test_models_have_slots():
+    assert not hasattr(ParkingLot(10, 'lot', 1.5, Location(51.5, -0.1)), '__dict__')
+    assert not hasattr(trusted(Location)(51.5, -0.1), '__dict__')
@@ -0,0 +1,114 @@
+import asyncio
+import json
+
+import pytest
+from tornado.websocket import WebSocketClosedError
+from parking.backend.db.lot_cache import LotEntry
+from parking.backend.user_server.notifier import LotUpdateNotifier
+from parking.backend.user_server.payload_cache import LotPayloadCache
+from parking.backend.user_server.wsserver import UserSessions
+from parking.shared import ws_codec
+from parking.shared.location import Location
+from parking.shared.ws_models import ParkingLotUpdateMessage
+
+
+class SlowSession:
+    """Stands in for a UserWSHandler whose writes complete only when released."""
+    def __init__(self, binary=False):
+        self.binary = binary
+        self.messages = []
+        self.pending = []
+        self.closed = False
+
+    def write_message(self, message, binary=False):
+        if self.closed:
+            raise WebSocketClosedError()
+        self.messages.append(message)
+        future = asyncio.get_event_loop().create_future()
+        self.pending.append(future)
+        return future
+
+    def release(self):
+        for future in self.pending:
+            future.set_result(None)
+        self.pending = []
+
+
+def lot(lot_id, available=10, price=1.0, lat=0.0, long=0.0):
+    return LotEntry(lot_id, 'lot', 100, lat, long, price, available, 0)
+
+
+@pytest.fixture
+def sessions():
+    user_sessions = UserSessions()
+    for user_id, location in [('near', Location(0.0, 0.001)), ('far', Location(1.0, 1.0))]:
+        user_sessions.add_user(user_id, SlowSession())
+        user_sessions.update_user_location(user_id, location)
+    user_sessions.add_user('binary', SlowSession(binary=True))
+    user_sessions.update_user_location('binary', Location(0.0, -0.001))
+    return user_sessions
+
+
+@pytest.mark.asyncio
+async def test_notify_nearby_only(sessions):
+    notifier = LotUpdateNotifier(sessions, radius=500.0)
+    assert notifier.notify(lot(1)) == 2
+    await asyncio.sleep(0)
+
+    near = sessions.get_user('near').session
+    assert [json.loads(m) for m in near.messages] == [{'id': 1, 'available': 10, 'price': 1.0, '_type': 8}]
+    binary = sessions.get_user('binary').session
+    assert ws_codec.decode(binary.messages[0]) == ParkingLotUpdateMessage(1, 10, 1.0)
+    assert sessions.get_user('far').session.messages == []
+
+
+@pytest.mark.asyncio
+async def test_stale_updates_dropped(sessions):
+    notifier = LotUpdateNotifier(sessions, radius=500.0)
+    session = sessions.get_user('near').session
+    notifier.notify(lot(1, available=10))
+    await asyncio.sleep(0)
+    # The first write is in flight; later updates queue behind it and replace each other.
+    notifier.notify(lot(1, available=9))
+    notifier.notify(lot(2, available=5))
+    notifier.notify(lot(1, available=8))
+    assert notifier.dropped == 2  # one for each session
+
+    for _ in range(3):
+        session.release()
+        sessions.get_user('binary').session.release()
+        await asyncio.sleep(0)
+    assert [(m['id'], m['available']) for m in map(json.loads, session.messages)] == [(1, 10), (1, 8), (2, 5)]
+    assert notifier.outboxes == {}
+
+
+@pytest.mark.asyncio
+async def test_closed_session(sessions):
+    notifier = LotUpdateNotifier(sessions, radius=500.0)
+    sessions.get_user('near').session.closed = True
+    notifier.notify(lot(1))
+    await asyncio.sleep(0)
+    sessions.get_user('binary').session.release()
+    await asyncio.sleep(0)
+    assert notifier.outboxes == {}
+    assert notifier.sent == 1
+
+
+@pytest.mark.asyncio
+async def test_notify_with_cached_payloads(sessions):
+    payloads = LotPayloadCache()
+    notifier = LotUpdateNotifier(sessions, radius=500.0, payloads=payloads)
+    entry = lot(1)
+    entry.version = 1
+    notifier.notify(entry)
+    await asyncio.sleep(0)
+    for session in (sessions.get_user('near').session, sessions.get_user('binary').session):
+        session.release()
+    await asyncio.sleep(0)
+    notifier.notify(entry)
+    await asyncio.sleep(0)
+
+    assert payloads.stats()['misses'] == 1 and payloads.stats()['hits'] == 1
+    near = sessions.get_user('near').session
+    assert [json.loads(m) for m in near.messages] == [{'id': 1, 'available': 10, 'price': 1.0, '_type': 8}] * 2
+    assert ws_codec.decode(sessions.get_user('binary').session.messages[1]) == ParkingLotUpdateMessage(1, 10, 1.0)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from parking.backend.db.occupancy import OccupancyHistory, RollupWriter
+
+
+def test_ring_buffer_keeps_latest_samples():
+    history = OccupancyHistory(samples=3, initial_lots=1)
+    for t, available in enumerate([10, 9, 8, 7]):
+        history.record(1, available, timestamp=float(t))
+    times, values = history.window([1], since=0.0)
+    assert list(times[0]) == [1.0, 2.0, 3.0]
+    assert list(values[0]) == [9.0, 8.0, 7.0]
+
+
+def test_window_over_many_lots():
+    history = OccupancyHistory(samples=4, initial_lots=1)
+    history.record_many([1, 2, 1], [5, 6, 7], timestamp=10.0)
+    history.record(2, 4, timestamp=20.0)
+    times, values = history.window([2, 1, 3], since=15.0)
+    assert values.shape == (3, 4)
+    assert list(values[0][~np.isnan(values[0])]) == [4.0]
+    assert np.isnan(values[1]).all() and np.isnan(values[2]).all()
+
+    _, values = history.window([1], since=0.0, until=15.0)
+    assert list(values[0][~np.isnan(values[0])]) == [7.0]
+
+
+def test_remove_recycles_row():
+    history = OccupancyHistory(samples=2, initial_lots=1)
+    history.record(1, 5, timestamp=1.0)
+    history.remove(1)
+    history.record(2, 3, timestamp=2.0)
+    assert len(history) == 1 and history.rows == {2: 0}
+    _, values = history.window([2], since=0.0)
+    assert list(values[0][~np.isnan(values[0])]) == [3.0]
+
+
+def test_rollup():
+    history = OccupancyHistory(samples=8)
+    for t, available in [(0.0, 10), (1.0, 4), (2.0, 6), (5.0, 1)]:
+        history.record(1, available, timestamp=t)
+    history.record(2, 3, timestamp=7.0)
+    assert history.rollup(0.0, 5.0) == [(1, 0.0, 3, 4, 10, pytest.approx(20 / 3), 6, 2.0)]
+    assert sorted(history.rollup(5.0, 10.0)) == [(1, 5.0, 1, 1, 1, 1.0, 1, 5.0), (2, 5.0, 1, 3, 3, 3.0, 3, 7.0)]
+    assert history.rollup(10.0, 15.0) == []
+
+
+@pytest.mark.asyncio
+async def test_rollup_writer_writes_complete_buckets():
+    history = OccupancyHistory(samples=8)
+    batches = []
+
+    async def write(rollups):
+        batches.append(rollups)
+
+    writer = RollupWriter(history, write, interval=10.0)
+    writer.written_until = 100.0
+    history.record(1, 5, timestamp=105.0)
+    history.record(1, 3, timestamp=115.0)
+    history.record(1, 2, timestamp=121.0)
+    assert await writer.flush(now=125.0) == 2
+    assert [r[1] for r in batches[0]] == [100.0, 110.0]
+    assert await writer.flush(now=125.0, partial=True) == 1
+    assert batches[1] == [(1, 120.0, 1, 2, 2, 2.0, 2, 121.0)]
@@ -0,0 +1,128 @@
+import json
+
+import pytest
+import testing.postgresql
+
+from parking.backend.db.dbaccess import DbAccess
+from parking.backend.engine.offers import OfferExpiry
+from parking.backend.user_server.wsserver import UserSessions
+from parking.shared.location import Location
+from parking.shared.rest_models import ParkingLot
+from parking.shared.util import serialize_model
+from parking.shared.ws_models import WebSocketMessageType
+
+Postgresql = testing.postgresql.PostgresqlFactory(cache_initialized_db=True)
+
+
+def teardown_module(module):
+    Postgresql.clear_cache()
+
+
+class RecordingSession:
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, msg):
+        self.messages.append(json.loads(serialize_model(msg)))
+
+
+async def allocated(db, park_id):
+    return (await db.get_parking_lots_by_id([park_id]))[0].num_allocated
+
+
+@pytest.mark.asyncio
+async def test_unanswered_offer_expires(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True)
+        await db.insert_parking_lot(ParkingLot(10, 'test_name', 0.0, Location(0.0, 1.0)))
+        await db.allocate_parking_lots([('a', 1), ('b', 1)])
+
+        sessions = UserSessions()
+        sessions.add_user('a', RecordingSession())
+        offers = OfferExpiry(db, sessions, timeout=1.0, tick=0.5)
+        offers.offer('a', 1)
+        offers.offer('b', 1)
+        assert offers.accept('b', 1) is True
+
+        start = offers.wheel.start
+        assert await offers.turn(start + 0.5) == []
+        assert await offers.turn(start + 1.0) == [('a', 1)]
+        assert len(offers) == 0
+        assert await allocated(db, 1) == 1
+
+        messages = sessions.get_user('a').session.messages
+        assert messages == [{'_type': WebSocketMessageType.PARKING_DEALLOC, 'id': 1}]
+
+
+@pytest.mark.asyncio
+async def test_rejected_offer_released(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True)
+        await db.insert_parking_lot(ParkingLot(10, 'test_name', 0.0, Location(0.0, 1.0)))
+        await db.allocate_parking_lots([('a', 1)])
+
+        offers = OfferExpiry(db, timeout=60.0)
+        offers.offer('a', 1)
+        assert offers.reject('a', 2) is False
+        assert offers.reject('a', 1) is True
+        assert offers.accept('a', 1) is False
+
+        # A rejection is released on the next turn, but is not an expiry.
+        assert await offers.turn() == []
+        assert offers.released == 1 and offers.expired == 0
+        assert await allocated(db, 1) == 0
+
+
+@pytest.mark.asyncio
+async def test_stop_releases_pending_offers(event_loop):
+    with Postgresql() as postgresql:
+        db = await DbAccess.create(postgresql.url(), event_loop, reset_tables=True)
+        await db.insert_parking_lot(ParkingLot(10, 'test_name', 0.0, Location(0.0, 1.0)))
+        await db.allocate_parking_lots([('a', 1), ('b', 1), ('c', 1)])
+
+        sessions = UserSessions()
+        sessions.add_user('a', RecordingSession())
+        offers = OfferExpiry(db, sessions, timeout=60.0)
+        offers.start()
+        offers.offer('a', 1)
+        offers.offer('b', 1)
+        offers.offer('c', 1)
+        offers.accept('c', 1)
+        offers.reject('b', 1)
+
+        # Only the accepted allocation outlives the process.
+        await offers.stop()
+        assert len(offers) == 0
+        assert offers.expired == 1 and offers.released == 2
+        assert await allocated(db, 1) == 1
+        assert sessions.get_user('a').session.messages == [{'_type': WebSocketMessageType.PARKING_DEALLOC, 'id': 1}]
+
+
+@pytest.mark.asyncio
+async def test_failed_release_retried_as_expiry(event_loop):
+    class FlakyDb:
+        def __init__(self):
+            self.fail = True
+
+        async def deallocate_parking_lots(self, allocations):
+            if self.fail:
+                self.fail = False
+                raise RuntimeError('database is down')
+            return list(allocations)
+
+    sessions = UserSessions()
+    sessions.add_user('a', RecordingSession())
+    offers = OfferExpiry(FlakyDb(), sessions, timeout=1.0, tick=0.5)
+    offers.offer('a', 1)
+    offers.offer('b', 2)
+    offers.reject('b', 2)
+
+    start = offers.wheel.start
+    with pytest.raises(RuntimeError):
+        await offers.turn(start + 1.0)
+    assert sessions.get_user('a').session.messages == []
+
+    # The retry still counts 'a' as expired, and tells them so; 'b' is only released.
+    assert await offers.turn(start + 1.5) == [('a', 1)]
+    assert offers.expired == 1 and offers.released == 2
+    assert sessions.get_user('a').session.messages == [{'_type': WebSocketMessageType.PARKING_DEALLOC, 'id': 1}]
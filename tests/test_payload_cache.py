@@ -0,0 +1,48 @@
+from parking.backend.db.lot_cache import LotCache, LotEntry
+from parking.backend.user_server.payload_cache import LotPayloadCache
+from parking.shared import ws_codec
+from parking.shared.location import Location
+from parking.shared.rest_models import ParkingLot
+from parking.shared.util import serialize_model
+from parking.shared.ws_models import ParkingAllocationMessage, ParkingLotUpdateMessage
+
+
+def serialized(msg):
+    return serialize_model(msg), ws_codec.encode_binary(msg)
+
+
+def test_payloads_match_serialized_messages():
+    cache = LotCache()
+    entry = cache.put(LotEntry(7, 'Central', 250, 51.5, -0.12, 2.5, 40, 3))
+    payloads = LotPayloadCache()
+    lot = ParkingLot(250, 'Central', 2.5, Location(51.5, -0.12), 7)
+    assert payloads.allocation(entry) == serialized(ParkingAllocationMessage(lot))
+    error = {'reason': 'test'}
+    assert payloads.allocation(entry, error) == serialized(ParkingAllocationMessage(lot, error))
+    assert payloads.update(entry) == serialized(ParkingLotUpdateMessage(7, 40, 2.5))
+
+
+def test_payloads_follow_lot_versions():
+    cache = LotCache()
+    entry = cache.put(LotEntry(7, 'Central', 250, 51.5, -0.12, 2.5, 40, 3))
+    payloads = LotPayloadCache()
+    first = payloads.allocation(entry)
+    assert payloads.allocation(entry) is first
+    assert payloads.stats() == {'size': 1, 'hits': 1, 'misses': 1, 'invalidations': 0}
+
+    cache.update(7, price=3.0)
+    assert '"price": 3.0' in payloads.allocation(entry)[0]
+    cache.update(7, num_available=12)
+    assert payloads.update(entry) == serialized(ParkingLotUpdateMessage(7, 12, 3.0))
+
+    payloads.invalidate(7)
+    assert payloads.lots == {}
+
+
+def test_unversioned_lots_not_kept():
+    payloads = LotPayloadCache()
+    entry = LotEntry(7, 'Central', 250, 51.5, -0.12, 2.5, 40, 3)
+    payloads.allocation(entry)
+    entry.price = 3.0
+    assert '"price": 3.0' in payloads.allocation(entry)[0]
+    assert payloads.lots == {}
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import threading
+import time
+
+import pytest
+import tornado.web
+from parking.backend.admin_server.admin import ProfileHandler
+from parking.backend.profiling import LoopLagMonitor, SamplingProfiler
+
+
+@pytest.mark.asyncio
+async def test_monitor_reports_blocking(caplog):
+    monitor = LoopLagMonitor(interval=0.01, threshold=0.05)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    with caplog.at_level(logging.WARNING, logger='backend'):
+        time.sleep(0.3)
+        await asyncio.sleep(0.05)
+    monitor.stop()
+
+    assert monitor.blocked == 1
+    assert monitor.max_lag >= 0.2
+    assert 'test_monitor_reports_blocking' in caplog.text
+
+
+def busy(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampling_profiler():
+    stop = threading.Event()
+    thread = threading.Thread(target=busy, args=(stop,))
+    thread.start()
+    try:
+        profiler = SamplingProfiler(thread.ident, interval=0.001)
+        collapsed = profiler.run(0.1)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert profiler.samples > 0
+    lines = collapsed.splitlines()
+    assert sum(int(line.rsplit(' ', 1)[1]) for line in lines) == profiler.samples
+    assert all('busy (' in line for line in lines)
+
+
+@pytest.fixture
+def app():
+    return tornado.web.Application([(r'/admin/profile', ProfileHandler)])
+
+
+@pytest.fixture
+def io_loop():
+    return tornado.ioloop.IOLoop.current()
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_profile_endpoint(http_client, base_url):
+    response = await http_client.fetch(base_url + '/admin/profile?seconds=0.1&interval=1')
+    assert response.body
+    assert b'start (' in response.body
+
+    # Intervals below a millisecond are raised to one.
+    response = await http_client.fetch(base_url + '/admin/profile?seconds=0.1&interval=0.000001')
+    assert b'start (' in response.body
+
+    for query in ('seconds=1000', 'interval=0', 'interval=nan', 'interval=inf', 'seconds=1&interval=2000'):
+        response = await http_client.fetch(base_url + '/admin/profile?' + query, raise_error=False)
+        assert response.code == 400
@@ -0,0 +1,102 @@
+import io
+import json
+from asyncio import AbstractEventLoop
+
+import pytest
+import testing.postgresql
+import tornado.ioloop
+
+from parking.backend.__main__ import build_parser
+from parking.backend.db import tools
+from parking.backend.db.dbaccess import DbAccess
+from parking.backend.db.provision import parse_lot, read_rows, validate_batches
+from parking.shared.location import Location
+from parking.shared.rest_models import ParkingLot
+from parking.shared.util import serialize_model
+
+CSV = 'name,capacity,price,lat,long\nfirst,10,1.5,51.5,-0.1\nsecond,20,0,51.6,-0.2\n'
+
+
+@pytest.fixture(scope="module")
+def postgresql():
+    postgresql_con = testing.postgresql.Postgresql()
+    yield postgresql_con
+    postgresql_con.stop()
+
+
+@pytest.fixture
+def dba(postgresql):
+    loop: AbstractEventLoop = tornado.ioloop.IOLoop.current().asyncio_loop
+    dba = tornado.ioloop.IOLoop.current().run_sync(
+        lambda: DbAccess.create(postgresql.url(), loop=loop, reset_tables=True))
+    yield dba
+    tornado.ioloop.IOLoop.current().run_sync(dba.close)
+
+
+@pytest.fixture
+def io_loop():
+    return tornado.ioloop.IOLoop.current()
+
+
+def test_read_and_parse_csv():
+    rows = list(read_rows(io.StringIO(CSV), 'csv'))
+    assert [line_num for line_num, _ in rows] == [2, 3]
+    assert parse_lot(rows[0][1], 'csv') == ParkingLot(10, 'first', 1.5, Location(51.5, -0.1))
+
+
+def test_parse_ndjson_like_rest_api():
+    lot = ParkingLot(10, 'first', 1.5, Location(51.5, -0.1), id=7)
+    assert parse_lot(serialize_model(lot), 'ndjson') == ParkingLot(10, 'first', 1.5, Location(51.5, -0.1))
+    for line in ('{"name": "x"}', '[1, 2]', 'not json', json.dumps({'capacity': 0, 'name': 'x', 'price': 1.0,
+                                                                    'location': {'latitude': 0.0, 'longitude': 0.0}})):
+        with pytest.raises((TypeError, ValueError)):
+            parse_lot(line, 'ndjson')
+
+
+def test_validate_batches():
+    text = CSV + 'third,-1,1.0,0,0\nfourth,5,1.0,0,0\n'
+    with pytest.raises(ValueError, match='line 4'):
+        list(validate_batches(read_rows(io.StringIO(text), 'csv'), 'csv', batch_size=2))
+
+    rejected = []
+    batches = list(validate_batches(read_rows(io.StringIO(text), 'csv'), 'csv', batch_size=2, rejected=rejected))
+    assert [[lot.name for lot in batch] for batch in batches] == [['first', 'second'], ['fourth']]
+    assert [line_num for line_num, _ in rejected] == [4]
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_insert_parking_lots(dba):
+    await dba.insert_parking_lot(ParkingLot(1, 'before', 1.0, Location(0.0, 0.0)))
+
+    lots = [ParkingLot(i + 1, 'lot{}'.format(i), 1.0, Location(0.0, float(i))) for i in range(5)]
+    park_ids = await dba.insert_parking_lots([lots[:2], [], lots[2:]])
+    assert park_ids == [2, 3, 4, 5, 6]
+    assert await dba.insert_parking_lot(ParkingLot(1, 'after', 1.0, Location(0.0, 0.0))) == 7
+
+    entries = {entry.id: entry for entry in await dba.get_parking_lots_by_id(park_ids)}
+    assert [entries[park_id].name for park_id in park_ids] == ['lot0', 'lot1', 'lot2', 'lot3', 'lot4']
+    assert entries[6].capacity == entries[6].num_available == 5
+    assert dba.cache.get(6) is not None
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_invalid_import_loads_nothing(dba):
+    with pytest.raises(ValueError, match='line 4'):
+        await tools.import_lots(dba, io.StringIO(CSV + 'bad,x,1.0,0,0\n'), 'csv', batch_size=1)
+    assert await dba.get_parking_lots() == []
+    assert len(dba.cache) == 0
+
+
+def test_import_command(postgresql, dba, tmp_path):
+    path = tmp_path / 'city.csv'
+    path.write_text(CSV + 'bad,x,1.0,0,0\n' + ''.join('lot{0},{0},1.0,51.5,-0.1\n'.format(i) for i in range(1, 11)))
+    ids = tmp_path / 'ids.txt'
+    args = ['--db', postgresql.url(), 'import', str(path), '--batch', '4', '--ids', str(ids)]
+    with pytest.raises(SystemExit):
+        tools.run_command(build_parser().parse_args(args))
+    assert not ids.exists()
+
+    tools.run_command(build_parser().parse_args(args + ['--skip-invalid']))
+    assert ids.read_text().split() == [str(park_id) for park_id in range(1, 13)]
+    lots = tornado.ioloop.IOLoop.current().run_sync(lambda: dba.get_parking_lots_by_id([1, 12]))
+    assert sorted((lot.id, lot.name) for lot in lots) == [(1, 'first'), (12, 'lot10')]
@@ -0,0 +1,120 @@
+import pytest
+import tornado.gen
+import tornado.web
+import tornado.websocket
+
+from parking.backend.user_server.mailbox import LocationMailbox
+from parking.backend.user_server.rate_limit import RateLimiter, TokenBucket
+from parking.backend.user_server.wsserver import UserSessions, UserWSHandler
+from parking.shared.location import Location
+from parking.shared.util import serialize_model
+from parking.shared.ws_models import LocationUpdateMessage, ParkingRejectionMessage, WebSocketMessageType
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2.0, burst=3.0, tokens=3.0, updated=0.0)
+    assert [bucket.take(0.0) for _ in range(4)] == [True, True, True, False]
+    assert bucket.take(0.5) and not bucket.take(0.5)
+    # Refills up to the burst only.
+    assert [bucket.take(100.0) for _ in range(4)] == [True, True, True, False]
+
+
+def test_rate_limiter():
+    limiter = RateLimiter({WebSocketMessageType.LOCATION_UPDATE: (1.0, 1.0)}, now=0.0)
+    assert limiter.allow(WebSocketMessageType.LOCATION_UPDATE, 0.0)
+    assert not limiter.allow(WebSocketMessageType.LOCATION_UPDATE, 0.5)
+    assert limiter.allow(WebSocketMessageType.LOCATION_UPDATE, 1.5)
+    # Types without a limit are always allowed.
+    assert all(limiter.allow(WebSocketMessageType.PARKING_REQUEST, 0.0) for _ in range(100))
+
+
+class NullSession:
+    pass
+
+
+def test_mailbox_latest_wins():
+    sessions = UserSessions()
+    for user_id in ('a', 'b'):
+        sessions.add_user(user_id, NullSession())
+    mailbox = LocationMailbox(sessions)
+    for i in range(5):
+        mailbox.put('a', Location(float(i), 0.0))
+    mailbox.put('b', Location(9.0, 9.0))
+    mailbox.put('gone', Location(1.0, 1.0))
+    assert sessions.get_user('a').location is None
+
+    assert mailbox.flush() == 2
+    assert sessions.get_user('a').location == Location(4.0, 0.0)
+    assert sessions.get_user('b').location == Location(9.0, 9.0)
+    assert mailbox.stats() == {'pending': 0, 'received': 7, 'applied': 2}
+    assert mailbox.flush() == 0
+
+
+@pytest.fixture
+def user_sessions():
+    return UserSessions()
+
+
+@pytest.fixture
+def mailbox(user_sessions):
+    return LocationMailbox(user_sessions)
+
+
+class RecordingEngine:
+    def __init__(self):
+        self.rejections = []
+
+    def reject(self, user_id, park_id):
+        self.rejections.append((user_id, park_id))
+
+
+@pytest.fixture
+def engine():
+    return RecordingEngine()
+
+
+@pytest.fixture
+def app(user_sessions, mailbox, engine):
+    limits = {WebSocketMessageType.LOCATION_UPDATE: (1.0, 3.0), WebSocketMessageType.PARKING_REJECTION: (1.0, 2.0)}
+    return tornado.web.Application([(r'/ws/(.*)', UserWSHandler, {'user_sessions': user_sessions, 'engine': engine,
+                                                                  'mailbox': mailbox, 'rate_limits': limits})])
+
+
+@pytest.fixture
+def io_loop():
+    return tornado.ioloop.IOLoop.current()
+
+
+async def connect(base_url, user_sessions):
+    conn = await tornado.websocket.websocket_connect(base_url.replace('http', 'ws') + '/ws/a')
+    while 'a' not in user_sessions.users:
+        await tornado.gen.sleep(0.01)
+    return conn
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_location_burst(http_server, base_url, user_sessions, mailbox):
+    conn = await connect(base_url, user_sessions)
+    for i in range(10):
+        await conn.write_message(serialize_model(LocationUpdateMessage(Location(float(i), 0.0))))
+    while mailbox.received < 3:
+        await tornado.gen.sleep(0.01)
+    await tornado.gen.sleep(0.05)
+
+    # Past the burst of 3 updates are dropped before being decoded; the rest collapse into one.
+    assert mailbox.received == 3
+    assert mailbox.flush() == 1
+    assert user_sessions.get_user('a').location == Location(2.0, 0.0)
+    assert conn.close_code is None
+    conn.close()
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_control_flood_closes(http_server, base_url, user_sessions, engine):
+    conn = await connect(base_url, user_sessions)
+    for _ in range(3):
+        await conn.write_message(serialize_model(ParkingRejectionMessage(1)))
+    assert await conn.read_message() is None
+    assert conn.close_code == 1008
+    # The messages within the limit were all handled, and the one over it was refused, not dropped.
+    assert engine.rejections == [('a', 1), ('a', 1)]
@@ -2,7 +2,8 @@ import attr
 import pytest
 from parking.shared.location import Location
 from parking.shared.rest_models import (ParkingLot, ParkingLotCreationResponse,
-                                        ParkingLotAvailableMessage, ParkingLotPriceMessage)
+                                        ParkingLotAvailableMessage, ParkingLotPriceMessage,
+                                        ParkingLotAvailableUpdate, ParkingLotBulkUpdateMessage)
 
 loc = Location(0.0, 1.0)
 
@@ -57,3 +58,24 @@ def test_space_available_neg():
 def test_price_available_neg():
     with pytest.raises(ValueError):
         ParkingLotPriceMessage(-100.0)
+
+
+def test_bulk_update_deser():
+    msg = ParkingLotBulkUpdateMessage(**{'available': [{'id': 1, 'available': 5}], 'price': [{'id': 2, 'price': 1.0}]})
+    assert msg.available == [ParkingLotAvailableUpdate(1, 5)]
+    assert msg.price[0].price == 1.0
+
+
+def test_bulk_update_defaults_empty():
+    msg = ParkingLotBulkUpdateMessage()
+    assert msg.available == [] and msg.price == []
+
+
+def test_bulk_update_invalid_item():
+    with pytest.raises(ValueError):
+        ParkingLotBulkUpdateMessage(available=[{'id': 1, 'available': -5}])
+
+
+def test_bulk_update_not_a_list():
+    with pytest.raises(TypeError):
+        ParkingLotBulkUpdateMessage(available={'id': 1, 'available': 5})
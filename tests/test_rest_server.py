@@ -4,8 +4,13 @@ import pytest
 import tornado.web
 import testing.postgresql
 from parking.backend.sensor_server.rest_server import (IndividualLotDeleteHandler, IndividualLotAvailableHandler,
-                                                       IndividualLotPriceHandler, ParkingLotsCreationHandler)
+                                                       IndividualLotPriceHandler, ParkingLotsCreationHandler,
+                                                       ParkingLotsBulkUpdateHandler)
 from parking.backend.db.dbaccess import DbAccess
+from parking.backend.db.lot_cache import LotEntry
+from parking.backend.engine.lot_index import LotIndex
+from parking.backend.sensor_server.lot_search import LotSearch
+from parking.backend.user_server.payload_cache import LotPayloadCache
 from parking.shared.rest_models import ParkingLot, ParkingLotCreationResponse, ParkingLotPriceMessage
 from parking.shared.util import serialize_model
 from parking.shared.location import Location
@@ -22,15 +27,43 @@ def postgresql():
 
 
 @pytest.fixture
-def app(postgresql):
+def lot_index():
+    return LotIndex()
+
+
+class RecordingNotifier:
+    def __init__(self):
+        self.lots = []
+
+    def notify(self, lot):
+        self.lots.append(lot)
+
+
+@pytest.fixture
+def notifier():
+    return RecordingNotifier()
+
+
+@pytest.fixture
+def payloads():
+    return LotPayloadCache()
+
+
+@pytest.fixture
+def app(postgresql, lot_index, notifier, payloads):
     loop: AbstractEventLoop = tornado.ioloop.IOLoop.current().asyncio_loop
     dba: DbAccess = tornado.ioloop.IOLoop.current().run_sync(
         lambda: DbAccess.create(postgresql.url(), loop=loop, init_tables=True, reset_tables=True))
-    application = tornado.web.Application([(r'/spaces', ParkingLotsCreationHandler, {'dba': dba}),
-                                           (r'/spaces/([0-9])+', IndividualLotDeleteHandler, {'dba': dba}),
-                                           (r'/spaces/([0-9])+/available', IndividualLotAvailableHandler, {'dba': dba}),
-                                           (r'/spaces/([0-9])+/price', IndividualLotPriceHandler, {'dba': dba})])
-    return application
+    lots = {'dba': dba, 'lot_index': lot_index, 'payloads': payloads}
+    updates = {'dba': dba, 'notifier': notifier, 'payloads': payloads}
+    search = {'dba': dba, 'lot_index': lot_index, 'lot_search': LotSearch(dba, lot_index)}
+    application = tornado.web.Application([(r'/spaces', ParkingLotsCreationHandler, search),
+                                           (r'/spaces/bulk', ParkingLotsBulkUpdateHandler, updates),
+                                           (r'/spaces/([0-9]+)', IndividualLotDeleteHandler, lots),
+                                           (r'/spaces/([0-9]+)/available', IndividualLotAvailableHandler, updates),
+                                           (r'/spaces/([0-9]+)/price', IndividualLotPriceHandler, updates)])
+    yield application
+    tornado.ioloop.IOLoop.current().run_sync(dba.close)
 
 
 @pytest.fixture
@@ -56,6 +89,17 @@ async def test_delete_parking_lot(http_client, base_url):
     assert response.code == 200
 
 
+@pytest.mark.gen_test(run_sync=False)
+async def test_lot_index_follows_create_and_delete(http_client, base_url, lot_index):
+    lot = ParkingLot(100, 'test', 1.0, Location(0.0, 1.0))
+    response = await http_client.fetch(base_url + '/spaces', method='POST', headers=HEADERS, body=serialize_model(lot))
+    park_id = ParkingLotCreationResponse(**json.loads(response.body)).id
+    assert lot_index.nearest(Location(0.0, 1.0)) == [(park_id, 0.0)]
+
+    await http_client.fetch(base_url + '/spaces/{}'.format(park_id), method='DELETE')
+    assert park_id not in lot_index
+
+
 @pytest.mark.gen_test(run_sync=False)
 async def test_invalid_content_type(http_client, base_url):
     response = await http_client.fetch(base_url + '/spaces', method='POST', body='not json', raise_error=False)
@@ -78,3 +122,104 @@ async def test_update_parking_lot_price(http_client, base_url):
 async def test_delete_invalid_parking_lot_id(http_client, base_url):
     response = await http_client.fetch(base_url + '/spaces/1234', method='DELETE', raise_error=False)
     assert response.code == 404
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_bulk_update(http_client, base_url):
+    lot = ParkingLot(100, 'test', 1.0, Location(0.0, 1.0))
+    for _ in range(2):
+        await http_client.fetch(base_url + '/spaces', method='POST', headers=HEADERS, body=serialize_model(lot))
+
+    body = json.dumps({'available': [{'id': 1, 'available': 5}, {'id': 7, 'available': 5}],
+                       'price': [{'id': 2, 'price': 3.0}]})
+    response = await http_client.fetch(base_url + '/spaces/bulk', method='POST', headers=HEADERS, body=body)
+    assert json.loads(response.body) == {'updated': [1, 2], 'unknown': [7]}
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_bulk_update_invalid(http_client, base_url):
+    body = json.dumps({'available': [{'id': 1, 'available': -5}]})
+    response = await http_client.fetch(base_url + '/spaces/bulk', method='POST', headers=HEADERS, body=body,
+                                       raise_error=False)
+    assert response.code == 400
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_price_update_notifies(http_client, base_url, notifier):
+    lot = ParkingLot(100, 'test', 1.0, Location(0.0, 1.0))
+    await http_client.fetch(base_url + '/spaces', method='POST', headers=HEADERS, body=serialize_model(lot))
+
+    body = serialize_model(ParkingLotPriceMessage(2.0))
+    await http_client.fetch(base_url + '/spaces/1/price', method='POST', headers=HEADERS, body=body)
+    assert [(lot.id, lot.price) for lot in notifier.lots] == [(1, 2.0)]
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_changes_invalidate_payloads(http_client, base_url, payloads):
+    lot = ParkingLot(100, 'test', 1.0, Location(0.0, 1.0))
+    await http_client.fetch(base_url + '/spaces', method='POST', headers=HEADERS, body=serialize_model(lot))
+    payloads.allocation(LotEntry(1, 'test', 100, 0.0, 1.0, 1.0, 100, 0, version=1))
+    assert 1 in payloads.lots
+
+    body = serialize_model(ParkingLotPriceMessage(2.0))
+    await http_client.fetch(base_url + '/spaces/1/price', method='POST', headers=HEADERS, body=body)
+    assert 1 not in payloads.lots
+
+    payloads.allocation(LotEntry(1, 'test', 100, 0.0, 1.0, 2.0, 100, 0, version=2))
+    await http_client.fetch(base_url + '/spaces/1', method='DELETE')
+    assert payloads.lots == {}
+    assert payloads.invalidations == 2
+
+
+async def create_lots(http_client, base_url, lots):
+    for name, location in lots:
+        lot = ParkingLot(10, name, 1.0, location)
+        await http_client.fetch(base_url + '/spaces', method='POST', headers=HEADERS, body=serialize_model(lot))
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_search_parking_lots(http_client, base_url):
+    await create_lots(http_client, base_url, [('near', Location(0.001, 0.0)), ('nearest', Location(0.0, 0.0)),
+                                              ('far', Location(0.1, 0.0))])
+
+    response = await http_client.fetch(base_url + '/spaces?lat=0.0&long=0.0&radius=500')
+    lots = json.loads(response.body)['lots']
+    assert [lot['name'] for lot in lots] == ['nearest', 'near']
+    assert lots[0] == {'id': 2, 'name': 'nearest', 'capacity': 10, 'price': 1.0,
+                       'location': {'latitude': 0.0, 'longitude': 0.0}, 'num_available': 10, 'num_allocated': 0}
+
+    response = await http_client.fetch(base_url + '/spaces?lat=0.0&long=0.0&radius=50000&limit=1')
+    assert [lot['name'] for lot in json.loads(response.body)['lots']] == ['nearest']
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_search_not_modified(http_client, base_url):
+    await create_lots(http_client, base_url, [('a', Location(0.0, 0.0)), ('b', Location(1.0, 1.0))])
+    url = base_url + '/spaces?lat=0.0&long=0.0&radius=1000'
+
+    response = await http_client.fetch(url)
+    etag = response.headers['Etag']
+    response = await http_client.fetch(url, headers={'If-None-Match': etag}, raise_error=False)
+    assert response.code == 304
+
+    # A change to a lot outside the area leaves the search unchanged.
+    await http_client.fetch(base_url + '/spaces/2/available', method='POST', headers=HEADERS,
+                            body=json.dumps({'available': 3}))
+    response = await http_client.fetch(url, headers={'If-None-Match': etag}, raise_error=False)
+    assert response.code == 304
+
+    await http_client.fetch(base_url + '/spaces/1/available', method='POST', headers=HEADERS,
+                            body=json.dumps({'available': 3}))
+    response = await http_client.fetch(url, headers={'If-None-Match': etag}, raise_error=False)
+    assert response.code == 200
+    assert response.headers['Etag'] != etag
+    assert json.loads(response.body)['lots'][0]['num_available'] == 3
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_search_invalid_arguments(http_client, base_url):
+    for query in ('', '?lat=0.0', '?lat=x&long=0.0', '?lat=0.0&long=0.0&radius=0', '?lat=0.0&long=0.0&limit=1.5',
+                  '?lat=91.0&long=0.0', '?lat=0.0&long=0.0&limit=inf', '?lat=0.0&long=0.0&limit=nan',
+                  '?lat=0.0&long=0.0&limit=0', '?lat=nan&long=0.0', '?lat=0.0&long=0.0&radius=nan'):
+        response = await http_client.fetch(base_url + '/spaces' + query, raise_error=False)
+        assert response.code == 400
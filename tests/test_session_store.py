@@ -0,0 +1,73 @@
+import pytest
+from parking.backend.user_server.session_store import SessionStore
+from parking.backend.user_server.wsserver import UserSessions
+from parking.shared.location import Location, haversine
+
+
+def test_allocate_and_recycle_slots():
+    store = SessionStore(initial_capacity=2)
+    a, b = store.allocate('a'), store.allocate('b')
+    assert a != b and len(store) == 2
+
+    store.release(a)
+    assert len(store) == 1
+    assert store.allocate('c') == a
+
+
+def test_grow():
+    store = SessionStore(initial_capacity=2)
+    slots = [store.allocate(str(i)) for i in range(5)]
+    assert sorted(slots) == list(range(5))
+    assert store.capacity == 8
+    store.set_location(slots[4], Location(1.0, 2.0))
+    assert store.get_location(slots[4]) == Location(1.0, 2.0)
+
+
+def test_location_cleared_on_release():
+    store = SessionStore()
+    slot = store.allocate('a')
+    assert store.get_location(slot) is None
+    store.set_location(slot, Location(1.0, 2.0))
+    store.release(slot)
+    assert store.get_location(store.allocate('b')) is None
+
+
+def test_invalid_capacity():
+    with pytest.raises(ValueError):
+        SessionStore(initial_capacity=0)
+
+
+def test_within():
+    store = SessionStore()
+    points = {'near': Location(0.0, 0.001), 'nearer': Location(0.0, 0.0005), 'far': Location(0.0, 1.0),
+              'north': Location(1.0, 0.0)}
+    for user_id, location in points.items():
+        store.set_location(store.allocate(user_id), location)
+    store.allocate('unlocated')
+
+    hits = store.within(Location(0.0, 0.0), 200.0)
+    assert [user_id for user_id, _ in hits] == ['nearer', 'near']
+    assert hits[1][1] == pytest.approx(haversine(0.0, 0.0, 0.0, 0.001))
+    assert store.within(Location(5.0, 5.0), 10.0) == []
+
+
+def test_stale():
+    store = SessionStore()
+    store.set_location(store.allocate('old'), Location(0.0, 0.0), timestamp=100.0)
+    store.set_location(store.allocate('new'), Location(0.0, 0.0), timestamp=200.0)
+    assert store.stale(50.0, now=210.0) == ['old']
+
+
+def test_user_sessions_use_store():
+    sessions = UserSessions()
+    sessions.add_user('a', None)
+    sessions.update_user_location('a', Location(0.0, 0.0))
+    user = sessions.get_user('a')
+    assert user.location == Location(0.0, 0.0)
+    assert not hasattr(user, '__dict__')
+
+    user.location = Location(1.0, 1.0)
+    assert sessions.users_within(Location(1.0, 1.0), 1.0) == [('a', 0.0)]
+
+    sessions.remove_user('a')
+    assert len(sessions.store) == 0
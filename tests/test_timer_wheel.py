@@ -0,0 +1,60 @@
+import pytest
+
+from parking.backend.engine.timer_wheel import TimerWheel
+
+
+def test_schedule_and_advance():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.schedule('a', 2.0, 1)
+    wheel.schedule('b', 5.0, 2)
+    assert len(wheel) == 2 and 'a' in wheel
+    assert wheel.get('b') == 2
+
+    assert wheel.advance(1.5) == []
+    assert wheel.advance(2.0) == [('a', 1)]
+    assert wheel.advance(10.0) == [('b', 2)]
+    assert len(wheel) == 0
+
+
+def test_schedule_replaces_and_cancel():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.schedule('a', 2.0, 1)
+    wheel.schedule('a', 4.0, 3)
+    assert wheel.advance(3.0) == []
+    assert wheel.cancel('a') == 3
+    assert wheel.cancel('a') is None
+    assert wheel.advance(10.0) == []
+
+
+def test_clear():
+    wheel = TimerWheel(tick=1.0, slots=4)
+    wheel.schedule('a', 2.0, 1)
+    wheel.schedule('b', 9.0, 2)
+    assert sorted(wheel.clear()) == [('a', 1), ('b', 2)]
+    assert len(wheel) == 0 and 'a' not in wheel
+    assert wheel.advance(10.0) == []
+
+
+def test_timeout_beyond_one_turn():
+    wheel = TimerWheel(tick=1.0, slots=4)
+    wheel.schedule('far', 10.0)
+    wheel.schedule('near', 2.0)
+    # 'far' shares a slot with ticks 2 and 6 but is only due at tick 10.
+    assert wheel.advance(6.0) == [('near', None)]
+    assert wheel.advance(9.0) == []
+    assert wheel.advance(10.0) == [('far', None)]
+
+
+def test_delay_measured_from_last_advance():
+    wheel = TimerWheel(tick=0.5, slots=16, start=100.0)
+    wheel.advance(103.0)
+    wheel.schedule('a', 1.0)
+    assert wheel.advance(103.9) == []
+    assert wheel.advance(104.0) == [('a', None)]
+
+
+def test_invalid_configuration():
+    with pytest.raises(ValueError):
+        TimerWheel(tick=0.0)
+    with pytest.raises(ValueError):
+        TimerWheel(slots=0)
@@ -0,0 +1,50 @@
+import pytest
+
+from parking.backend.db.write_behind import AvailabilityBuffer
+
+
+class RecordingFlush:
+    def __init__(self):
+        self.batches = []
+
+    async def __call__(self, updates):
+        batch = list(updates)
+        self.batches.append(batch)
+        return [park_id for park_id, _ in batch]
+
+
+@pytest.mark.asyncio
+async def test_coalesces_updates():
+    flush = RecordingFlush()
+    buffer = AvailabilityBuffer(flush, interval=60)
+    buffer.add(1, 10)
+    buffer.add(1, 5)
+    buffer.add(2, 3)
+    assert await buffer.flush() == 2
+    assert sorted(flush.batches[0]) == [(1, 5), (2, 3)]
+    assert buffer.stats() == {'pending': 0, 'received': 3, 'written': 2, 'coalesced': 1}
+    assert await buffer.flush() == 0
+
+
+@pytest.mark.asyncio
+async def test_stop_flushes_pending():
+    flush = RecordingFlush()
+    buffer = AvailabilityBuffer(flush, interval=60)
+    buffer.start()
+    buffer.add(1, 10)
+    await buffer.stop()
+    assert flush.batches == [[(1, 10)]]
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_newer_values():
+    async def failing_flush(updates):
+        buffer.add(1, 7)
+        raise RuntimeError('database unavailable')
+
+    buffer = AvailabilityBuffer(failing_flush, interval=60)
+    buffer.add(1, 10)
+    buffer.add(2, 3)
+    with pytest.raises(RuntimeError):
+        await buffer.flush()
+    assert buffer.pending == {1: 7, 2: 3}
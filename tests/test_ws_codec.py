@@ -0,0 +1,121 @@
+import pytest
+import tornado.gen
+import tornado.web
+import tornado.websocket
+from parking.backend.user_server.wsserver import UserSessions, UserWSHandler
+from parking.shared import ws_codec
+from parking.shared.location import Location
+from parking.shared.rest_models import ParkingLot
+from parking.shared.util import serialize_model
+from parking.shared.ws_models import (LocationUpdateMessage, ParkingAcceptanceMessage, ParkingAllocationMessage,
+                                      ParkingCancellationMessage, ParkingDeallocationMessage, ParkingLotUpdateMessage,
+                                      ParkingRejectionMessage, ParkingRequestMessage)
+
+MESSAGES = [
+    LocationUpdateMessage(Location(51.5, -0.1)),
+    ParkingRequestMessage(Location(51.5, -0.1)),
+    ParkingRequestMessage(Location(51.5, -0.1), {'max_price': 3.5}),
+    ParkingAllocationMessage(ParkingLot(100, 'Lot ä', 1.5, Location(51.5, -0.1), 7)),
+    ParkingAllocationMessage(ParkingLot(100, '', 0.0, Location(0.0, 0.0), 1), {'reason': 'full'}),
+    ParkingAllocationMessage(None, {'reason': 'no_lot_available'}),
+    ParkingAcceptanceMessage(3),
+    ParkingRejectionMessage(4),
+    ParkingDeallocationMessage(5),
+    ParkingCancellationMessage(6, 2),
+    ParkingLotUpdateMessage(7, 12, 2.5),
+]
+
+
+@pytest.mark.parametrize('msg', MESSAGES)
+def test_binary_round_trip(msg):
+    data = ws_codec.encode_binary(msg)
+    assert ws_codec.decode(data) == msg
+
+
+@pytest.mark.parametrize('msg', MESSAGES)
+def test_binary_is_smaller(msg):
+    assert len(ws_codec.encode_binary(msg)) < len(serialize_model(msg).encode())
+
+
+def test_decode_json():
+    msg = LocationUpdateMessage(Location(0.0, 1.0))
+    assert ws_codec.decode(serialize_model(msg)) == msg
+
+
+@pytest.mark.parametrize('data', [b'', b'\x63', b'\x01\x00', ws_codec.encode_binary(MESSAGES[3])[:-3]])
+def test_decode_binary_invalid(data):
+    with pytest.raises(ValueError):
+        ws_codec.decode_binary(data)
+
+
+@pytest.mark.parametrize('msg', [
+    ParkingAcceptanceMessage(2 ** 32),
+    ParkingLotUpdateMessage(7, 2 ** 32, 2.5),
+    ParkingCancellationMessage(6, 2 ** 31),
+    ParkingAllocationMessage(ParkingLot(100, 'lot', 1.5, Location(0.0, 0.0), 2 ** 31)),
+    ParkingAllocationMessage(ParkingLot(2 ** 32, 'lot', 1.5, Location(0.0, 0.0), 1)),
+    ParkingAllocationMessage(ParkingLot(100, 'x' * 65536, 1.5, Location(0.0, 0.0), 1)),
+])
+def test_encode_binary_out_of_range(msg):
+    with pytest.raises(ValueError):
+        ws_codec.encode_binary(msg)
+
+
+@pytest.fixture
+def user_sessions():
+    return UserSessions()
+
+
+@pytest.fixture
+def app(user_sessions):
+    return tornado.web.Application([(r'/ws/(.*)', UserWSHandler, {'user_sessions': user_sessions})])
+
+
+@pytest.fixture
+def io_loop():
+    return tornado.ioloop.IOLoop.current()
+
+
+async def send_and_echo(base_url, user_sessions, subprotocols):
+    url = base_url.replace('http', 'ws') + '/ws/a'
+    conn = await tornado.websocket.websocket_connect(url, subprotocols=subprotocols)
+    msg = LocationUpdateMessage(Location(51.5, -0.1))
+    subprotocol = conn.selected_subprotocol
+    binary = subprotocol == ws_codec.BINARY_SUBPROTOCOL
+    await conn.write_message(ws_codec.encode(msg, binary), binary=binary)
+    user = user_sessions.get_user('a')
+    while user.location is None:
+        await tornado.gen.sleep(0.01)
+    assert user.location == msg.location
+
+    user.session.send_message(ParkingAcceptanceMessage(1))
+    reply = await conn.read_message()
+    conn.close()
+    return subprotocol, reply
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_negotiate_binary(http_server, base_url, user_sessions):
+    subprotocol, reply = await send_and_echo(base_url, user_sessions, [ws_codec.BINARY_SUBPROTOCOL])
+    assert subprotocol == ws_codec.BINARY_SUBPROTOCOL
+    assert isinstance(reply, bytes)
+    assert ws_codec.decode(reply) == ParkingAcceptanceMessage(1)
+
+
+@pytest.mark.gen_test(run_sync=False)
+async def test_json_fallback(http_server, base_url, user_sessions):
+    subprotocol, reply = await send_and_echo(base_url, user_sessions, None)
+    assert subprotocol is None
+    assert isinstance(reply, str)
+    assert ws_codec.decode(reply) == ParkingAcceptanceMessage(1)
+
+
+@pytest.mark.parametrize('msg', MESSAGES)
+def test_peek_type(msg):
+    assert ws_codec.peek_type(serialize_model(msg)) == msg._type
+    assert ws_codec.peek_type(ws_codec.encode_binary(msg)) == msg._type
+
+
+def test_peek_type_missing():
+    assert ws_codec.peek_type('{"location": {}}') is None
+    assert ws_codec.peek_type(b'') is None
@@ -15,6 +15,10 @@ def test_deserialize_invalid_type_ws_msg():
     with pytest.raises(ValueError):
         deserialize_ws_message(data)
 
+    data = json.dumps({'_type': True, 'location': {'latitude': 0.0, 'longitude': 1.0}})
+    with pytest.raises(ValueError):
+        deserialize_ws_message(data)
+
 
 def test_message_type():
     msg = LocationUpdateMessage(Location(0.0, 1.0))